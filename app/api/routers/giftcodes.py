@@ -2,6 +2,7 @@ from fastapi import APIRouter, HTTPException, Depends
 from app.api.dependencies import require_ready
 from app.db.supabase import get_giftcodes, add_giftcode, deactivate_giftcode
 from app.utils.fetch_gc_async import fetch_latest_codes_async
+from app.services.code_runs import code_runs
 
 router = APIRouter(prefix="/giftcodes", tags=["giftcodes"], dependencies=[Depends(require_ready)])
 
@@ -13,6 +14,7 @@ async def list_giftcodes():
 async def fetch_giftcodes():
     fetched = await fetch_latest_codes_async("whiteoutsurvival", "gift code")
     new_codes = [c for c in (add_giftcode(code) for code in fetched) if c]
+    code_runs.submit(new_codes)
     return {"message": "Gift codes fetched.", "new_codes": new_codes}
 
 @router.post("/deactivate")
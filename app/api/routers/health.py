@@ -1,5 +1,6 @@
 from fastapi import APIRouter
 from app.core.lifespan import is_ready
+from app.core.http import http_stats
 
 router = APIRouter(tags=["health"])
 
@@ -13,4 +14,8 @@ async def healthz():
 
 @router.get("/health")
 async def health():
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok"}
+
+@router.get("/health/http")
+async def health_http():
+    return http_stats()
@@ -0,0 +1,10 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app.utils.metrics import render
+
+router = APIRouter(tags=["metrics"])
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Counters and histograms in the Prometheus text exposition format."""
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
@@ -1,8 +1,11 @@
+import json
 from fastapi import APIRouter, HTTPException, Depends, Header
+from fastapi.responses import StreamingResponse
 from app.api.dependencies import require_ready
-from app.schemas.players import Player
+from app.schemas.players import Player, PlayerBulk
 from app.db.supabase import get_players, add_player, remove_player, update_player
-from app.utils.wos_api import PlayerAPI
+from app.services.player_api import get_player_api
+from app.services.player_bulk import onboard_players
 from app.core.config import settings
 
 router = APIRouter(prefix="/players", tags=["players"], dependencies=[Depends(require_ready)])
@@ -13,27 +16,39 @@ async def list_players():
 
 @router.post("/create")
 async def create_player(player: Player):
-    api = None
-    try:
-        api = PlayerAPI()
-        login = await api.login_player(player.player_id, settings.SALT)
-        if not login:
-            raise HTTPException(400, f"Adding '{player.player_id}' failed.")
-        add_player(login["token"])
-        return {"message": f"Player '{player.player_id}' added successfully."}
-    finally:
-        if api: await api.close_session()
+    login = await get_player_api().login_player(player.player_id, settings.SALT, refresh=True)
+    if not login:
+        raise HTTPException(400, f"Adding '{player.player_id}' failed.")
+    add_player(login["token"])
+    return {"message": f"Player '{player.player_id}' added successfully."}
+
+# Bulk requests with more fids than this stream their results as NDJSON
+BULK_STREAM_THRESHOLD = 25
+
+@router.post("/bulk")
+async def create_players_bulk(req: PlayerBulk):
+    """
+    Subscribe many players at once: concurrent logins, one bulk upsert.
+    Returns {"results": [...]} with one entry per fid, or, for more than
+    BULK_STREAM_THRESHOLD fids, streams the same entries as NDJSON.
+    """
+    fids = list(dict.fromkeys(fid.strip() for fid in req.player_ids if fid.strip()))
+    if len(fids) <= BULK_STREAM_THRESHOLD:
+        return {"results": [result async for result in onboard_players(fids)]}
+
+    async def lines():
+        async for result in onboard_players(fids):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 @router.post("/update")
 async def update_player_profile(player: Player):
-    api = None
-    try:
-        api = PlayerAPI()
-        login = await api.login_player(player.player_id, settings.SALT)
-        update_player(login["token"])
-        return {"message": f"Player '{player.player_id}' info updated."}
-    finally:
-        if api: await api.close_session()
+    login = await get_player_api().login_player(player.player_id, settings.SALT, refresh=True)
+    if not login:
+        raise HTTPException(400, f"Updating '{player.player_id}' failed.")
+    update_player(login["token"])
+    return {"message": f"Player '{player.player_id}' info updated."}
 
 @router.post("/remove")
 async def remove_player_db(
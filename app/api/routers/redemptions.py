@@ -1,37 +1,59 @@
+import json
+from collections import Counter
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from app.api.dependencies import require_ready
 from app.schemas.redemptions import RedemptionRequest
-from app.db.supabase import get_giftcodes, get_redeemed_codes, record_redemption
-from app.utils.wos_api import PlayerAPI
+from app.db.supabase import get_giftcodes, get_redeemed_codes
+from app.services.batch_redeemer import LOGIN_FAILED
+from app.services.jobs import stream_player_redemption
+from app.services.player_api import get_player_api
+from app.utils.outcome_policy import get_policy
 from app.core.config import settings
 
 router = APIRouter(prefix="/players", tags=["redemptions"], dependencies=[Depends(require_ready)])
 
+ALREADY_REDEEMED = "already_redeemed"
+
 @router.post("/redeem")
 async def redeem_giftcode(req: RedemptionRequest):
-    api = None
-    try:
-        codes = get_giftcodes()
-        redeemed = set(get_redeemed_codes(req.player_id))
-        results = []
+    """
+    Redeem every active code the player hasn't redeemed yet, on the batch
+    pipeline. Streams NDJSON: one line per code as it finishes, then a
+    summary line with the count per outcome.
+    """
+    redeemed = set(get_redeemed_codes(req.player_id))
+    codes = get_giftcodes()
+    pending = [code for code in codes if code not in redeemed]
+
+    # Log in up front so a bad player id is still a plain 400
+    login = await get_player_api().login_player(req.player_id, settings.SALT)
+    if not login:
+        raise HTTPException(400, "Login failed.")
 
-        api = PlayerAPI()
-        login = await api.login_player(req.player_id, settings.SALT)
-        if not login:
-            raise HTTPException(400, "Login failed.")
+    policy = get_policy()
 
+    async def lines():
+        counts = Counter()
         for code in codes:
             if code in redeemed:
-                results.append({"message": f"Code '{code}' already redeemed for '{req.player_id}'."})
-                continue
-            res = await api.redeem_code(req.player_id, settings.SALT, code)
-            if res.get("success"):
-                record_redemption(req.player_id, code)
-            results.append(res)
-
-        return {"results": results}
-    finally:
-        if api: await api.close_session()
+                counts[ALREADY_REDEEMED] += 1
+                yield json.dumps({
+                    "player_id": req.player_id, "code": code, "outcome": ALREADY_REDEEMED,
+                    "message": f"Code '{code}' already redeemed for '{req.player_id}'."
+                }) + "\n"
+        try:
+            async for pair in stream_player_redemption(req.player_id, pending):
+                counts[pair["outcome"]] += 1
+                yield json.dumps({
+                    "player_id": req.player_id, "code": pair["code"], "outcome": pair["outcome"],
+                    "message": "Login failed." if pair["outcome"] == LOGIN_FAILED else policy.rule(pair["outcome"]).message
+                }) + "\n"
+        except Exception as e:
+            yield json.dumps({"player_id": req.player_id, "error": str(e)}) + "\n"
+        yield json.dumps({"player_id": req.player_id, "summary": dict(counts)}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 @router.get("/{player_id}/redemptions")
 async def list_redeemed_codes(player_id: str):
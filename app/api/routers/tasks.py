@@ -1,7 +1,15 @@
-from fastapi import APIRouter, Depends
+import json
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from app.api.dependencies import require_ready
-from app.services.jobs import task_results, has_inflight_task, start_job
-from app.schemas.tasks import AutomationRequest
+from app.db.supabase import get_giftcodes, get_players
+from app.services.jobs import task_results, has_inflight_task, start_job, cancel_job, reset_tasks, stream_task_events
+from app.services.task_events import HEARTBEAT
+from app.services.scheduler import scheduler
+from app.services.code_runs import code_runs
+from app.schemas.tasks import AutomationRequest, ScheduleUpdate
+from app.utils.wos_api import upstream_breaker
+from app.utils.tracing import tracer
 
 router = APIRouter(prefix="/tasks", tags=["tasks"], dependencies=[Depends(require_ready)])
 
@@ -11,6 +19,8 @@ async def expired_codes():
     if inflight:
         return {"error": "A task is already in progress.", "task_id": tid}
     tid = start_job()
+    if tid is None:
+        return {"error": "A task is already in progress.", "task_id": has_inflight_task()[1]}
     return {"task_id": tid, "status": "Processing", "progress": 0}
 
 @router.post("/automate-all")
@@ -20,18 +30,100 @@ async def automate_all(req: AutomationRequest):
         return {"error": "A task is already in progress.", "task_id": tid}
     n = 20 if req.n == "all" else int(req.n)
     tid = start_job(n=n)
+    if tid is None:
+        return {"error": "A task is already in progress.", "task_id": has_inflight_task()[1]}
     return {"task_id": tid, "status": "Processing", "progress": 0}
 
-@router.get("/{task_id}")
-async def get_task_status(task_id: str):
-    return task_results.get(task_id, {"status": "Not Found", "progress": 0})
-
+# Declared before /{task_id} so they aren't captured as a task id
 @router.get("/inprogress")
 async def get_task_inprogress():
     inflight, tid = has_inflight_task()
-    return {"result": inflight, "task_id": tid}
+    return {"result": inflight, "task_id": tid, "code_runs": task_results.inflight_codes(), "queued_codes": code_runs.pending()}
+
+@router.get("/schedule")
+async def get_schedule():
+    return scheduler.snapshot()
+
+@router.patch("/schedule/{job}")
+async def update_schedule(job: str, req: ScheduleUpdate):
+    if job not in scheduler.jobs:
+        raise HTTPException(status_code=404, detail=f"Unknown job '{job}'")
+    try:
+        return scheduler.update(job, interval=req.interval, jitter=req.jitter, enabled=req.enabled)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/schedule/{job}/run")
+async def run_scheduled_job(job: str):
+    if job not in scheduler.jobs:
+        raise HTTPException(status_code=404, detail=f"Unknown job '{job}'")
+    return await scheduler.run_job(job)
+
+@router.get("/{task_id}")
+async def get_task_status(task_id: str, expand: bool = False):
+    task = task_results.get(task_id)
+    if task is None:
+        return {"status": "Not Found", "progress": 0}
+    if task.get("status") == "Processing":
+        # Live upstream health so pollers can see a run stalled on an open breaker
+        task = {**task, "upstream": upstream_breaker.snapshot()}
+    if expand:
+        # Records only keep counts; current tables are loaded on request
+        task = {**task, "giftcodes": get_giftcodes(), "players": get_players()}
+    return task
+
+@router.post("/{task_id}/cancel")
+async def cancel_task(task_id: str):
+    """Stop a run after its workers' current step; finished pairs stay recorded."""
+    task = task_results.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task.get("status") != "Processing":
+        raise HTTPException(status_code=409, detail=f"Task already {task.get('status')}.")
+    if not cancel_job(task_id):
+        raise HTTPException(status_code=409, detail="Task is not running.")
+    return {"task_id": task_id, "status": "Cancelling"}
+
+@router.get("/{task_id}/trace")
+async def get_task_trace(task_id: str):
+    """Span trees of the run's recent (fid, code) pairs, from this worker's trace buffer."""
+    traces = tracer.for_task(task_id)
+    if not traces and task_results.get(task_id) is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return {"task_id": task_id, "traces": traces}
+
+@router.get("/{task_id}/events")
+async def task_events_sse(task_id: str):
+    """Server-Sent Events: progress, pair and a final result event, instead of polling /tasks/{task_id}."""
+    if task_results.get(task_id) is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    async def events():
+        async for event, data in stream_task_events(task_id):
+            if event == HEARTBEAT:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.websocket("/{task_id}/ws")
+async def task_events_ws(websocket: WebSocket, task_id: str):
+    """Same events as /events, as JSON messages {"event": ..., "data": ...}."""
+    await websocket.accept()
+    try:
+        async for event, data in stream_task_events(task_id):
+            if event != HEARTBEAT:
+                await websocket.send_text(json.dumps({"event": event, "data": data}, default=str))
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
 
 @router.post("/reset")
 def reset():
-    task_results.clear()
+    reset_tasks()
     return {"status": "cleared"}
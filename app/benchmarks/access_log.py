@@ -0,0 +1,142 @@
+"""
+Benchmark for the request logging middleware.
+
+Drives a minimal FastAPI app in-process (ASGI calls, no sockets) with the old
+``@app.middleware("http")`` logger that buffered every body and logged
+synchronously, then with AccessLogMiddleware behind the queue listener, and
+prints requests/sec for both. Log output goes to --log-file (default: the
+null device) so the terminal isn't part of the measurement; point it at a
+real file to include disk I/O.
+
+    uv run python -m app.benchmarks.access_log --requests 5000 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+from fastapi import FastAPI, Request
+
+from app.core.access_log import AccessLog, AccessLogMiddleware
+
+BODY = json.dumps({"player_id": "123456789", "codes": ["CODE"] * 20}).encode()
+
+
+def _app():
+    app = FastAPI()
+
+    @app.post("/players/add")
+    async def add(request: Request):
+        return {"ok": True}
+
+    return app
+
+
+def legacy_app(logger):
+    """The app with the middleware AccessLogMiddleware replaced."""
+    app = _app()
+
+    @app.middleware("http")
+    async def log_requests(request: Request, call_next):
+        start = time.time()
+        try:
+            body = (await request.body())[:1024]
+            logger.info(f"{request.client.host} {request.method} {request.url} body={body!r}")
+        except Exception:
+            logger.info(f"{request.client.host} {request.method} {request.url} body=<unavailable>")
+        response = await call_next(request)
+        logger.info(f"Status {response.status_code} in {time.time()-start:.2f}s @ {datetime.now():%m/%d/%Y %H:%M:%S}")
+        return response
+
+    return app
+
+
+def access_log_app(logger, **rates):
+    app = _app()
+    app.add_middleware(AccessLogMiddleware, logger=logger, **rates)
+    return app
+
+
+async def _request(app):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST", "scheme": "http",
+        "path": "/players/add", "raw_path": b"/players/add", "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"bench"), (b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+    }
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            return {"type": "http.disconnect"}
+        sent = True
+        return {"type": "http.request", "body": BODY, "more_body": False}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def _drive(app, requests, concurrency):
+    remaining = iter(range(requests))
+
+    async def client():
+        for _ in remaining:
+            await _request(app)
+
+    for _ in range(min(100, requests)):
+        await _request(app)  # warm up routing and the logger
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return requests / (time.perf_counter() - start)
+
+
+def run(requests, concurrency, log_file, sample_rate=1.0):
+    handler = logging.FileHandler(log_file)
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+
+    legacy = logging.getLogger("bench.legacy")
+    legacy.propagate = False
+    legacy.setLevel(logging.INFO)
+    legacy.addHandler(handler)
+    try:
+        before = asyncio.run(_drive(legacy_app(legacy), requests, concurrency))
+    finally:
+        legacy.removeHandler(handler)
+
+    log = AccessLog("bench.access")
+    log.logger.setLevel(logging.INFO)
+    log.start(handler)
+    try:
+        after = asyncio.run(_drive(access_log_app(log.logger, sample_rate=sample_rate), requests, concurrency))
+    finally:
+        log.stop()
+        handler.close()
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "sample_rate": sample_rate,
+        "before_req_per_sec": round(before, 1),
+        "after_req_per_sec": round(after, 1),
+        "speedup": round(after / before, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--sample-rate", type=float, default=1.0)
+    parser.add_argument("--log-file", default=os.devnull)
+    args = parser.parse_args()
+    print(json.dumps(run(args.requests, args.concurrency, args.log_file, args.sample_rate), indent=2))
+
+
+if __name__ == "__main__":
+    main()
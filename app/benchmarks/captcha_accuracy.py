@@ -0,0 +1,178 @@
+"""
+Accuracy / latency benchmark for CaptchaSolver.
+
+Streams labeled captchas (captchas.feedback = TRUE, label = captchas.name)
+from the database, or from a dataset previously exported with --export,
+runs them through the solver and prints a JSON report with exact-match and
+per-position accuracy, latency percentiles and solves/sec.
+
+    # snapshot the labeled set once
+    uv run python -m app.benchmarks.captcha_accuracy --export ./captcha_dataset
+    # benchmark against the snapshot (or --source db)
+    uv run python -m app.benchmarks.captcha_accuracy --dataset ./captcha_dataset \\
+        --batch-size 16 --threads 4 --min-accuracy 0.95 --output report.json
+    # same dataset, candidate model variant
+    uv run python -m app.benchmarks.captcha_accuracy --dataset ./captcha_dataset --variant int8
+
+Exits with status 1 when --min-accuracy is given and not met, so it can gate
+model or runtime changes in CI.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import numpy as np
+from PIL import Image
+
+MANIFEST = "manifest.jsonl"
+
+
+def iter_db_samples(limit=None):
+    from app.db.supabase import iter_labeled_captchas
+
+    for captcha_id, name, img in iter_labeled_captchas(limit=limit):
+        yield str(captcha_id), name, img
+
+
+def iter_dir_samples(dataset_dir, limit=None):
+    with open(os.path.join(dataset_dir, MANIFEST), "r", encoding="utf-8") as f:
+        for line in islice(f, limit):
+            entry = json.loads(line)
+            with open(os.path.join(dataset_dir, entry["file"]), "rb") as img:
+                yield entry["id"], entry["label"], img.read()
+
+
+def export_dataset(dataset_dir, limit=None):
+    """Write labeled captchas from the DB to ``dataset_dir`` with a JSONL manifest."""
+    os.makedirs(dataset_dir, exist_ok=True)
+    count = 0
+    with open(os.path.join(dataset_dir, MANIFEST), "w", encoding="utf-8") as manifest:
+        for captcha_id, label, img in iter_db_samples(limit):
+            filename = f"{captcha_id}.img"
+            with open(os.path.join(dataset_dir, filename), "wb") as f:
+                f.write(img)
+            manifest.write(json.dumps({"id": captcha_id, "label": label, "file": filename}) + "\n")
+            count += 1
+    return count
+
+
+def _batched(iterable, size):
+    it = iter(iterable)
+    while batch := list(islice(it, size)):
+        yield batch
+
+
+def _solve_batch(solver, batch):
+    images = [Image.open(io.BytesIO(img)) for _, _, img in batch]
+    start = time.perf_counter()
+    texts, _ = solver.predict_batch(images)
+    elapsed = time.perf_counter() - start
+    return [label for _, label, _ in batch], texts, elapsed
+
+
+def _percentiles(values_ms):
+    if not values_ms:
+        return {"p50": None, "p95": None, "p99": None}
+    p50, p95, p99 = np.percentile(values_ms, [50, 95, 99])
+    return {"p50": round(float(p50), 3), "p95": round(float(p95), 3), "p99": round(float(p99), 3)}
+
+
+def run(solver, samples, batch_size=1, threads=1):
+    """Benchmark ``solver`` over an iterable of (id, label, img_bytes) samples."""
+    positions = solver.output_positions
+    position_hits = np.zeros(positions, dtype=np.int64)
+    exact_hits = 0
+    total = 0
+    batch_latencies_ms = []
+    solve_latencies_ms = []
+
+    def record(result):
+        nonlocal exact_hits, total
+        labels, texts, elapsed = result
+        batch_latencies_ms.append(elapsed * 1000)
+        solve_latencies_ms.extend([elapsed * 1000 / len(labels)] * len(labels))
+        for label, text in zip(labels, texts):
+            total += 1
+            exact_hits += label == text
+            for pos in range(min(positions, len(label), len(text))):
+                position_hits[pos] += label[pos] == text[pos]
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        # Keep a bounded number of batches in flight so the dataset is streamed, not loaded.
+        pending = deque()
+        for batch in _batched(samples, batch_size):
+            pending.append(pool.submit(_solve_batch, solver, batch))
+            if len(pending) >= threads * 2:
+                record(pending.popleft().result())
+        while pending:
+            record(pending.popleft().result())
+    wall = time.perf_counter() - wall_start
+
+    return {
+        "samples": total,
+        "batch_size": batch_size,
+        "threads": threads,
+        "accuracy": round(exact_hits / total, 6) if total else None,
+        "accuracy_per_position": [round(int(h) / total, 6) if total else None for h in position_hits],
+        "batch_latency_ms": _percentiles(batch_latencies_ms),
+        "solve_latency_ms": _percentiles(solve_latencies_ms),
+        "solves_per_sec": round(total / wall, 2) if wall > 0 else None,
+        "wall_seconds": round(wall, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", choices=["db", "dir"], default=None,
+                        help="where to read samples from (default: dir if --dataset is given, else db)")
+    parser.add_argument("--dataset", help="dataset directory written by --export")
+    parser.add_argument("--export", metavar="DIR", help="export labeled captchas from the DB to DIR and exit")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--variant", default=None, help="model variant to benchmark (default: configured primary)")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--min-accuracy", type=float, default=None,
+                        help="exit non-zero if exact-match accuracy falls below this")
+    args = parser.parse_args(argv)
+
+    if args.export:
+        count = export_dataset(args.export, args.limit)
+        print(json.dumps({"exported": count, "dataset": args.export}))
+        return 0
+
+    source = args.source or ("dir" if args.dataset else "db")
+    if source == "dir":
+        if not args.dataset:
+            parser.error("--dataset is required with --source dir")
+        samples = iter_dir_samples(args.dataset, args.limit)
+    else:
+        samples = iter_db_samples(args.limit)
+
+    from app.utils.captcha_solver import CaptchaSolver
+
+    solver = CaptchaSolver(args.variant)
+    report = run(solver, samples, batch_size=args.batch_size, threads=args.threads)
+    report["source"] = source
+    report["variant"] = solver.variant
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+    if args.min_accuracy is not None and (report["accuracy"] or 0) < args.min_accuracy:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
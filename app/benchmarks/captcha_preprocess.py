@@ -0,0 +1,126 @@
+"""
+Micro-benchmark for CaptchaSolver preprocessing + decoding.
+
+Compares the original per-call implementation with the compiled path and
+prints per-solve CPU time for both. Uses the real ONNX model when it is
+present, otherwise a stub session that returns random logits so only the
+Python-side work is measured.
+
+    uv run python -m app.benchmarks.captcha_preprocess --iterations 5000
+"""
+import argparse
+import io
+import json
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from app.utils.captcha_solver import CaptchaSolver, MODEL_PATH, META_PATH
+
+
+class _StubInput:
+    name = "input"
+
+
+class _StubSession:
+    """Stands in for ort.InferenceSession when the model file isn't checked out."""
+
+    def __init__(self, metadata):
+        rng = np.random.default_rng(0)
+        self._outputs = [
+            rng.random((1, metadata["num_classes"]), dtype=np.float32)
+            for _ in range(metadata["output_positions"])
+        ]
+
+    def get_inputs(self):
+        return [_StubInput()]
+
+    def run(self, _names, _feed):
+        return self._outputs
+
+
+def legacy_solve(solver, image):
+    """The pre-compiled implementation, kept verbatim for comparison."""
+    channels, height, width = solver.metadata["input_shape"]
+    img = image.resize((width, height)).convert('L')
+    arr = np.asarray(img).astype(np.float32) / 255.0
+    mean = solver.metadata["normalization"]["mean"][0]
+    std = solver.metadata["normalization"]["std"][0]
+    arr = (arr - mean) / std
+    if channels == 1:
+        arr = arr[np.newaxis, np.newaxis, :, :]
+    else:
+        arr = np.repeat(arr[np.newaxis, :, :], channels, axis=0)
+        arr = arr[np.newaxis, :, :, :]
+
+    input_name = solver.session.get_inputs()[0].name
+    outputs = solver.session.run(None, {input_name: arr})
+
+    predicted_text = ""
+    confidences = []
+    idx_to_char = solver.metadata["idx_to_char"]
+    for pos in range(solver.metadata["output_positions"]):
+        probs = np.squeeze(outputs[pos])
+        max_idx = int(np.argmax(probs))
+        confidences.append(float(probs[max_idx]))
+        predicted_text += idx_to_char[str(max_idx)]
+    return predicted_text, confidences
+
+
+def build_solver():
+    if os.path.exists(MODEL_PATH):
+        return CaptchaSolver(), "onnx"
+    solver = CaptchaSolver.__new__(CaptchaSolver)
+    with open(META_PATH, "r", encoding="utf-8") as f:
+        solver.metadata = json.load(f)
+    solver.session = _StubSession(solver.metadata)
+    solver._compile()
+    return solver, "stub"
+
+
+def sample_image():
+    """A JPEG-decoded RGB image the size the upstream API serves."""
+    rng = np.random.default_rng(1)
+    noise = rng.integers(0, 256, size=(60, 200, 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(noise, "RGB").save(buf, format="JPEG")
+    return Image.open(io.BytesIO(buf.getvalue())).convert("RGB")
+
+
+def _time_per_call(fn, image, iterations):
+    for _ in range(min(100, iterations)):
+        fn(image)
+    start = time.process_time()
+    for _ in range(iterations):
+        fn(image)
+    return (time.process_time() - start) / iterations
+
+
+def run(iterations):
+    solver, session_kind = build_solver()
+    image = sample_image()
+
+    assert legacy_solve(solver, image)[0] == solver.predict(image)[0]
+
+    before = _time_per_call(lambda img: legacy_solve(solver, img), image, iterations)
+    after = _time_per_call(solver.predict, image, iterations)
+    return {
+        "session": session_kind,
+        "iterations": iterations,
+        "before_us_per_solve": round(before * 1e6, 2),
+        "after_us_per_solve": round(after * 1e6, 2),
+        "speedup": round(before / after, 2) if after else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+    print(json.dumps(run(args.iterations), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""
+Local stand-in for wos-giftcode-api.centurygame.com.
+
+Implements /api/player, /api/captcha and /api/gift_code with the same
+request signing and response shapes as the real API, plus the failure modes
+the pipeline has to cope with: latency, 429s, 5xx, login tokens expiring
+(40009), captcha fetched too often (40100), wrong captchas (40103) and
+per-code expiry. GET /stats returns what the server has seen so far.
+
+    uv run python -m app.benchmarks.fake_wos_server --port 8081 \\
+        --latency 0.05 0.2 --rate-limit 0.02 --token-ttl 600 \\
+        --code SPRING2025 --code OLDCODE:0
+    WOS_API_URL=http://127.0.0.1:8081/api uv run -m app.main
+
+Captchas are 4 characters from the solver's alphabet rendered as PNG data
+URIs (or, with render_captchas=False, the answer itself so load tests do not
+spend their CPU on PIL). By default any captcha answer is accepted (the
+synthetic images are not what the model was trained on); pass
+--strict-captcha to require the real text, and --captcha-error-rate to
+inject 40103s either way.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import random
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+
+from aiohttp import web
+from PIL import Image, ImageDraw
+
+from app.core.config import settings
+from app.utils.captcha_solver import META_PATH
+
+CAPTCHA_SIZE = (150, 40)
+CAPTCHA_LENGTH = 4
+DEFAULT_CHARS = "ABCDEFGHIJKLMNPQRSTUVWXYZ23456789"
+
+
+@dataclass
+class FakeServerConfig:
+    salt: str = settings.SALT
+    latency: tuple[float, float] = (0.0, 0.0)   # uniform per-request delay, seconds
+    rate_limit: float = 0.0                     # share of requests answered with HTTP 429
+    server_error: float = 0.0                   # share of requests answered with HTTP 503
+    token_ttl: float = 3600                     # seconds a login stays valid before 40009
+    captcha_interval: float = 0.0               # min seconds between captchas per fid before 40100
+    captcha_error_rate: float = 0.0             # share of redemptions failed with 40103 regardless
+    strict_captcha: bool = False                # require the captcha text that was served
+    codes: dict[str, float | None] = field(default_factory=dict)  # code -> expires at (epoch) or None
+    accept_unknown_codes: bool = True           # unknown codes redeem instead of 40014
+    render_captchas: bool = True                # False: serve the text itself (see captcha_text()) to save CPU
+    seed: int | None = None
+
+
+def _load_chars():
+    try:
+        with open(META_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)["chars"]
+    except (OSError, KeyError, ValueError):
+        return DEFAULT_CHARS
+
+
+def _sign(params, salt):
+    query = "&".join(f"{key}={params[key]}" for key in sorted(params))
+    return hashlib.md5(f"{query}{salt}".encode("utf-8")).hexdigest()
+
+
+def _reply(code, msg, err_code="", data=None):
+    return web.json_response({"code": code, "data": data if data is not None else [], "msg": msg, "err_code": err_code})
+
+
+class FakeWOSServer:
+    """Request handlers and per-player state for the fake API."""
+
+    def __init__(self, config: FakeServerConfig | None = None):
+        self.config = config or FakeServerConfig()
+        self.rng = random.Random(self.config.seed)
+        self.chars = _load_chars()
+        self.tokens = {}           # (fid, time) -> issued at (monotonic)
+        self.last_captcha = {}     # fid -> monotonic of the last captcha served
+        self.captchas = {}         # fid -> text of the outstanding captcha
+        self.redeemed = set()      # (fid, code)
+        self.stats = Counter()
+
+    def app(self):
+        app = web.Application(middlewares=[self._faults])
+        app.router.add_post("/api/player", self.player)
+        app.router.add_post("/api/captcha", self.captcha)
+        app.router.add_post("/api/gift_code", self.gift_code)
+        app.router.add_get("/stats", self.get_stats)
+        return app
+
+    @web.middleware
+    async def _faults(self, request, handler):
+        if request.path == "/stats":
+            return await handler(request)
+        low, high = self.config.latency
+        if high > 0:
+            await asyncio.sleep(self.rng.uniform(low, high))
+        endpoint = request.path.rsplit("/", 1)[-1]
+        self.stats[f"{endpoint}.requests"] += 1
+        roll = self.rng.random()
+        if roll < self.config.rate_limit:
+            self.stats[f"{endpoint}.429"] += 1
+            return web.json_response({"msg": "Too Many Requests"}, status=429)
+        if roll < self.config.rate_limit + self.config.server_error:
+            self.stats[f"{endpoint}.503"] += 1
+            return web.json_response({"msg": "Service Unavailable"}, status=503)
+        return await handler(request)
+
+    def _count(self, endpoint, outcome):
+        self.stats[f"{endpoint}.{outcome}"] += 1
+
+    async def _signed_payload(self, request, endpoint):
+        """Return the request JSON if its sign checks out, else None (after counting it)."""
+        payload = await request.json()
+        sign = payload.pop("sign", None)
+        if sign != _sign(payload, self.config.salt):
+            self._count(endpoint, "sign_error")
+            return None
+        return payload
+
+    def _logged_in(self, payload):
+        issued_at = self.tokens.get((str(payload.get("fid")), payload.get("time")))
+        return issued_at is not None and time.monotonic() - issued_at < self.config.token_ttl
+
+    async def player(self, request):
+        payload = await self._signed_payload(request, "player")
+        if payload is None:
+            return _reply(1, "Sign Error", 0)
+        fid = str(payload["fid"])
+        self.tokens[(fid, payload["time"])] = time.monotonic()
+        self._count("player", "success")
+        return _reply(0, "success", "", {
+            "fid": int(fid) if fid.isdigit() else fid,
+            "nickname": f"player-{fid}",
+            "kid": 1,
+            "stove_lv": 30,
+            "stove_lv_content": 30,
+            "avatar_image": "https://example.invalid/avatar.png",
+            "total_recharge_amount": 0,
+        })
+
+    async def captcha(self, request):
+        payload = await self._signed_payload(request, "captcha")
+        if payload is None:
+            return _reply(1, "Sign Error", 0)
+        if not self._logged_in(payload):
+            self._count("captcha", "40009")
+            return _reply(1, "NOT LOGIN.", 40009)
+        fid = str(payload["fid"])
+        now = time.monotonic()
+        last = self.last_captcha.get(fid)
+        if last is not None and now - last < self.config.captcha_interval:
+            self._count("captcha", "40100")
+            return _reply(1, "CAPTCHA GET TOO FREQUENT.", 40100)
+        self.last_captcha[fid] = now
+
+        text = "".join(self.rng.choice(self.chars) for _ in range(CAPTCHA_LENGTH))
+        self.captchas[fid] = text
+        self._count("captcha", "success")
+        img = render_captcha(text, self.rng) if self.config.render_captchas else plain_captcha(text)
+        return _reply(0, "SUCCESS", "", {"img": img})
+
+    async def gift_code(self, request):
+        payload = await self._signed_payload(request, "gift_code")
+        if payload is None:
+            return _reply(1, "Sign Error", 0)
+        if not self._logged_in(payload):
+            self._count("gift_code", "40009")
+            return _reply(1, "NOT LOGIN.", 40009)
+
+        fid = str(payload["fid"])
+        code = payload.get("cdk")
+        expected = self.captchas.pop(fid, None)
+        answer = str(payload.get("captcha_code", "")).upper()
+        if (
+            self.rng.random() < self.config.captcha_error_rate
+            or (self.config.strict_captcha and answer != expected)
+        ):
+            self._count("gift_code", "40103")
+            return _reply(1, "CAPTCHA CHECK ERROR.", 40103)
+
+        if code not in self.config.codes and not self.config.accept_unknown_codes:
+            self._count("gift_code", "40014")
+            return _reply(1, "CDK NOT FOUND.", 40014)
+        expires_at = self.config.codes.get(code)
+        if expires_at is not None and time.time() >= expires_at:
+            self._count("gift_code", "40007")
+            return _reply(1, "TIME ERROR.", 40007)
+        if (fid, code) in self.redeemed:
+            self._count("gift_code", "40008")
+            return _reply(1, "RECEIVED.", 40008)
+
+        self.redeemed.add((fid, code))
+        self._count("gift_code", "20000")
+        return _reply(0, "SUCCESS", 20000)
+
+    async def get_stats(self, request):
+        return web.json_response({
+            **dict(self.stats),
+            "logins": len(self.tokens),
+            "redeemed": len(self.redeemed),
+        })
+
+
+def render_captcha(text, rng=random):
+    """Draw ``text`` on a noisy background and return it as a PNG data URI."""
+    width, height = CAPTCHA_SIZE
+    image = Image.new("RGB", CAPTCHA_SIZE, (rng.randint(200, 255),) * 3)
+    draw = ImageDraw.Draw(image)
+    for _ in range(6):
+        draw.line(
+            [(rng.randrange(width), rng.randrange(height)), (rng.randrange(width), rng.randrange(height))],
+            fill=(rng.randint(100, 200),) * 3,
+        )
+    step = width // (len(text) + 1)
+    for i, char in enumerate(text):
+        draw.text((step * (i + 0.5) + rng.randint(-3, 3), 12 + rng.randint(-4, 4)), char, fill=(0, 0, 0))
+
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+def plain_captcha(text):
+    """Unrendered captcha for load tests: the answer itself, readable with captcha_text()."""
+    return "data:text/plain;base64," + base64.b64encode(text.encode("ascii")).decode("ascii")
+
+
+def captcha_text(img):
+    """Answer of a captcha served with render_captchas=False, or None for a real image."""
+    header, _, data = img.partition(",")
+    if header != "data:text/plain;base64":
+        return None
+    return base64.b64decode(data).decode("ascii")
+
+
+async def start_fake_server(config: FakeServerConfig | None = None, host="127.0.0.1", port=0):
+    """
+    Start the fake API on ``host:port`` (0 picks a free port) inside the
+    running loop. Returns (server, runner, base_url); call runner.cleanup() to stop.
+    """
+    server = FakeWOSServer(config)
+    runner = web.AppRunner(server.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    return server, runner, f"http://{host}:{bound_port}/api"
+
+
+def _parse_code(value):
+    """CODE or CODE:seconds-until-expiry (0 = already expired)."""
+    code, _, ttl = value.partition(":")
+    return code, (time.time() + float(ttl)) if ttl else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--salt", default=settings.SALT)
+    parser.add_argument("--latency", type=float, nargs=2, default=(0.0, 0.0), metavar=("MIN", "MAX"))
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--server-error", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--token-ttl", type=float, default=3600, help="seconds before a login gets 40009")
+    parser.add_argument("--captcha-interval", type=float, default=0.0, help="min seconds between captchas per fid (40100)")
+    parser.add_argument("--captcha-error-rate", type=float, default=0.0, help="share of redemptions failed with 40103")
+    parser.add_argument("--strict-captcha", action="store_true", help="require the served captcha text")
+    parser.add_argument("--code", action="append", default=[], type=_parse_code,
+                        help="known gift code, optionally CODE:seconds-until-expiry (repeatable)")
+    parser.add_argument("--reject-unknown-codes", action="store_true", help="answer 40014 for codes not given with --code")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    config = FakeServerConfig(
+        salt=args.salt,
+        latency=tuple(args.latency),
+        rate_limit=args.rate_limit,
+        server_error=args.server_error,
+        token_ttl=args.token_ttl,
+        captcha_interval=args.captcha_interval,
+        captcha_error_rate=args.captcha_error_rate,
+        strict_captcha=args.strict_captcha,
+        codes=dict(args.code),
+        accept_unknown_codes=not args.reject_unknown_codes,
+        seed=args.seed,
+    )
+    web.run_app(FakeWOSServer(config).app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
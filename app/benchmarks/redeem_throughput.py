@@ -0,0 +1,322 @@
+"""
+End-to-end throughput benchmark for batch redemption.
+
+Runs batch_redeemer.process_unredeemed_df (or batch_redeemer.main with
+--entry main) against the in-process fake gift code server and an in-memory
+DB, over a grid of players x codes x latency x 429 rate x captcha accuracy x
+MAX_WORKERS x BATCH_DELAY, and prints one JSON record per scenario:
+pairs/sec, upstream calls per successful pair, p95 pair latency and peak
+Python memory.
+
+Every pacing constant (CAPTCHA_DELAY, REDEEM_DELAY, BATCH_DELAY, policy
+backoffs, injected latency) is multiplied by --time-scale so a grid finishes
+in seconds; compare scenarios against each other or a baseline taken at the
+same scale.
+
+Only the metrics that do not depend on timing (successes, upstream calls per
+success and upstream request counts) gate a baseline comparison; pairs/sec,
+p95 latency and peak memory swing by tens of percent between identical runs
+and are reported as notes.
+
+    uv run python -m app.benchmarks.redeem_throughput \\
+        --players 20 100 --codes 3 --latency 0.05 --rate-limit 0 0.05 \\
+        --accuracy 0.9 --workers 3 8 --output report.json
+    # regression check against the committed baseline (exit status 1 on regression)
+    uv run python -m app.benchmarks.redeem_throughput \\
+        --baseline app/benchmarks/baselines/redeem_throughput.json
+    # refresh the baseline
+    uv run python -m app.benchmarks.redeem_throughput \\
+        --write-baseline app/benchmarks/baselines/redeem_throughput.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import sys
+import time
+import tracemalloc
+from contextlib import ExitStack
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from app.benchmarks.fake_wos_server import FakeServerConfig, captcha_text, start_fake_server
+from app.services import batch_redeemer
+from app.services.task_registry import TaskRegistry
+from app.utils import wos_api
+from app.utils.circuit_breaker import CircuitBreaker
+from app.utils.outcome_policy import OutcomePolicy
+from app.utils.rate_limiter import RateLimiter
+from app.utils.wos_api import PlayerAPI
+
+DEFAULT_BASELINE = "app/benchmarks/baselines/redeem_throughput.json"
+
+# metric -> direction that counts as a regression; "upstream.<name>" reads record["upstream"][<name>]
+REGRESSION_METRICS = {
+    "successes": "lower",
+    "calls_per_success": "higher",
+    "upstream.player.requests": "higher",
+    "upstream.captcha.requests": "higher",
+    "upstream.gift_code.requests": "higher",
+}
+# Timing-dependent metrics, only reported
+TIMING_METRICS = {
+    "pairs_per_sec": "lower",
+    "p95_pair_latency": "higher",
+    "peak_memory_mb": "higher",
+}
+
+
+class FakeSolver:
+    """Reads the answer off the fake server's unrendered captcha; wrong ``1 - accuracy`` of the time."""
+
+    def __init__(self, accuracy, rng):
+        self.accuracy = accuracy
+        self.rng = rng
+
+    def solve(self, captcha_json):
+        text = captcha_text(captcha_json["data"]["img"]) or "AAAA"
+        if self.rng.random() >= self.accuracy:
+            text = text[1:] + ("3" if text[0] == "2" else "2")  # never equal to the answer
+        return text, None
+
+
+class InMemoryDB:
+    """Just enough of app.db.supabase (and the JSON caches) for batch_redeemer."""
+
+    def __init__(self, players, codes):
+        self.players = [{"fid": fid, "nickname": f"player-{fid}"} for fid in players]
+        self.codes = [{"code": code} for code in codes]
+        self.unredeemed = {(fid, code) for fid in players for code in codes}
+        self.writes = {}
+
+    def create_cache(self, cache_type, data):
+        self.writes.setdefault(cache_type, []).append(data)
+        if cache_type == "redeemed_giftcode":
+            self.unredeemed.discard((data["fid"], data["code"]))
+
+    def get_players(self):
+        return list(self.players)
+
+    def get_giftcodes(self):
+        return list(self.codes)
+
+    def get_unredeemed_code_player_list(self):
+        return [{"fid": fid, "code": code} for fid, code in sorted(self.unredeemed)]
+
+    def get_giftcodes_unchecked(self, fid):
+        return []
+
+    def select_unredeemed_pairs(self, limit, policy="least-recent", exclude_codes=()):
+        return [row for row in self.get_unredeemed_code_player_list() if row["code"] not in exclude_codes][:limit]
+
+    def record_attempts(self, attempts):
+        self.writes.setdefault("attempts", []).extend(attempts)
+
+    def record_login_failures(self, player_ids):
+        self.writes.setdefault("login_failures", []).extend(player_ids)
+
+    def clear_login_failures(self, player_ids):
+        pass
+
+    def record_ineligible(self, pairs):
+        self.writes.setdefault("ineligible", []).extend(pairs)
+
+    @property
+    def successes(self):
+        return len(self.writes.get("redeemed_giftcode", []))
+
+
+def scaled_policy(scale):
+    """The error_codes.json policy with every backoff multiplied by ``scale``."""
+    with open(batch_redeemer.settings.ERROR_CODES_FILE, "r", encoding="utf-8") as f:
+        table = json.load(f)
+    for entry in table.values():
+        if "backoff" in entry:
+            entry["backoff"] = [value * scale for value in entry["backoff"]]
+    return OutcomePolicy(table)
+
+
+def scenario_key(s):
+    return (
+        f"p{s['players']}-c{s['codes']}-lat{s['latency']}-r{s['rate_limit']}"
+        f"-acc{s['accuracy']}-w{s['workers']}-d{s['batch_delay']}"
+    )
+
+
+async def run_scenario(s, time_scale=0.01, entry="df", seed=0):
+    rng = random.Random(seed)
+    players = [str(100000 + i) for i in range(s["players"])]
+    codes = [f"CODE{i}" for i in range(s["codes"])]
+    db = InMemoryDB(players, codes)
+
+    latency = s["latency"] * time_scale
+    config = FakeServerConfig(
+        salt=batch_redeemer.SALT,
+        latency=(latency * 0.5, latency * 1.5),
+        rate_limit=s["rate_limit"],
+        strict_captcha=True,
+        render_captchas=False,
+        seed=seed,
+    )
+    server, runner, base_url = await start_fake_server(config)
+    api = PlayerAPI(base_url=base_url)
+    api.breaker = CircuitBreaker("benchmark")
+    settings = batch_redeemer.settings
+    api.limiter = RateLimiter(settings.UPSTREAM_RATE_LIMIT / time_scale, settings.UPSTREAM_RATE_BURST)
+    policy = scaled_policy(time_scale)
+    api.policy = policy
+
+    started, latencies = {}, []
+    advance, finish_code = batch_redeemer.advance, batch_redeemer._finish_code
+
+    async def timed_advance(work, *args):
+        started.setdefault((work.fid, work.codes[0]), time.perf_counter())
+        return await advance(work, *args)
+
+    def timed_finish_code(work, *args):
+        start = started.pop((work.fid, work.codes[0]), None)
+        if start is not None:
+            latencies.append(time.perf_counter() - start)
+        return finish_code(work, *args)
+
+    with ExitStack() as stack:
+        patch = lambda target, name, value: stack.enter_context(mock.patch.object(target, name, value))
+        patch(batch_redeemer, "player_api", api)
+        patch(batch_redeemer, "policy", policy)
+        patch(batch_redeemer, "get_solver", lambda: FakeSolver(s["accuracy"], rng))
+        patch(batch_redeemer, "create_cache", db.create_cache)
+        patch(batch_redeemer, "advance", timed_advance)
+        patch(batch_redeemer, "_finish_code", timed_finish_code)
+        patch(batch_redeemer, "MAX_WORKERS", s["workers"])
+        patch(batch_redeemer.settings, "TASK_STORE", "memory")  # in-process claims, no database
+        patch(batch_redeemer, "BATCH_DELAY", s["batch_delay"] * time_scale)
+        for name in ("CAPTCHA_DELAY", "REDEEM_DELAY", "UNSOLVED_CAPTCHA_COOLDOWN"):
+            patch(wos_api, name, getattr(wos_api, name) * time_scale)
+        if entry == "main":
+            patch(batch_redeemer, "get_player_api", lambda: api)
+            patch(batch_redeemer, "fetch_latest_codes_async", mock.AsyncMock(return_value=[]))
+            for name in ("get_players", "get_giftcodes", "get_unredeemed_code_player_list", "get_giftcodes_unchecked",
+                         "select_unredeemed_pairs", "record_attempts", "record_login_failures",
+                         "clear_login_failures", "record_ineligible"):
+                patch(batch_redeemer, name, getattr(db, name))
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            if entry == "main":
+                task_results = TaskRegistry()
+                pairs = len(db.unredeemed)
+                await batch_redeemer.main(task_results, "benchmark", batch_redeemer.SALT, n=pairs, timeout=3600)
+            else:
+                df = pd.DataFrame(db.get_unredeemed_code_player_list())
+                await batch_redeemer.process_unredeemed_df(df, lambda delta, pair=None: None)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            await api.close_session()
+            await runner.cleanup()
+
+    pairs = s["players"] * s["codes"]
+    upstream_calls = sum(v for k, v in server.stats.items() if k.endswith(".requests"))
+    return {
+        "scenario": scenario_key(s),
+        **s,
+        "time_scale": time_scale,
+        "pairs": pairs,
+        "successes": db.successes,
+        "elapsed_sec": round(elapsed, 3),
+        "pairs_per_sec": round(pairs / elapsed, 2),
+        "upstream_calls": upstream_calls,
+        "calls_per_success": round(upstream_calls / db.successes, 3) if db.successes else None,
+        "p95_pair_latency": round(float(np.percentile(latencies, 95)), 4) if latencies else None,
+        "peak_memory_mb": round(peak / 1024 / 1024, 2),
+        "upstream": {k: v for k, v in sorted(server.stats.items())},
+    }
+
+
+def build_grid(args):
+    names = ("players", "codes", "latency", "rate_limit", "accuracy", "workers", "batch_delay")
+    values = (args.players, args.codes, args.latency, args.rate_limit, args.accuracy, args.workers, args.batch_delay)
+    return [dict(zip(names, combo)) for combo in itertools.product(*values)]
+
+
+def _metric(record, name):
+    if name.startswith("upstream."):
+        return record.get("upstream", {}).get(name.removeprefix("upstream."))
+    return record.get(name)
+
+
+def compare(results, baseline, tolerance, metrics=REGRESSION_METRICS):
+    """
+    Return human-readable changes of ``results`` against ``baseline`` (both
+    lists of records) that moved ``metrics`` the wrong way by more than
+    ``tolerance``.
+    """
+    previous = {r["scenario"]: r for r in baseline}
+    regressions = []
+    for record in results:
+        base = previous.get(record["scenario"])
+        if base is None:
+            continue
+        for metric, direction in metrics.items():
+            old, new = _metric(base, metric), _metric(record, metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (direction == "lower" and change < -tolerance) or (direction == "higher" and change > tolerance):
+                regressions.append(f"{record['scenario']}: {metric} {old} -> {new} ({change:+.0%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--players", type=int, nargs="+", default=[20, 100])
+    parser.add_argument("--codes", type=int, nargs="+", default=[3])
+    parser.add_argument("--latency", type=float, nargs="+", default=[0.1], help="mean upstream latency, seconds")
+    parser.add_argument("--rate-limit", type=float, nargs="+", default=[0.0, 0.05], help="share of requests answered with 429")
+    parser.add_argument("--accuracy", type=float, nargs="+", default=[0.9], help="captcha solver accuracy")
+    parser.add_argument("--workers", type=int, nargs="+", default=[batch_redeemer.MAX_WORKERS])
+    parser.add_argument("--batch-delay", type=float, nargs="+", default=[batch_redeemer.BATCH_DELAY])
+    parser.add_argument("--time-scale", type=float, default=0.01, help="multiplier for every delay and backoff")
+    parser.add_argument("--entry", choices=("df", "main"), default="df", help="process_unredeemed_df or main")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here as well as stdout")
+    parser.add_argument("--baseline", help=f"compare against a baseline report, e.g. {DEFAULT_BASELINE}")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative change before a gated metric regresses")
+    parser.add_argument("--timing-tolerance", type=float, default=0.5,
+                        help="relative change in a timing metric worth a note (never fails the run)")
+    parser.add_argument("--write-baseline", help="write the report as the new baseline")
+    args = parser.parse_args(argv)
+    logging.disable(logging.WARNING)  # batch_redeemer logs every step and every 429
+
+    results = []
+    for s in build_grid(args):
+        record = asyncio.run(run_scenario(s, args.time_scale, args.entry, args.seed))
+        print(json.dumps(record), file=sys.stderr)
+        results.append(record)
+
+    report = json.dumps(results, indent=2)
+    print(report)
+    for path in filter(None, (args.output, args.write_baseline)):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        for line in compare(results, baseline, args.timing_tolerance, TIMING_METRICS):
+            print(f"NOTE {line}", file=sys.stderr)
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
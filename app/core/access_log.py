@@ -0,0 +1,135 @@
+import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+from time import perf_counter
+
+from app.utils import metrics
+
+BODY_PREVIEW_BYTES = 1024
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that hands the record over untouched: the stock prepare()
+    formats the message on the calling thread, which is the event loop here.
+    The queue never leaves the process, so the listener formats it instead.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class AccessLog:
+    """
+    The "access" logger, with its handlers moved off the event loop: while
+    started, records go onto an in-memory queue and a QueueListener thread
+    writes them through the root logger's handlers. Before start() (and
+    after stop()) records propagate to the root logger as usual.
+    """
+
+    def __init__(self, name="access"):
+        self.logger = logging.getLogger(name)
+        self._queue = queue.SimpleQueue()
+        self._handler = _DeferredQueueHandler(self._queue)
+        self._listener: QueueListener | None = None
+
+    def start(self, *handlers):
+        if self._listener is not None:
+            return
+        handlers = handlers or tuple(logging.getLogger().handlers) or (logging.StreamHandler(),)
+        self._listener = QueueListener(self._queue, *handlers, respect_handler_level=True)
+        self._listener.start()
+        self.logger.addHandler(self._handler)
+        self.logger.propagate = False
+
+    def stop(self):
+        if self._listener is None:
+            return
+        self.logger.removeHandler(self._handler)
+        self.logger.propagate = True
+        self._listener.stop()  # flushes whatever is still queued
+        self._listener = None
+
+
+access_log = AccessLog()
+
+
+class AccessLogMiddleware:
+    """
+    Pure ASGI access log: one record per HTTP request with client, method,
+    path, status and duration as structured fields (record attributes).
+    ``route_rates`` maps a path prefix to the fraction of its requests that
+    get logged (the longest matching prefix wins, ``sample_rate`` otherwise);
+    5xx responses are always logged. The request body is never read, only
+    a ``body_rate`` fraction of requests copy the first bytes of it as they
+    stream past to the app. Every request, sampled or not, also feeds the
+    http_* metrics under its route template.
+    """
+
+    def __init__(self, app, sample_rate=1.0, route_rates=None, body_rate=0.0, logger=None, rng=random.random):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.route_rates = sorted((route_rates or {}).items(), key=lambda item: len(item[0]), reverse=True)
+        self.body_rate = body_rate
+        self.logger = logger or access_log.logger
+        self.rng = rng
+
+    def rate_for(self, path):
+        for prefix, rate in self.route_rates:
+            if path == prefix or path.startswith(prefix.rstrip("/") + "/"):
+                return rate
+        return self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = perf_counter()
+        status = 500
+        body = None
+
+        if self.body_rate and self.rng() < self.body_rate:
+            body = bytearray()
+            downstream = receive
+
+            async def receive():
+                message = await downstream()
+                if message["type"] == "http.request" and len(body) < BODY_PREVIEW_BYTES:
+                    body.extend(message.get("body", b"")[:BODY_PREVIEW_BYTES - len(body)])
+                return message
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            elapsed = perf_counter() - start
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            metrics.http_requests.inc(scope["method"], route, status)
+            metrics.http_latency.observe(elapsed, scope["method"], route)
+            rate = self.rate_for(scope["path"])
+            if status >= 500 or rate >= 1 or (rate > 0 and self.rng() < rate):
+                self._log(scope, status, elapsed, body)
+
+    def _log(self, scope, status, elapsed, body):
+        client = scope.get("client")
+        fields = {
+            "client": client[0] if client else None,
+            "method": scope["method"],
+            "path": scope["path"],
+            "status": status,
+            "duration_ms": round(elapsed * 1000, 2),
+        }
+        if body is not None:
+            fields["body"] = bytes(body)
+        # %-style args: the message is only built when the listener formats it
+        self.logger.info(
+            "%s %s %s %s %.1fms", fields["client"], fields["method"], fields["path"], status, fields["duration_ms"],
+            extra=fields,
+        )
@@ -12,6 +12,48 @@ class Settings(BaseSettings):
         "http://localhost",
     ]
     ADMIN_ACTION_PASSWORD: str
+    CAPTCHA_MODEL_VARIANT: str = "fp32"
+    CAPTCHA_SHADOW_VARIANT: str | None = None
+    CAPTCHA_SHADOW_SAMPLE_RATE: float = 0.05
+    WOS_API_URL: str = "https://wos-giftcode-api.centurygame.com/api"
+    HTTP_POOL_LIMIT: int = 20
+    HTTP_POOL_LIMIT_PER_HOST: int = 8
+    HTTP_KEEPALIVE_TIMEOUT: float = 60
+    HTTP_DNS_CACHE_TTL: int = 300
+    HTTP_TOTAL_TIMEOUT: float = 30
+    HTTP_CONNECT_TIMEOUT: float = 10
+    PLAYER_SESSION_MAX: int = 10000
+    PLAYER_SESSION_TTL: float = 1800
+    SELECTION_POLICY: str = "least-recent"
+    DEAD_PLAYER_BACKOFF_BASE: float = 3600
+    DEAD_PLAYER_BACKOFF_MAX: float = 7 * 86400
+    TASK_STORE: str = "postgres"
+    TASK_HISTORY_MAX: int = 50
+    TASK_PROGRESS_FLUSH_SECONDS: float = 1.0
+    TASK_HISTORY_TTL: float = 7 * 86400
+    SCHEDULER_ENABLED: bool = True
+    SCHEDULE_FETCH_INTERVAL: float = 3600
+    SCHEDULE_PROBE_INTERVAL: float = 6 * 3600
+    SCHEDULE_REDEEM_INTERVAL: float = 2 * 3600
+    SCHEDULE_REDEEM_BATCH: int = 20
+    SCHEDULE_REFRESH_INTERVAL: float = 24 * 3600
+    SCHEDULE_JITTER: float = 0.1
+    CODE_RUN_TIMEOUT: float = 900
+    SHUTDOWN_GRACE_SECONDS: float = 20
+    UPSTREAM_RATE_LIMIT: float = 10
+    UPSTREAM_RATE_BURST: int = 10
+    BULK_LOGIN_CONCURRENCY: int = 8
+    ACCESS_LOG_SAMPLE_RATE: float = 1.0
+    ACCESS_LOG_ROUTE_SAMPLE_RATES: dict[str, float] = {}
+    ACCESS_LOG_BODY_SAMPLE_RATE: float = 0.0
+    TRACE_ENABLED: bool = False
+    TRACE_BUFFER_SPANS: int = 2000
+    TRACE_FILE: str | None = None
+    BREAKER_FAILURE_RATE: float = 0.5
+    BREAKER_WINDOW: int = 20
+    BREAKER_MIN_CALLS: int = 8
+    BREAKER_OPEN_SECONDS: float = 30
+    BREAKER_MAX_TRIPS: int = 3
 
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -0,0 +1,80 @@
+import logging
+import aiohttp
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_session: aiohttp.ClientSession | None = None
+
+# Filled in by the trace hooks below for every session built by create_http_session().
+connection_stats = {"requests": 0, "connections_created": 0, "connections_reused": 0}
+
+
+async def _on_request_start(session, ctx, params):
+    connection_stats["requests"] += 1
+
+
+async def _on_connection_create_end(session, ctx, params):
+    connection_stats["connections_created"] += 1
+
+
+async def _on_connection_reuseconn(session, ctx, params):
+    connection_stats["connections_reused"] += 1
+
+
+def _trace_config():
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(_on_request_start)
+    trace.on_connection_create_end.append(_on_connection_create_end)
+    trace.on_connection_reuseconn.append(_on_connection_reuseconn)
+    return trace
+
+
+def create_http_session() -> aiohttp.ClientSession:
+    """Build a ClientSession with a keep-alive connection pool tuned for the WOS API."""
+    connector = aiohttp.TCPConnector(
+        limit=settings.HTTP_POOL_LIMIT,
+        limit_per_host=settings.HTTP_POOL_LIMIT_PER_HOST,
+        ttl_dns_cache=settings.HTTP_DNS_CACHE_TTL,
+        keepalive_timeout=settings.HTTP_KEEPALIVE_TIMEOUT,
+        enable_cleanup_closed=True,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=settings.HTTP_TOTAL_TIMEOUT,
+        connect=settings.HTTP_CONNECT_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=[_trace_config()])
+
+
+async def open_http_session() -> aiohttp.ClientSession:
+    """Create the application-scoped session (called from lifespan)."""
+    global _session
+    if _session is None or _session.closed:
+        _session = create_http_session()
+        logger.info("Shared HTTP session opened.")
+    return _session
+
+
+async def close_http_session():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+        logger.info("Shared HTTP session closed.")
+
+
+def get_http_session() -> aiohttp.ClientSession | None:
+    """Return the shared session, or None outside the app (callers then own a private one)."""
+    if _session is None or _session.closed:
+        return None
+    return _session
+
+
+def http_stats():
+    created = connection_stats["connections_created"]
+    reused = connection_stats["connections_reused"]
+    return {
+        **connection_stats,
+        "reuse_ratio": round(reused / (created + reused), 4) if created + reused else None,
+        "shared_session_open": get_http_session() is not None,
+    }
@@ -1,31 +1,47 @@
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from app.core.config import settings
+from app.core.http import open_http_session, close_http_session
+from app.core.access_log import access_log
+from app.utils.tracing import tracer
 from app.db.supabase import init_db, add_player
-from app.utils.wos_api import PlayerAPI
+from app.services.player_api import get_player_api, close_player_api
+from app.services.scheduler import scheduler
+from app.services.jobs import start_code_runs, drain
+from app.services.code_runs import code_runs
 
 is_ready: bool = False  # exported
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    access_log.start()
+    tracer.start_export()
     init_db()
+    await open_http_session()
 
     # local dev: ensure .env is loaded via pydantic settings (already handled)
     if not settings.RENDER and settings.DEFAULT_PLAYER:
         async def init_default_player():
-            api = None
-            try:
-                api = PlayerAPI()
-                login = await api.login_player(settings.DEFAULT_PLAYER, settings.SALT)
-                if not login:
-                    raise RuntimeError("DEFAULT_PLAYER login failed.")
-                add_player(login["token"])
-            finally:
-                if api:
-                    await api.close_session()
+            login = await get_player_api().login_player(settings.DEFAULT_PLAYER, settings.SALT, refresh=True)
+            if not login:
+                raise RuntimeError("DEFAULT_PLAYER login failed.")
+            add_player(login["token"])
         await init_default_player()
 
     global is_ready
     is_ready = True
 
-    yield
+    start_code_runs()
+    if settings.SCHEDULER_ENABLED:
+        scheduler.start()
+
+    try:
+        yield
+    finally:
+        await scheduler.stop()
+        await code_runs.stop()
+        await drain(settings.SHUTDOWN_GRACE_SECONDS)
+        await close_player_api()
+        await close_http_session()
+        tracer.stop_export()
+        access_log.stop()
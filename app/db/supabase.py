@@ -1,11 +1,16 @@
 from app.core.config import settings
+from app.utils import metrics
+from app.utils.tracing import tracer
 from datetime import datetime, timezone
+from time import perf_counter
+import functools
 import logging
 
 import psycopg
 from psycopg import errors
 from psycopg import sql
 from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -28,6 +33,25 @@ def _now():
     return datetime.now(timezone.utc)
 
 
+def _timed(fn):
+    """
+    Time a DB entry point into the db_latency histogram and, inside a traced
+    pair, trace it as a "db.<name>" span. Not for generators: their queries
+    run while the caller iterates, not inside the call.
+    """
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            with tracer.span(f"db.{name}"):
+                return fn(*args, **kwargs)
+        finally:
+            metrics.db_latency.observe(perf_counter() - start, name)
+    return wrapper
+
+
 def _normalize_player_id(player_id):
     if player_id is None:
         return player_id
@@ -76,6 +100,7 @@ def _ensure_timestamp_column(cursor, table_name, column_name, default_sql=None):
         ))
 
 
+@_timed
 def init_db():
     """Initialize the database."""
     with _connect() as conn:
@@ -124,12 +149,82 @@ def init_db():
                 )
             """)
 
+            # One row per (player, code) ever attempted; drives fair work selection
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS redemption_attempts (
+                    player_id TEXT NOT NULL,
+                    code TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_attempt TIMESTAMPTZ,
+                    last_outcome TEXT,
+                    PRIMARY KEY (player_id, code)
+                )
+            """)
+            # Negative caches: fids whose login keeps failing, and codes a player can't redeem
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS player_login_failures (
+                    player_id TEXT PRIMARY KEY,
+                    failures INTEGER NOT NULL DEFAULT 0,
+                    last_failure TIMESTAMPTZ,
+                    retry_after TIMESTAMPTZ
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS ineligible_pairs (
+                    player_id TEXT NOT NULL,
+                    code TEXT NOT NULL,
+                    reason TEXT,
+                    recorded_at TIMESTAMPTZ,
+                    PRIMARY KEY (player_id, code)
+                )
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS redemptions_player_code_idx
+                ON redemptions (player_id, code)
+            """)
+
+            # Task state shared by every API worker process
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    progress INTEGER NOT NULL DEFAULT 0,
+                    record JSONB NOT NULL,
+                    cancel_requested BOOLEAN NOT NULL DEFAULT FALSE,
+                    created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cursor.execute("""
+                ALTER TABLE tasks
+                ADD COLUMN IF NOT EXISTS cancel_requested BOOLEAN NOT NULL DEFAULT FALSE
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS tasks_processing_idx
+                ON tasks (updated_at DESC) WHERE status = 'Processing'
+            """)
+
+            # Last-run state and overrides of the in-process scheduler (app.services.scheduler)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS schedule_state (
+                    job TEXT PRIMARY KEY,
+                    interval_seconds DOUBLE PRECISION,
+                    jitter DOUBLE PRECISION,
+                    enabled BOOLEAN,
+                    last_run_at TIMESTAMPTZ,
+                    last_status TEXT,
+                    last_detail JSONB,
+                    updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
             _ensure_timestamp_column(cursor, "players", "subscribed_date")
             _ensure_timestamp_column(cursor, "giftcodes", "created_date")
             _ensure_timestamp_column(cursor, "giftcodes", "last_checked", "CURRENT_TIMESTAMP")
             _ensure_timestamp_column(cursor, "redemptions", "redeemed_date")
 
 
+@_timed
 def add_player(player_data):
     """Add a new player to the database."""
     try:
@@ -163,6 +258,62 @@ def add_player(player_data):
         logger.info(f"Player '{player_data['fid']}' already exists.")
 
 
+# Profile columns as returned by the player endpoint, typed for jsonb_to_recordset()
+_PROFILE_RECORD = """
+    fid TEXT,
+    nickname TEXT,
+    kid INTEGER,
+    stove_lv INTEGER,
+    stove_lv_content TEXT,
+    avatar_image TEXT,
+    total_recharge_amount INTEGER
+"""
+PROFILE_FIELDS = ("fid", "nickname", "kid", "stove_lv", "stove_lv_content", "avatar_image", "total_recharge_amount")
+
+
+def _profile_rows(profiles):
+    """Profile dicts reduced to PROFILE_FIELDS, one per fid (the last one wins)."""
+    rows = {}
+    for profile in profiles:
+        row = {field: profile.get(field) for field in PROFILE_FIELDS}
+        row["fid"] = _normalize_player_id(row["fid"])
+        rows[row["fid"]] = row
+    return list(rows.values())
+
+
+@_timed
+def upsert_players(profiles):
+    """
+    Insert many player profiles in one statement; fids already subscribed get
+    their profile refreshed instead. Returns {fid: "added" | "updated"}.
+    """
+    rows = _profile_rows(profiles)
+    if not rows:
+        return {}
+    with _connect() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(sql.SQL("""
+                INSERT INTO players (
+                    fid, nickname, kid, stove_lv, stove_lv_content, avatar_image, total_recharge_amount, subscribed_date
+                )
+                SELECT fid, nickname, kid, stove_lv, stove_lv_content, avatar_image, total_recharge_amount, %s
+                FROM jsonb_to_recordset(%s) AS p({record})
+                ON CONFLICT (fid)
+                DO UPDATE SET
+                    nickname = EXCLUDED.nickname,
+                    kid = EXCLUDED.kid,
+                    stove_lv = EXCLUDED.stove_lv,
+                    stove_lv_content = EXCLUDED.stove_lv_content,
+                    avatar_image = EXCLUDED.avatar_image,
+                    total_recharge_amount = EXCLUDED.total_recharge_amount
+                RETURNING fid, (xmax = 0) AS inserted
+            """).format(record=sql.SQL(_PROFILE_RECORD)), (_now(), Jsonb(rows)))
+            results = {fid: "added" if inserted else "updated" for fid, inserted in cursor.fetchall()}
+    logger.info(f"Upserted {len(results)} player(s).")
+    return results
+
+
+@_timed
 def update_player(player_data):
     """Update a player in the database."""
     try:
@@ -184,6 +335,7 @@ def update_player(player_data):
         logger.info(f"Player '{player_data['fid']}' info failed to update.")
 
 
+@_timed
 def remove_player(fid):
     """Removes a player from the database."""
     fid = _normalize_player_id(fid)
@@ -204,6 +356,24 @@ def remove_player(fid):
         return response
 
 
+@_timed
+def get_player_ids(skip_backed_off=False):
+    """Every subscribed fid; with ``skip_backed_off``, minus those still backing off after failed logins."""
+    query = "SELECT fid FROM players p"
+    if skip_backed_off:
+        query += """
+            WHERE NOT EXISTS (
+                SELECT 1 FROM player_login_failures f
+                WHERE f.player_id = p.fid AND f.retry_after > CURRENT_TIMESTAMP
+            )
+        """
+    with _connect() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(query + " ORDER BY fid")
+            return [row[0] for row in cursor.fetchall()]
+
+
+@_timed
 def get_players():
     """Retrieve all subscribed players."""
     with _connect(row_factory=dict_row) as conn:
@@ -246,6 +416,7 @@ def get_players():
     return players
 
 
+@_timed
 def add_giftcode(code):
     """
     Add a new gift code.
@@ -294,6 +465,7 @@ def add_giftcode(code):
         return None
 
 
+@_timed
 def get_giftcodes():
     """Retrieve all gift codes."""
     with _connect() as conn:
@@ -303,6 +475,7 @@ def get_giftcodes():
     return codes
 
 
+@_timed
 def get_giftcodes_unchecked(default_player: str | None = None):
     """Retrieve all gift codes that have not been checked in the last 24 hours.
 
@@ -335,6 +508,7 @@ def get_giftcodes_unchecked(default_player: str | None = None):
     return codes
 
 
+@_timed
 def deactivate_giftcode(code):
     """Set the status of a specific gift code to 'Inactive'."""
     try:
@@ -359,6 +533,7 @@ def deactivate_giftcode(code):
         return message
 
 
+@_timed
 def record_redemption(player_id, code):
     """Record a gift code redemption for a player."""
     player_id = _normalize_player_id(player_id)
@@ -371,6 +546,37 @@ def record_redemption(player_id, code):
     logger.info(f"Redemption recorded: Player '{player_id}' redeemed code '{code}'.")
 
 
+@_timed
+def record_run_results(redeemed=(), expired=(), captcha_ids=(), checked=()):
+    """
+    Write what a batch run collected in one transaction, one statement per
+    kind: redemptions ({"fid", "code"} dicts), codes found expired, captchas
+    that were solved correctly and codes the default player checked.
+    """
+    now = _now()
+    with _connect() as conn:
+        with conn.cursor() as cursor:
+            if redeemed:
+                cursor.executemany("""
+                    INSERT INTO redemptions (player_id, code, redeemed_date)
+                    VALUES (%s, %s, %s)
+                """, [(_normalize_player_id(item["fid"]), item["code"], now) for item in redeemed])
+            if expired:
+                cursor.execute("""
+                    UPDATE giftcodes SET status = 'Inactive'
+                    WHERE code = ANY(%s) AND status != 'Inactive'
+                """, (list(expired),))
+            if captcha_ids:
+                cursor.execute("UPDATE captchas SET feedback = TRUE WHERE id = ANY(%s)", (list(captcha_ids),))
+            if checked:
+                cursor.execute("UPDATE giftcodes SET last_checked = %s WHERE code = ANY(%s)", (now, list(checked)))
+    logger.info(
+        f"Recorded {len(redeemed)} redemption(s), {len(expired)} expired code(s), "
+        f"{len(captcha_ids)} solved captcha(s) and {len(checked)} checked code(s)."
+    )
+
+
+@_timed
 def get_redeemed_codes(player_id):
     """Get all redeemed codes for a player."""
     player_id = _normalize_player_id(player_id)
@@ -381,49 +587,388 @@ def get_redeemed_codes(player_id):
     return redeemed_codes
 
 
+@_timed
 def update_players_table(player_data_list):
-    """Update players' information from a DataFrame."""
-    try:
-        with _connect() as conn:
-            with conn.cursor() as cursor:
-                for player_data in player_data_list:
-                    player_data = _normalize_player_data(player_data)
-                    cursor.execute("""
-                        UPDATE players
-                        SET nickname = %(nickname)s,
-                            kid = %(kid)s,
-                            stove_lv = %(stove_lv)s,
-                            stove_lv_content = %(stove_lv_content)s,
-                            avatar_image = %(avatar_image)s,
-                            total_recharge_amount = %(total_recharge_amount)s
-                        WHERE fid = %(fid)s
-                    """, player_data)
-        logger.info("Players updated successfully.")
-    except errors.IntegrityError as e:
-        logger.error(f"An error occurred: {e}")
-
-
+    """
+    Refresh many player profiles in one statement. Only rows whose profile
+    actually changed are written; returns the fids that were.
+    """
+    rows = _profile_rows(player_data_list)
+    if not rows:
+        return []
+    with _connect() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(sql.SQL("""
+                UPDATE players p
+                SET nickname = n.nickname,
+                    kid = n.kid,
+                    stove_lv = n.stove_lv,
+                    stove_lv_content = n.stove_lv_content,
+                    avatar_image = n.avatar_image,
+                    total_recharge_amount = n.total_recharge_amount
+                FROM jsonb_to_recordset(%s) AS n({record})
+                WHERE p.fid = n.fid
+                  AND (p.nickname, p.kid, p.stove_lv, p.stove_lv_content, p.avatar_image, p.total_recharge_amount)
+                      IS DISTINCT FROM
+                      (n.nickname, n.kid, n.stove_lv, n.stove_lv_content, n.avatar_image, n.total_recharge_amount)
+                RETURNING p.fid
+            """).format(record=sql.SQL(_PROFILE_RECORD)), (Jsonb(rows),))
+            changed = [row[0] for row in cursor.fetchall()]
+    logger.info(f"Refreshed {len(changed)} of {len(rows)} player profile(s).")
+    return changed
+
+
+# Unredeemed (fid, code) pairs minus the negative caches: ineligible pairs and
+# fids whose login failures are still backing off.
+_PENDING_PAIRS_SQL = """
+    SELECT p.fid, g.code
+    FROM players p
+    CROSS JOIN giftcodes g
+    LEFT JOIN redemptions r
+        ON p.fid = r.player_id
+        AND g.code = r.code
+        AND r.redeemed_date >= g.created_date
+    WHERE r.code IS NULL
+      AND g.status = 'Active'
+      AND p.fid != %s
+      AND NOT EXISTS (
+          SELECT 1 FROM ineligible_pairs i
+          WHERE i.player_id = p.fid AND i.code = g.code
+      )
+      AND NOT EXISTS (
+          SELECT 1 FROM player_login_failures f
+          WHERE f.player_id = p.fid AND f.retry_after > CURRENT_TIMESTAMP
+      )
+"""
+
+
+@_timed
 def get_unredeemed_code_player_list():
     with _connect(row_factory=dict_row) as conn:
         with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT p.fid, g.code
-                FROM players p
-                CROSS JOIN giftcodes g
-                LEFT JOIN redemptions r
-                    ON p.fid = r.player_id
-                    AND g.code = r.code
-                    AND r.redeemed_date >= g.created_date
-                WHERE r.code IS NULL
-                  AND g.status = 'Active'
-                  AND p.fid != %s
-            """, (settings.DEFAULT_PLAYER,))
+            cursor.execute(_PENDING_PAIRS_SQL, (settings.DEFAULT_PLAYER,))
 
             unredeemed_codes_players = cursor.fetchall()
 
     return unredeemed_codes_players
 
 
+@_timed
+def get_unredeemed_pairs_for_code(code):
+    """Every player still pending for one code, as {"fid", "code"} rows."""
+    with _connect(row_factory=dict_row) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(sql.SQL("""
+                SELECT pending.fid, pending.code
+                FROM ({pending}) pending
+                WHERE pending.code = %s
+            """).format(pending=sql.SQL(_PENDING_PAIRS_SQL)), (settings.DEFAULT_PLAYER, code))
+
+            return cursor.fetchall()
+
+
+# ORDER BY clause per selection policy for select_unredeemed_pairs(). Every policy
+# sorts the whole pending set (players x active codes, joined to its attempt rows by
+# primary key), so no index on redemption_attempts can serve the ORDER BY itself.
+SELECTION_POLICIES = {
+    # pairs never tried first, then the ones tried longest ago
+    "least-recent": "a.last_attempt ASC NULLS FIRST, g.created_date DESC",
+    # newest codes first (they expire soonest after release), least recent within a code
+    "newest-code": "g.created_date DESC NULLS LAST, a.last_attempt ASC NULLS FIRST",
+    # random sample without replacement (Efraimidis-Spirakis) weighted by 1 / (1 + attempts):
+    # pairs that keep failing are still picked, just less often. It does not look at outcomes.
+    "fewer-attempts-weighted": "-LN(1.0 - RANDOM()) * (1 + COALESCE(a.attempts, 0))",
+}
+
+
+@_timed
+def select_unredeemed_pairs(limit, policy="least-recent", exclude_codes=()):
+    """
+    Pick up to ``limit`` unredeemed (fid, code) pairs according to ``policy``
+    (see SELECTION_POLICIES), using the attempt history in redemption_attempts.
+    Pairs of ``exclude_codes`` (codes with a code-scoped run) are left out.
+    """
+    order_by = SELECTION_POLICIES.get(policy)
+    if order_by is None:
+        raise ValueError(f"Unknown selection policy '{policy}'. Known: {', '.join(SELECTION_POLICIES)}")
+
+    with _connect(row_factory=dict_row) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(sql.SQL("""
+                SELECT pending.fid, pending.code
+                FROM ({pending}) pending
+                JOIN giftcodes g ON g.code = pending.code
+                LEFT JOIN redemption_attempts a
+                    ON a.player_id = pending.fid
+                    AND a.code = pending.code
+                WHERE NOT (pending.code = ANY(%s))
+                ORDER BY {order_by}
+                LIMIT %s
+            """).format(pending=sql.SQL(_PENDING_PAIRS_SQL), order_by=sql.SQL(order_by)),
+                (settings.DEFAULT_PLAYER, list(exclude_codes), limit))
+
+            return cursor.fetchall()
+
+
+@_timed
+def record_attempts(attempts):
+    """Upsert attempt bookkeeping for a batch of {"fid", "code", "outcome"} dicts."""
+    if not attempts:
+        return
+    now = _now()
+    with _connect() as conn:
+        with conn.cursor() as cursor:
+            cursor.executemany("""
+                INSERT INTO redemption_attempts (player_id, code, attempts, last_attempt, last_outcome)
+                VALUES (%s, %s, 1, %s, %s)
+                ON CONFLICT (player_id, code)
+                DO UPDATE SET
+                    attempts = redemption_attempts.attempts + 1,
+                    last_attempt = EXCLUDED.last_attempt,
+                    last_outcome = EXCLUDED.last_outcome
+            """, [
+                (_normalize_player_id(item["fid"]), item["code"], now, item.get("outcome"))
+                for item in attempts
+            ])
+    logger.info(f"Recorded {len(attempts)} redemption attempts.")
+
+
+@_timed
+def record_login_failures(player_ids):
+    """
+    Back off fids whose login failed: the first failure hides the fid from
+    pending work for DEAD_PLAYER_BACKOFF_BASE seconds, each further one
+    doubles that, up to DEAD_PLAYER_BACKOFF_MAX.
+    """
+    if not player_ids:
+        return
+    now = _now()
+    base, cap = settings.DEAD_PLAYER_BACKOFF_BASE, settings.DEAD_PLAYER_BACKOFF_MAX
+    with _connect() as conn:
+        with conn.cursor() as cursor:
+            cursor.executemany("""
+                INSERT INTO player_login_failures (player_id, failures, last_failure, retry_after)
+                VALUES (%(fid)s, 1, %(now)s, %(now)s + make_interval(secs => %(base)s))
+                ON CONFLICT (player_id)
+                DO UPDATE SET
+                    failures = player_login_failures.failures + 1,
+                    last_failure = EXCLUDED.last_failure,
+                    retry_after = EXCLUDED.last_failure + make_interval(
+                        secs => LEAST(%(cap)s, %(base)s * POWER(2, player_login_failures.failures))
+                    )
+            """, [
+                {"fid": _normalize_player_id(fid), "now": now, "base": base, "cap": cap}
+                for fid in player_ids
+            ])
+    logger.info(f"Backed off {len(player_ids)} player(s) after failed logins.")
+
+
+@_timed
+def clear_login_failures(player_ids):
+    """Forget past login failures for fids that logged in again."""
+    if not player_ids:
+        return
+    with _connect() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM player_login_failures WHERE player_id = ANY(%s)",
+                ([_normalize_player_id(fid) for fid in player_ids],),
+            )
+
+
+@_timed
+def record_ineligible(pairs):
+    """Mark (fid, code) pairs the player can't redeem, given as {"fid", "code", "outcome"} dicts."""
+    if not pairs:
+        return
+    now = _now()
+    with _connect() as conn:
+        with conn.cursor() as cursor:
+            cursor.executemany("""
+                INSERT INTO ineligible_pairs (player_id, code, reason, recorded_at)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (player_id, code) DO NOTHING
+            """, [
+                (_normalize_player_id(item["fid"]), item["code"], item.get("outcome"), now)
+                for item in pairs
+            ])
+    logger.info(f"Recorded {len(pairs)} ineligible player/code pair(s).")
+
+
+# Key of the session-level advisory lock held for the whole of a batch run.
+JOB_LOCK_KEY = 7_301_001
+# Held by the one worker process that runs the scheduler.
+SCHEDULER_LOCK_KEY = 7_301_002
+
+
+@_timed
+def acquire_job_lock(key=JOB_LOCK_KEY):
+    """
+    Try to take the batch-run advisory lock (or another one by ``key``).
+    Returns the connection holding it (keep it open for the run, then pass
+    it to release_job_lock), or None if another process already holds it.
+    A crashed holder's connection closes and releases the lock with it.
+    """
+    conn = psycopg.connect(_database_url(), autocommit=True)
+    try:
+        acquired = conn.execute("SELECT pg_try_advisory_lock(%s)", (key,)).fetchone()[0]
+    except Exception:
+        conn.close()
+        raise
+    if not acquired:
+        conn.close()
+        return None
+    return conn
+
+
+@_timed
+def release_job_lock(conn, key=JOB_LOCK_KEY):
+    try:
+        conn.execute("SELECT pg_advisory_unlock(%s)", (key,))
+    finally:
+        conn.close()
+
+
+@_timed
+def open_claims_connection():
+    """A connection to hold one run's claim locks (see try_claims); closing it drops them all."""
+    return psycopg.connect(_database_url(), autocommit=True)
+
+
+@_timed
+def try_claims(conn, keys):
+    """
+    Try to take a session advisory lock on ``conn`` for each text key, in one
+    round trip. Returns one bool per key: False where another session holds it.
+    """
+    rows = conn.execute("""
+        SELECT pg_try_advisory_lock(hashtextextended(k.key, 0))
+        FROM unnest(%s::text[]) WITH ORDINALITY AS k(key, i)
+        ORDER BY k.i
+    """, (list(keys),)).fetchall()
+    return [row[0] for row in rows]
+
+
+@_timed
+def release_claims(conn, keys):
+    conn.execute("SELECT pg_advisory_unlock(hashtextextended(k, 0)) FROM unnest(%s::text[]) AS k", (list(keys),))
+
+
+@_timed
+def upsert_task(task_id, record):
+    """
+    Write a task's status record (already JSON-friendly) to the shared tasks
+    table. Returns True if another worker has asked for the task to be
+    cancelled (see request_task_cancel).
+    """
+    with _connect() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO tasks (task_id, status, progress, record, created_at, updated_at)
+                VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                ON CONFLICT (task_id)
+                DO UPDATE SET
+                    status = EXCLUDED.status,
+                    progress = EXCLUDED.progress,
+                    record = EXCLUDED.record,
+                    updated_at = CURRENT_TIMESTAMP
+                RETURNING cancel_requested
+            """, (task_id, record.get("status"), int(record.get("progress", 0)), Jsonb(record)))
+            row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+@_timed
+def request_task_cancel(task_id):
+    """Flag a Processing task for cancellation by whichever worker runs it; False if it isn't running."""
+    with _connect() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE tasks
+                SET cancel_requested = TRUE
+                WHERE task_id = %s AND status = 'Processing'
+            """, (task_id,))
+            return cursor.rowcount > 0
+
+
+@_timed
+def get_task(task_id):
+    with _connect() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT record FROM tasks WHERE task_id = %s", (task_id,))
+            row = cursor.fetchone()
+    return row[0] if row else None
+
+
+@_timed
+def get_inflight_task():
+    """
+    Most recently updated batch run still marked Processing (code-scoped runs
+    aside), or None. A Processing row only counts while some worker holds the
+    batch-run lock, so rows left behind by a crashed worker are ignored.
+    """
+    with _connect() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT task_id FROM tasks
+                WHERE status = 'Processing' AND record->>'code' IS NULL
+                  AND EXISTS (
+                      SELECT 1 FROM pg_locks
+                      WHERE locktype = 'advisory' AND classid = 0 AND objid = %s AND granted
+                  )
+                ORDER BY updated_at DESC
+                LIMIT 1
+            """, (JOB_LOCK_KEY,))
+            row = cursor.fetchone()
+    return row[0] if row else None
+
+
+@_timed
+def fail_orphaned_tasks(except_task_id, stale_after=86400):
+    """
+    Mark batch runs still Processing other than ``except_task_id`` as failed
+    (their process died mid-run). Code-scoped runs hold no lock, so they
+    only count as orphaned once not updated for ``stale_after`` seconds.
+    """
+    with _connect() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE tasks
+                SET status = 'Failed',
+                    progress = 100,
+                    record = record || '{"status": "Failed", "progress": 100, "error": "Interrupted: the worker running this task stopped."}'::jsonb,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE status = 'Processing' AND task_id != %s
+                  AND (
+                      record->>'code' IS NULL
+                      OR updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                  )
+            """, (except_task_id, stale_after))
+            return cursor.rowcount
+
+
+@_timed
+def delete_finished_tasks(keep, ttl_seconds):
+    """Keep at most ``keep`` finished tasks, none older than ``ttl_seconds``."""
+    with _connect() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                DELETE FROM tasks
+                WHERE status != 'Processing'
+                  AND (
+                      updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                      OR task_id NOT IN (
+                          SELECT task_id FROM tasks
+                          WHERE status != 'Processing'
+                          ORDER BY updated_at DESC
+                          LIMIT %s
+                      )
+                  )
+            """, (ttl_seconds, keep))
+            return cursor.rowcount
+
+
+@_timed
 def record_captcha(name, img_data):
     """Record a captcha image with a name."""
     with _connect() as conn:
@@ -438,6 +983,24 @@ def record_captcha(name, img_data):
     return generated_id
 
 
+def iter_labeled_captchas(limit=None, itersize=500):
+    """Stream captchas confirmed correct by a successful redemption as (id, name, img) rows."""
+    query = "SELECT id, name, img FROM captchas WHERE feedback = TRUE ORDER BY id"
+    params = []
+    if limit:
+        query += " LIMIT %s"
+        params = [limit]
+
+    with _connect() as conn:
+        # Named cursor keeps the result set server-side instead of loading every image at once.
+        with conn.cursor(name="labeled_captchas") as cursor:
+            cursor.itersize = itersize
+            cursor.execute(query, params)
+            for captcha_id, name, img in cursor:
+                yield captcha_id, name, bytes(img)
+
+
+@_timed
 def update_captcha_feedback(captcha_id):
     """Update the feedback for a specific captcha."""
     with _connect() as conn:
@@ -446,6 +1009,7 @@ def update_captcha_feedback(captcha_id):
     logger.info(f"Captcha ID '{captcha_id}' feedback set to TRUE.")
 
 
+@_timed
 def update_giftcode_checkedtime(code):
     """Update the last checked time for a specific gift code."""
     with _connect() as conn:
@@ -458,5 +1022,47 @@ def update_giftcode_checkedtime(code):
     logger.info(f"Gift code '{code}' last checked time updated.")
 
 
+@_timed
+def get_schedule_state():
+    """Persisted scheduler state, job name -> row (NULL columns mean "use the configured default")."""
+    with _connect(row_factory=dict_row) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT job, interval_seconds, jitter, enabled, last_run_at, last_status, last_detail
+                FROM schedule_state
+            """)
+            return {row.pop("job"): row for row in cursor.fetchall()}
+
+
+@_timed
+def save_schedule_state(job, state):
+    """Upsert one job's interval/jitter/enabled and last-run columns."""
+    with _connect() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO schedule_state (
+                    job, interval_seconds, jitter, enabled, last_run_at, last_status, last_detail, updated_at
+                )
+                VALUES (%s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+                ON CONFLICT (job)
+                DO UPDATE SET
+                    interval_seconds = EXCLUDED.interval_seconds,
+                    jitter = EXCLUDED.jitter,
+                    enabled = EXCLUDED.enabled,
+                    last_run_at = EXCLUDED.last_run_at,
+                    last_status = EXCLUDED.last_status,
+                    last_detail = EXCLUDED.last_detail,
+                    updated_at = CURRENT_TIMESTAMP
+            """, (
+                job,
+                state.get("interval_seconds"),
+                state.get("jitter"),
+                state.get("enabled"),
+                state.get("last_run_at"),
+                state.get("last_status"),
+                Jsonb(state["last_detail"]) if state.get("last_detail") is not None else None,
+            ))
+
+
 if __name__ == "__main__":
     init_db()
@@ -1,14 +1,15 @@
 import logging
-from time import time
-from datetime import datetime
+from time import monotonic
 from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.lifespan import lifespan
 from app.core.config import settings
-from app.api.routers import health, players, giftcodes, redemptions, tasks
+from app.core.access_log import AccessLogMiddleware
+from app.api.routers import health, players, giftcodes, redemptions, tasks, metrics
+from app.utils.circuit_breaker import CircuitOpenError
 
 logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger("request_logger")
 
 app = FastAPI(
     title="Gift Code Redemption API",
@@ -26,17 +27,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    start = time()
-    try:
-        body = (await request.body())[:1024]
-        logger.info(f"{request.client.host} {request.method} {request.url} body={body!r}")
-    except Exception:
-        logger.info(f"{request.client.host} {request.method} {request.url} body=<unavailable>")
-    response = await call_next(request)
-    logger.info(f"Status {response.status_code} in {time()-start:.2f}s @ {datetime.now():%m/%d/%Y %H:%M:%S}")
-    return response
+# Added last so it is outermost and times the whole stack
+app.add_middleware(
+    AccessLogMiddleware,
+    sample_rate=settings.ACCESS_LOG_SAMPLE_RATE,
+    route_rates=settings.ACCESS_LOG_ROUTE_SAMPLE_RATES,
+    body_rate=settings.ACCESS_LOG_BODY_SAMPLE_RATE,
+)
+
+@app.exception_handler(CircuitOpenError)
+async def upstream_unavailable(request: Request, exc: CircuitOpenError):
+    retry_after = max(1, int(exc.retry_at - monotonic()))
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Upstream gift code API unavailable, try again later."},
+        headers={"Retry-After": str(retry_after)},
+    )
 
 # Include routers
 app.include_router(health.router)
@@ -44,3 +50,4 @@ app.include_router(players.router)
 app.include_router(giftcodes.router)
 app.include_router(redemptions.router)
 app.include_router(tasks.router)
+app.include_router(metrics.router)
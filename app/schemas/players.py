@@ -1,4 +1,7 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 class Player(BaseModel):
     player_id: str
+
+class PlayerBulk(BaseModel):
+    player_ids: list[str] = Field(min_length=1, max_length=1000)
@@ -1,4 +1,9 @@
 from pydantic import BaseModel
 
 class AutomationRequest(BaseModel):
-    n: str = "all"
\ No newline at end of file
+    n: str = "all"
+
+class ScheduleUpdate(BaseModel):
+    interval: float | None = None
+    jitter: float | None = None
+    enabled: bool | None = None
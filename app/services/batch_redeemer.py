@@ -1,199 +1,418 @@
 from app.db.supabase import (
     init_db, add_player, get_players, add_giftcode, get_giftcodes, get_giftcodes_unchecked,
-    deactivate_giftcode,
-    record_redemption, get_redeemed_codes, update_players_table, update_player, get_unredeemed_code_player_list,
-    record_captcha, update_captcha_feedback, update_giftcode_checkedtime
+    get_redeemed_codes, update_players_table, get_unredeemed_code_player_list,
+    record_captcha, record_run_results,
+    select_unredeemed_pairs, record_attempts, record_login_failures, clear_login_failures, record_ineligible,
+    get_unredeemed_pairs_for_code
 )
-from app.utils.captcha_solver import CaptchaSolver
+from app.utils.captcha_solver import get_solver, shadow_stats
 from app.utils.fetch_gc_async import fetch_latest_codes_async
-from app.utils.wos_api import PlayerAPI
+from app.utils.wos_api import LoginUnavailable, PlayerCooldown, UpstreamBackoff
+from app.utils.circuit_breaker import CircuitOpenError
+from app.utils import metrics
+from app.utils.tracing import tracer
+from app.utils.outcome_policy import get_policy, track_run, DONE, EXPIRED, INELIGIBLE, RELOGIN, GIVE_UP
+from app.services.player_api import get_player_api
+from app.services.task_registry import TaskRegistry
+from app.services.task_events import task_events
+from app.services.code_runs import code_runs
+from app.services.claims import open_claims
 from app.core.config import settings
-from collections import defaultdict
+from collections import defaultdict, deque
+from contextvars import ContextVar
 import asyncio
-import json
+import heapq
+import itertools
 import logging
 import os
 import pandas as pd
-import shutil
+import time
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 player_api = None
-solve_captcha = CaptchaSolver()
+_active_runs = 0          # main() and run_code() calls sharing player_api
 
 BATCH_DELAY = 1           # 1 second delay
 MAX_WORKERS = 3           # adjust based on your rate limit
 SALT = os.getenv("SALT")
-CACHE_DIR = "./cache"
-error_codes = json.load(open(settings.ERROR_CODES_FILE, "r"))
+# Rows collected per run by create_cache()
+CACHE_TYPES = ("expired_giftcode", "redeemed_giftcode", "success_captcha", "players", "checked_giftcode")
+policy = get_policy()
+LOGIN_FAILED = "login_failed"
+LOGIN_UNAVAILABLE = "login_unavailable"  # transient; the fid is not backed off as dead
+IN_PROGRESS = "in_progress"  # reported for pairs another run is already working
+CLAIM_RETRY = 2           # seconds before looking again at a fid another run is working
+
+# {"fid", "code", "outcome"} per finished pair of the current run (see track_attempts)
+_run_attempts: ContextVar[list | None] = ContextVar("run_attempts", default=None)
+# cache_type -> rows of the current run (see track_cache)
+_run_cache: ContextVar[dict | None] = ContextVar("run_cache", default=None)
+
+def _acquire_player_api():
+    global player_api, _active_runs
+    # shared PlayerAPI: logins and cooldowns carry over from routers and earlier runs
+    player_api = get_player_api()
+    _active_runs += 1
+
+def _release_player_api():
+    global player_api, _active_runs
+    _active_runs -= 1
+    if _active_runs == 0:
+        player_api = None
+
+def track_attempts() -> list:
+    """
+    Collect the pairs finished from here on in the current task, and in tasks
+    it starts, into a fresh list that is returned; flush_attempts() it when
+    the run ends. Concurrent runs each flush only their own pairs.
+    """
+    attempts = []
+    _run_attempts.set(attempts)
+    return attempts
 
-def make_progress_updater(task_results: dict, task_id: str):
-    """Returns a function inc(delta) that increments progress safely."""
-    def inc(delta: int):
+def track_cache() -> dict:
+    """
+    Like track_attempts(), for the redemptions, expired codes, solved
+    captchas, profiles and checked codes create_cache() collects. Kept in
+    memory per run, so concurrent runs (and worker processes) never touch
+    each other's rows.
+    """
+    cache = {cache_type: [] for cache_type in CACHE_TYPES}
+    _run_cache.set(cache)
+    return cache
+
+def _finalize_run(task_results: TaskRegistry, task_id: str, outcomes: dict, attempts: list, cache: dict):
+    """Attach run stats to the final record and persist what the run collected."""
+    extras = {"outcomes": {key: dict(counts) for key, counts in outcomes.items()}, "upstream": player_api.breaker.snapshot()}
+    stats = shadow_stats()
+    if stats:
+        logger.info(f"Captcha shadow stats: {stats}")
+        extras["captcha_shadow"] = stats
+    # Reassign rather than mutate so a shared task store persists the final record
+    task_results[task_id] = {**task_results[task_id], **extras}
+    _flush_run(attempts, cache)
+
+def _flush_run(attempts: list, cache: dict):
+    _release_player_api()
+    flush_attempts(attempts)
+    process_cache(cache)
+
+def make_progress_updater(task_results: TaskRegistry, task_id: str):
+    """
+    Returns a function inc(delta, pair=None) that increments progress safely
+    and pushes it, plus the finished pair's outcome if given, to the task's
+    event subscribers.
+    """
+    def inc(delta: int, pair: dict | None = None):
         cur = task_results.get(task_id, {}).get("progress", 0)
-        task_results[task_id]["progress"] = max(0, min(100, int(cur) + int(delta)))
+        progress = max(0, min(100, int(cur) + int(delta)))
+        task_results[task_id]["progress"] = progress
+        task_results.touch(task_id)
+        task_events.publish(task_id, "progress", {"progress": progress, "delta": int(delta)})
+        if pair is not None:
+            task_events.publish(task_id, "pair", pair)
     return inc
 
 def create_cache(cache_type, data):
-    os.makedirs(CACHE_DIR, exist_ok=True)
-
-    if cache_type == "expired_giftcode":
-        cache_file = os.path.join(CACHE_DIR, "expired_giftcode.json")
-    elif cache_type == "redeemed_giftcode":
-        cache_file = os.path.join(CACHE_DIR, "redeemed_giftcode.json")
-    elif cache_type == "success_captcha":
-        cache_file = os.path.join(CACHE_DIR, "success_captcha.json")
-    elif cache_type == "players":
-        cache_file = os.path.join(CACHE_DIR, "players.json")
-    elif cache_type == "checked_giftcode":
-        cache_file = os.path.join(CACHE_DIR, "checked_giftcode.json")
-    else:
+    """Collect a row for the current run (see track_cache); written in bulk by process_cache() when it ends."""
+    if cache_type not in CACHE_TYPES:
         raise ValueError(f"Unknown cache_type: {cache_type}")
+    cache = _run_cache.get()
+    if cache is None:
+        # Not inside a tracked run: write it straight away
+        process_cache({cache_type: [data]})
+        return
+    if data in cache[cache_type]:
+        logger.info(f"Data already exists in the {cache_type} cache")
+        return
+    cache[cache_type].append(data)
 
-    if os.path.exists(cache_file):
-        with open(cache_file, "r") as f:
-            try:
-                existing_data = json.load(f)
-            except json.JSONDecodeError:
-                existing_data = []
-    else:
-        existing_data = []
+def process_cache(cache: dict):
+    """Write the rows a run collected with one statement per kind, then empty ``cache``."""
+    if not any(cache.values()):
+        return
+    try:
+        record_run_results(
+            redeemed=list(cache.get("redeemed_giftcode", [])),
+            expired=[item["code"] for item in cache.get("expired_giftcode", [])],
+            captcha_ids=[item["captcha_id"] for item in cache.get("success_captcha", []) if item["captcha_id"] is not None],
+            checked=[item["code"] for item in cache.get("checked_giftcode", [])],
+        )
+        update_players_table(list(cache.get("players", [])))
+    except Exception as e:
+        logger.exception(f"Failed to record run results: {e}")
+    for items in cache.values():
+        items.clear()
 
-    if data in existing_data:
-        logger.info(f"Data already exists in {cache_file}")
+def flush_attempts(attempts: list):
+    """
+    Persist the attempt bookkeeping a run collected (track_attempts()), and
+    update the negative caches from it: fids whose login failed are backed
+    off, fids that logged in are cleared, ineligible pairs are recorded.
+    """
+    if not attempts:
         return
+    dead = {a["fid"] for a in attempts if a["outcome"] == LOGIN_FAILED}
+    alive = {a["fid"] for a in attempts if a["outcome"] != LOGIN_UNAVAILABLE} - dead
+    ineligible = [a for a in attempts if policy.rule(a["outcome"]).action == INELIGIBLE]
+    try:
+        record_attempts(attempts)
+        record_login_failures(sorted(dead))
+        clear_login_failures(sorted(alive))
+        record_ineligible(ineligible)
+    except Exception as e:
+        logger.exception(f"Failed to record redemption attempts: {e}")
+    attempts.clear()
+
+class PlayerWork:
+    """Pending codes for one fid plus where that fid is in its current captcha/redeem cycle."""
+
+    __slots__ = (
+        "fid", "codes", "priority", "logged_in", "attempts", "captcha_solution", "captcha_id", "result", "span",
+    )
+
+    def __init__(self, fid, codes, priority):
+        self.fid = fid
+        self.codes = deque(codes)
+        self.priority = priority
+        self.logged_in = False
+        self.attempts = 0
+        self.captcha_solution = None
+        self.captcha_id = None
+        self.result = None
+        self.span = None  # trace of the current code, opened by its first step
+
+
+class ReadyQueue:
+    """
+    Players ordered by the monotonic time their cooldown expires (ties broken
+    by priority). get() hands out whichever player is ready first, so a few
+    workers can interleave many players instead of sleeping on one.
+    """
 
-    existing_data.append(data)
-    with open(cache_file, "w") as f:
-        json.dump(existing_data, f, indent=2)
-
-def process_cache():
-    cache_files = ["expired_giftcode.json", "redeemed_giftcode.json", "success_captcha.json", "players.json", "checked_giftcode.json"]
-    for cache_file in cache_files:
-        file_path = os.path.join(CACHE_DIR, cache_file)
-        if os.path.exists(file_path):
-            with open(file_path, "r") as f:
-                data = json.load(f)
-                for item in data:
-                    if cache_file == "expired_giftcode.json":
-                        deactivate_giftcode(item['code'])
-                    elif cache_file == "redeemed_giftcode.json":
-                        record_redemption(item['fid'], item['code'])
-                    elif cache_file == "success_captcha.json":
-                        update_captcha_feedback(item['captcha_id'])
-                    elif cache_file == "players.json":
-                        # expect item like {"fid": "...", "token": "..."} or similar
-                        update_player(item)
-                    elif cache_file == "checked_giftcode.json":
-                        update_giftcode_checkedtime(item['code'])
-            os.remove(file_path)
-
-def clear_cache():
-    if os.path.exists(CACHE_DIR):
-        shutil.rmtree(CACHE_DIR)
-
-async def process(fid, code, progress_cb, progress_multiplier):
-    login_response = await player_api.login_player(fid, SALT)
-
-    if not login_response:
-        logger.info(f"Login failed for {fid}. Skipping...")
-        return None
+    def __init__(self, workers=0):
+        self._heap = []
+        self._seq = itertools.count()
+        self._changed = asyncio.Event()
+        self.workers = workers
 
-    # stash player token for later persistence
-    if isinstance(login_response, dict) and 'token' in login_response:
-        create_cache("players", login_response['token'])
+    def __len__(self):
+        return len(self._heap)
 
-    retries = 0
-    result = None
+    def put(self, ready_at, priority, item):
+        heapq.heappush(self._heap, (ready_at, priority, next(self._seq), item))
+        self._changed.set()
 
-    while retries < 4:
-        retries += 1
-        captcha_data = await player_api.get_captcha(fid, SALT)
-        if captcha_data is None:
-            logger.info(f"Captcha data is None for {fid}. Retrying...")
-            await asyncio.sleep(2)
-            continue
+    async def get(self):
+        while True:
+            timeout = None
+            if self._heap:
+                ready_at, _, _, item = self._heap[0]
+                timeout = ready_at - time.monotonic()
+                if timeout <= 0:
+                    heapq.heappop(self._heap)
+                    return item
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
 
-        captcha_solution, captcha_id = solve_captcha.solve(captcha_data)
-        result = await player_api.redeem_code(fid, code, captcha_solution, SALT)
 
-        if result:
-            msg = result.get("msg")
-            if msg == "Sign Error":
-                logger.info(f"Sign Error for {fid}: {code}")
-                await asyncio.sleep(2)
-                continue
+# Ready queues of the process_unredeemed_df calls in progress, read when /metrics is scraped
+_active_queues: set[ReadyQueue] = set()
+metrics.redeem_workers.fn = lambda: sum(q.workers for q in _active_queues)
+metrics.redeem_queue_depth.fn = lambda: sum(len(q) for q in _active_queues)
+
+
+def _finish_code(work, progress_cb, progress_multiplier, outcome):
+    """Close out the current code for ``work``; return when to revisit the fid, or None when it is done."""
+    pair = {"fid": work.fid, "code": work.codes[0], "outcome": outcome}
+    metrics.pairs_processed.inc(outcome)
+    if work.span is not None:
+        work.span.end(outcome=outcome, attempts=work.attempts)
+        work.span = None
+    attempts = _run_attempts.get()
+    if attempts is not None:
+        attempts.append(pair)
+    progress_cb(progress_multiplier, pair)
+    logger.info(f"[{work.fid} | {work.codes[0]}] -> {work.result}")
+    work.codes.popleft()
+    work.attempts = 0
+    work.result = None
+    if not work.codes:
+        return None
+    player_api.defer(work.fid, BATCH_DELAY)
+    return player_api.ready_at(work.fid)
 
-            err_code = result.get("err_code")
-            if err_code == 0:
-                logger.info(f"Code redeemed successfully for {fid}: {code}")
-                create_cache("redeemed_giftcode", {"fid": fid, "code": code})
-                create_cache("success_captcha", {"captcha_id": captcha_id})
-                if fid == settings.DEFAULT_PLAYER:
-                    create_cache("checked_giftcode", {"code": code})
-                break
 
-            elif str(err_code) in error_codes:
-                ec = error_codes[str(err_code)]
-                logger.info(ec.get('message', f"err_code {err_code}"))
-                if ec.get('captcha_error'):
-                    await asyncio.sleep(2)
-                    continue
-                elif ec.get('success'):
-                    create_cache("redeemed_giftcode", {"fid": fid, "code": code})
-                    create_cache("success_captcha", {"captcha_id": captcha_id})
-                    if fid == settings.DEFAULT_PLAYER:
-                        create_cache("checked_giftcode", {"code": code})
-                    break
-                elif ec.get('expired'):
-                    create_cache("expired_giftcode", {"code": code})
-                    create_cache("success_captcha", {"captcha_id": captcha_id})
-                    if fid == settings.DEFAULT_PLAYER:
-                        create_cache("checked_giftcode", {"code": code})
-                    break
-                else:
-                    await asyncio.sleep(2)
-                    continue
-            else:
-                logger.info(error_codes['default']['message'])
-                logger.info(result)
-        else:
-            logger.info("None Response!")
-        await asyncio.sleep(10)
+def _apply_policy(work, rule, progress_cb, progress_multiplier):
+    """Retry after the rule's backoff, or close out the code once its retry budget is spent."""
+    action, delay = policy.decide(rule, work.attempts)
+    tracer.event("policy", rule=rule.key, action=action, delay=round(delay, 3) if delay else delay, attempt=work.attempts)
+    if action == GIVE_UP:
+        logger.info(f"Giving up on {work.codes[0]} for {work.fid} after {work.attempts} attempts ({rule.key}).")
+        return _finish_code(work, progress_cb, progress_multiplier, rule.key)
+    if action == RELOGIN:
+        player_api.sessions.pop(work.fid)
+        work.logged_in = False
+    player_api.defer(work.fid, delay or 0)
+    return player_api.ready_at(work.fid)
 
-    # progress for this (fid, code) task
-    progress_cb(progress_multiplier)
-    logger.info(f"[{fid} | {code}] -> {result}")
-    await asyncio.sleep(BATCH_DELAY)
 
+async def advance(work, progress_cb, progress_multiplier):
+    """
+    Run the next step (login, captcha or redeem) for ``work`` without waiting
+    out any cooldown. Returns the monotonic time the fid should be picked up
+    again, or None once all of its codes are finished.
+    """
+    if work.span is None:
+        work.span = tracer.start_trace("pair", fid=work.fid, code=work.codes[0])
+    with tracer.activate(work.span):
+        return await _step(work, progress_cb, progress_multiplier)
+
+
+async def _step(work, progress_cb, progress_multiplier):
+    fid = work.fid
+    code = work.codes[0]
+
+    if not work.logged_in:
+        try:
+            with tracer.span("login"):
+                login_response = await player_api.login_player(fid, SALT, raise_unavailable=True)
+        except LoginUnavailable:
+            # Rate limits or network trouble, not a rejected player: park the fid and retry the login
+            work.attempts += 1
+            action, delay = policy.decide(LOGIN_UNAVAILABLE, work.attempts)
+            tracer.event("policy", rule=LOGIN_UNAVAILABLE, action=action, delay=round(delay, 3) if delay else delay, attempt=work.attempts)
+            if action == GIVE_UP:
+                logger.info(f"Login for {fid} still unavailable after {work.attempts} attempts. Skipping...")
+                while work.codes:
+                    _finish_code(work, progress_cb, progress_multiplier, LOGIN_UNAVAILABLE)
+                return None
+            player_api.defer(fid, delay or 0)
+            return player_api.ready_at(fid)
+        if not login_response:
+            logger.info(f"Login failed for {fid}. Skipping...")
+            while work.codes:
+                _finish_code(work, progress_cb, progress_multiplier, LOGIN_FAILED)
+            return None
+
+        # stash player token for later persistence
+        if isinstance(login_response, dict) and 'token' in login_response:
+            create_cache("players", login_response['token'])
+        work.logged_in = True
+        return player_api.ready_at(fid)
 
-async def worker(fid_queue, fid_to_codes, progress_cb, progress_multiplier):
+    try:
+        if work.captcha_solution is None:
+            with tracer.span("captcha", attempt=work.attempts + 1):
+                captcha_data = await player_api.get_captcha(fid, SALT, wait=False)
+            work.attempts += 1
+            if captcha_data is None:
+                logger.info(f"Captcha data is None for {fid}. Retrying...")
+                return _apply_policy(work, policy.rule("no_captcha"), progress_cb, progress_multiplier)
+
+            with tracer.span("solve", attempt=work.attempts):
+                work.captcha_solution, work.captcha_id = get_solver().solve(captcha_data)
+            return player_api.ready_at(fid)
+
+        with tracer.span("redeem", attempt=work.attempts):
+            result = await player_api.redeem_code(fid, code, work.captcha_solution, SALT, wait=False)
+    except PlayerCooldown as e:
+        return e.ready_at
+    except UpstreamBackoff as e:
+        # Each backoff cycle spends one attempt of the rule's budget; GIVE_UP once it is gone
+        work.attempts += 1
+        return _apply_policy(work, e.rule, progress_cb, progress_multiplier)
+
+    captcha_id = work.captcha_id
+    work.captcha_solution = work.captcha_id = None
+    work.result = result
+
+    rule = policy.classify(result)
+    logger.info(f"{rule.message} [{fid} | {code}]")
+    if rule.action == DONE:
+        create_cache("redeemed_giftcode", {"fid": fid, "code": code})
+        create_cache("success_captcha", {"captcha_id": captcha_id})
+        if fid == settings.DEFAULT_PLAYER:
+            create_cache("checked_giftcode", {"code": code})
+        return _finish_code(work, progress_cb, progress_multiplier, rule.key)
+    if rule.action == EXPIRED:
+        create_cache("expired_giftcode", {"code": code})
+        create_cache("success_captcha", {"captcha_id": captcha_id})
+        if fid == settings.DEFAULT_PLAYER:
+            create_cache("checked_giftcode", {"code": code})
+        return _finish_code(work, progress_cb, progress_multiplier, rule.key)
+    if rule.action == INELIGIBLE:
+        # Only this player is locked out; the code stays active for everyone else
+        create_cache("success_captcha", {"captcha_id": captcha_id})
+        return _finish_code(work, progress_cb, progress_multiplier, rule.key)
+    if rule is policy.default:
+        logger.info(result)
+    return _apply_policy(work, rule, progress_cb, progress_multiplier)
+
+
+class UpstreamUnavailable(Exception):
+    """The upstream circuit breaker kept tripping; the run was ended early."""
+
+
+class RunCancelled(Exception):
+    """The run's cancel event was set; workers stopped after their current step."""
+
+
+def _check_cancelled(cancel):
+    if cancel is not None and cancel.is_set():
+        raise RunCancelled("Cancelled on request.")
+
+
+async def worker(ready_queue, claims, on_fid_done, on_abort, progress_cb, progress_multiplier):
     try:
         while True:
-            _, fid = await fid_queue.get()
-
-            if fid is None:
-                fid_queue.task_done()
+            work = await ready_queue.get()
+            if work is None:
                 break
+            if not await claims.claim_fid(str(work.fid)):
+                # Another run is working this fid; look again once it may be done
+                ready_queue.put(time.monotonic() + CLAIM_RETRY, work.priority, work)
+                continue
 
             try:
-                codes = fid_to_codes[fid]
-                for code in codes:
-                    await process(fid, code, progress_cb, progress_multiplier)
-            finally:
-                fid_queue.task_done()
+                next_ready = await advance(work, progress_cb, progress_multiplier)
+            except CircuitOpenError as e:
+                if player_api.breaker.consecutive_trips >= settings.BREAKER_MAX_TRIPS:
+                    on_abort()
+                    break
+                # Park the fid until the breaker lets a probe through
+                next_ready = e.retry_at
+            except Exception as e:
+                logger.exception(f"Unexpected error processing {work.fid}: {e}")
+                next_ready = None
+
+            if next_ready is None:
+                await claims.release_fid(str(work.fid))
+                on_fid_done()
+            else:
+                ready_queue.put(next_ready, work.priority, work)
     except asyncio.CancelledError:
         raise
 
 
-async def process_unredeemed_df(unredeemed_df: pd.DataFrame, progress_cb, progress_share=50):
+async def process_unredeemed_df(unredeemed_df: pd.DataFrame, progress_cb, progress_share=50, cancel: asyncio.Event = None):
     """
     Process unredeemed rows with concurrency across unique fids only.
-    All codes for the same fid are processed sequentially by a single worker.
+    All codes for the same fid are processed sequentially, one step at a time;
+    a fid waiting out a cooldown does not hold a worker.
     PRIORITY_ACCOUNT is always dequeued first when present.
+    Pairs another run already queued are reported as IN_PROGRESS and left to
+    it, and a fid another run is working waits until that run lets go of it.
+    Once ``cancel`` is set, workers stop after their current step and
+    RunCancelled is raised; finished pairs stay recorded.
     """
+    _check_cancelled(cancel)
     if unredeemed_df is None or unredeemed_df.empty:
         return []
 
@@ -201,37 +420,82 @@ async def process_unredeemed_df(unredeemed_df: pd.DataFrame, progress_cb, progre
     progress_multiplier = max(1, int(progress_share / max(1, total_rows)))
 
     # Group by fid so each fid is handled by only one worker at a time
+    rows = list(unredeemed_df.itertuples(index=False))
+    claims = await open_claims()
+    claimed = await claims.claim_pairs((str(row.fid), row.code) for row in rows)
     fid_to_codes = defaultdict(list)
-    for row in unredeemed_df.itertuples(index=False):
+    for row in rows:
+        if (str(row.fid), row.code) not in claimed:
+            logger.info(f"[{row.fid} | {row.code}] is being redeemed by another run. Skipping...")
+            progress_cb(progress_multiplier, {"fid": row.fid, "code": row.code, "outcome": IN_PROGRESS})
+            continue
         fid_to_codes[row.fid].append(row.code)
+    if not fid_to_codes:
+        await claims.close()
+        return []
 
-    fid_queue = asyncio.PriorityQueue()
-
-    # enqueue unique fids with priority
-    for fid in fid_to_codes.keys():
+    worker_count = min(MAX_WORKERS, len(fid_to_codes))
+    ready_queue = ReadyQueue(worker_count)
+    for fid, codes in fid_to_codes.items():
         priority = 0 if str(fid) == str(settings.PRIORITY_ACCOUNT) else 1
-        await fid_queue.put((priority, fid))
+        ready_queue.put(player_api.ready_at(fid), priority, PlayerWork(fid, codes, priority))
+    remaining = len(fid_to_codes)
+
+    aborted = cancelled = False
+
+    def stop_workers():
+        for _ in range(worker_count):
+            ready_queue.put(float("-inf"), 999, None)  # sentinel
+
+    def on_fid_done():
+        nonlocal remaining
+        remaining -= 1
+        if remaining == 0:
+            stop_workers()
+
+    def on_abort():
+        nonlocal aborted
+        if not aborted:
+            aborted = True
+            logger.warning(f"Upstream unavailable; abandoning {remaining} fid(s) still pending.")
+            stop_workers()
+
+    async def on_cancel():
+        nonlocal cancelled
+        await cancel.wait()
+        cancelled = True
+        logger.info(f"Cancel requested; stopping workers with {remaining} fid(s) still pending.")
+        stop_workers()
 
-    worker_count = min(MAX_WORKERS, len(fid_to_codes))
     workers = [
         asyncio.create_task(
-            worker(fid_queue, fid_to_codes, progress_cb, progress_multiplier)
+            worker(ready_queue, claims, on_fid_done, on_abort, progress_cb, progress_multiplier)
         )
         for _ in range(worker_count)
     ]
+    watchers = [asyncio.create_task(on_cancel())] if cancel is not None else []
 
+    _active_queues.add(ready_queue)
     try:
-        await fid_queue.join()
+        await asyncio.gather(*workers)
     finally:
-        for _ in range(worker_count):
-            await fid_queue.put((999, None))  # sentinel
-
-        await asyncio.gather(*workers, return_exceptions=True)
-
+        for w in workers + watchers:
+            w.cancel()
+        await asyncio.gather(*workers, *watchers, return_exceptions=True)
+        _active_queues.discard(ready_queue)
+        await claims.close()
+
+    if cancelled and remaining:
+        raise RunCancelled(f"Cancelled on request; {remaining} fid(s) were not finished.")
+
+    if aborted:
+        raise UpstreamUnavailable(
+            f"Upstream API unavailable (circuit breaker tripped {player_api.breaker.consecutive_trips} times in a row)."
+        )
     return []
 
 
-async def _run_default_player(progress_cb, default_player: str = None, n: int = None):
+async def _run_default_player(progress_cb, default_player: str = None, n: int = None, cancel: asyncio.Event = None):
     """Run the default player through the queue/worker pipeline."""
     if not default_player:
         logger.info("No default player provided. Skipping default player run.")
@@ -247,21 +511,10 @@ async def _run_default_player(progress_cb, default_player: str = None, n: int =
 
     # Smaller share if also running the full main logic
     progress_share = 10 if n else 90
-    return await process_unredeemed_df(unredeemed_df, progress_cb, progress_share=progress_share)
+    return await process_unredeemed_df(unredeemed_df, progress_cb, progress_share=progress_share, cancel=cancel)
 
-async def _main_logic(task_results: dict, task_id: str, progress_cb, salt: str, default_player: str = None, n: int = None, new_codes_true: list = None):
+async def _main_logic(task_results: TaskRegistry, task_id: str, progress_cb, salt: str, default_player: str = None, n: int = None, new_codes_true: list = None, cancel: asyncio.Event = None):
     """Main logic for processing unredeemed codes."""
-    global player_api
-    # ensure single session
-    if player_api is not None:
-        await player_api.close_session()
-    player_api = PlayerAPI()
-
-    # flush cache from previous run (if any)
-    if os.path.exists(CACHE_DIR):
-        process_cache()
-        clear_cache()
-
     players = get_players()
     if not players:
         task_results[task_id] = {
@@ -272,8 +525,14 @@ async def _main_logic(task_results: dict, task_id: str, progress_cb, salt: str,
     
     all_codes = get_giftcodes()
 
-    # Always compute unredeemed list; sample only if n is provided
-    unredeemed_data = get_unredeemed_code_player_list()
+    # Codes with a code-scoped run queued or going are left to it
+    code_run_codes = code_runs.pending()
+
+    # With n, let the selection policy pick which n pairs get a turn this run
+    if n:
+        unredeemed_data = select_unredeemed_pairs(n, settings.SELECTION_POLICY, exclude_codes=code_run_codes)
+    else:
+        unredeemed_data = [row for row in get_unredeemed_code_player_list() if row["code"] not in code_run_codes]
     if not unredeemed_data:
         task_results[task_id] = {
             "status": "Completed", "progress": 100,
@@ -283,8 +542,6 @@ async def _main_logic(task_results: dict, task_id: str, progress_cb, salt: str,
         return []
 
     unredeemed_df = pd.DataFrame(unredeemed_data)  # expect cols: fid, code
-    if n:
-        unredeemed_df = unredeemed_df.sample(n=min(n, len(unredeemed_df)), random_state=42)
 
     if unredeemed_df.empty:
         task_results[task_id] = {
@@ -294,60 +551,179 @@ async def _main_logic(task_results: dict, task_id: str, progress_cb, salt: str,
         }
         return []
 
-    workers = await process_unredeemed_df(unredeemed_df, progress_cb, progress_share= 100 - task_results.get(task_id, {}).get("progress", 0))
+    workers = await process_unredeemed_df(unredeemed_df, progress_cb, progress_share= 100 - task_results.get(task_id, {}).get("progress", 0), cancel=cancel)
     return workers
 
-async def main(task_results: dict, task_id: str, salt: str, default_player: str = None, n: int = None, timeout=300):
-    global player_api
-    # single session lifecycle inside main
-    if player_api is not None:
-        await player_api.close_session()
-    player_api = PlayerAPI()
+async def main(task_results: TaskRegistry, task_id: str, salt: str, default_player: str = None, n: int = None, timeout=300, cancel: asyncio.Event = None):
+    _acquire_player_api()
+    outcomes = track_run()
+    attempts = track_attempts()
+    cache = track_cache()
 
-    workers_all = []
-    
     progress_cb = make_progress_updater(task_results, task_id)
     task_results[task_id] = {"status": "Processing", "progress": 0}
 
     try:
         new_codes = await fetch_latest_codes_async("whiteoutsurvival", "gift code")
         new_codes_true = [code for code in (add_giftcode(c) for c in new_codes) if code is not None]
+        code_runs.submit(new_codes_true)
         progress_cb(10)
+        _check_cancelled(cancel)
 
         w1_starttime = asyncio.get_event_loop().time()
-        w1 = await asyncio.wait_for(_run_default_player(progress_cb, default_player, n), timeout=timeout)
+        w1 = await asyncio.wait_for(_run_default_player(progress_cb, default_player, n, cancel), timeout=timeout)
         w1_elapsed_time = asyncio.get_event_loop().time() - w1_starttime
 
         if not w1:  
             logger.info("Default player skipped.")
         if n:
-            w2 = await asyncio.wait_for(_main_logic(task_results, task_id, progress_cb, salt, default_player, n, new_codes_true), timeout=timeout-w1_elapsed_time)
+            _check_cancelled(cancel)
+            w2 = await asyncio.wait_for(_main_logic(task_results, task_id, progress_cb, salt, default_player, n, new_codes_true, cancel), timeout=timeout-w1_elapsed_time)
 
         if task_results[task_id].get("status") == "Processing":
             task_results[task_id] = {
                 "status": "Completed", "progress": 100,
                 "message": "Main logic executed successfully.",
-                "giftcodes": get_giftcodes(), "players": get_players(), "new_codes": new_codes_true
+                "new_codes": new_codes_true
             }
 
+    except UpstreamUnavailable as e:
+        logger.warning(f"Run ended early: {e}")
+        task_results[task_id] = {
+            "status": "Failed", "progress": 100,
+            "error": str(e)
+        }
+
+    except RunCancelled as e:
+        logger.info(f"Task {task_id}: {e}")
+        task_results[task_id] = {
+            "status": "Cancelled", "progress": task_results[task_id].get("progress", 0),
+            "message": str(e)
+        }
+
+    except asyncio.CancelledError:
+        # Hard cancel (shutdown grace period over): record it, flush in finally, stay cancelled
+        task_results[task_id] = {
+            "status": "Cancelled", "progress": task_results[task_id].get("progress", 0),
+            "message": "Interrupted by shutdown."
+        }
+        raise
+
     except asyncio.TimeoutError:
         task_results[task_id] = {
             "status": "Timeout", "progress": 100,
-            "error": f"Timeout: Task exceeded {timeout} seconds.",
-            "giftcodes": get_giftcodes(), "players": get_players()
+            "error": f"Timeout: Task exceeded {timeout} seconds."
         }
-        logger.warning("⏰ Timeout reached. Cancelling workers...")
-        for w in workers_all:
-            try:
-                w.cancel()
-            except Exception:
-                pass
-        await asyncio.gather(*workers_all, return_exceptions=True)
+        # wait_for cancelled the stage; process_unredeemed_df cancels and awaits its own workers
+        logger.warning("⏰ Timeout reached. Workers cancelled.")
+
+    except Exception as e:
+        # Never leave the task marked Processing; it would block every later run
+        logger.exception(f"Task {task_id} failed: {e}")
+        task_results[task_id] = {
+            "status": "Failed", "progress": 100,
+            "error": str(e)
+        }
+
+    finally:
+        _finalize_run(task_results, task_id, outcomes, attempts, cache)
+
+async def run_code(task_results: TaskRegistry, task_id: str, code: str, default_player: str = None, timeout=900, cancel: asyncio.Event = None):
+    """
+    Code-scoped run for a newly added gift code: probe it with the default
+    player, then, unless the probe found it expired, redeem it for every
+    player still pending. Runs beside a batch run from main().
+    """
+    _acquire_player_api()
+    outcomes = track_run()
+    attempts = track_attempts()
+    cache = track_cache()
+    progress_cb = make_progress_updater(task_results, task_id)
+    task_results[task_id] = {"status": "Processing", "progress": 0, "code": code}
+    loop = asyncio.get_event_loop()
+    started = loop.time()
+
+    try:
+        probe = None
+        if default_player:
+            def probe_cb(delta, pair=None):
+                nonlocal probe
+                if pair is not None:
+                    probe = pair["outcome"]
+                progress_cb(delta, pair)
+
+            probe_df = pd.DataFrame({"fid": [default_player], "code": [code]})
+            await asyncio.wait_for(process_unredeemed_df(probe_df, probe_cb, progress_share=10, cancel=cancel), timeout=timeout)
+
+        if probe is not None and policy.rule(probe).action == EXPIRED:
+            task_results[task_id] = {
+                "status": "Completed", "progress": 100,
+                "message": f"Code '{code}' is expired; nothing to redeem.",
+                "code": code, "probe": probe
+            }
+        else:
+            pairs = get_unredeemed_pairs_for_code(code)
+            if pairs:
+                await asyncio.wait_for(
+                    process_unredeemed_df(
+                        pd.DataFrame(pairs), progress_cb,
+                        progress_share=100 - task_results[task_id]["progress"], cancel=cancel
+                    ),
+                    timeout=timeout - (loop.time() - started)
+                )
+            task_results[task_id] = {
+                "status": "Completed", "progress": 100,
+                "message": f"Code '{code}' processed for {len(pairs)} player(s).",
+                "code": code, "probe": probe, "pairs": len(pairs)
+            }
+
+    except UpstreamUnavailable as e:
+        logger.warning(f"Code run for '{code}' ended early: {e}")
+        task_results[task_id] = {"status": "Failed", "progress": 100, "code": code, "error": str(e)}
+
+    except RunCancelled as e:
+        logger.info(f"Code run {task_id}: {e}")
+        task_results[task_id] = {
+            "status": "Cancelled", "progress": task_results[task_id].get("progress", 0),
+            "code": code, "message": str(e)
+        }
+
+    except asyncio.CancelledError:
+        task_results[task_id] = {
+            "status": "Cancelled", "progress": task_results[task_id].get("progress", 0),
+            "code": code, "message": "Interrupted by shutdown."
+        }
+        raise
+
+    except asyncio.TimeoutError:
+        task_results[task_id] = {
+            "status": "Timeout", "progress": 100, "code": code,
+            "error": f"Timeout: Task exceeded {timeout} seconds."
+        }
+
+    except Exception as e:
+        logger.exception(f"Code run {task_id} for '{code}' failed: {e}")
+        task_results[task_id] = {"status": "Failed", "progress": 100, "code": code, "error": str(e)}
+
+    finally:
+        _finalize_run(task_results, task_id, outcomes, attempts, cache)
+
+async def redeem_for_player(player_id: str, codes: list, on_pair, cancel: asyncio.Event = None):
+    """
+    Redeem ``codes`` for one player on the batch pipeline (captchas,
+    cooldowns, outcome policy), calling ``on_pair(pair)`` as each code
+    finishes. Outcomes are recorded the same way a batch run records them.
+    """
+    _acquire_player_api()
+    attempts = track_attempts()
+    cache = track_cache()
+    try:
+        df = pd.DataFrame({"fid": [player_id] * len(codes), "code": codes})
+
+        def progress_cb(delta, pair=None):
+            if pair is not None:
+                on_pair(pair)
 
+        await process_unredeemed_df(df, progress_cb, cancel=cancel)
     finally:
-        if player_api:
-            await player_api.close_session()
-            player_api = None
-        if os.path.exists(CACHE_DIR):
-            process_cache()
-            clear_cache()
+        _flush_run(attempts, cache)
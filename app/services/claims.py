@@ -0,0 +1,128 @@
+"""
+Claims that keep concurrent runs off each other's players: a (fid, code)
+pair is queued by one run only, and a fid is worked by one run at a time.
+Runs share the PlayerAPI sessions and cooldowns of their process, and
+upstream's per-player limits across processes.
+
+LocalClaims only sees the runs of this process. SharedClaims takes Postgres
+advisory locks on a connection held for the run, so batch and code runs on
+every worker process see each other; a crashed worker's claims go with its
+connection.
+"""
+import asyncio
+import logging
+from typing import Iterable
+
+from app.core.config import settings
+from app.db.supabase import open_claims_connection, release_claims, try_claims
+
+logger = logging.getLogger(__name__)
+
+Pair = tuple[str, str]
+
+
+def _fid_key(fid):
+    return f"claim:fid:{fid}"
+
+
+def _pair_key(pair):
+    return f"claim:pair:{pair[0]}:{pair[1]}"
+
+
+class LocalClaims:
+    """Claims of one run, checked against every other run in this process."""
+
+    _fids: set[str] = set()
+    _pairs: set[Pair] = set()
+
+    def __init__(self):
+        self.fids: set[str] = set()
+        self.pairs: set[Pair] = set()
+
+    async def claim_pairs(self, pairs: Iterable[Pair]) -> set[Pair]:
+        """Claim whichever of ``pairs`` no other run holds; returns those."""
+        claimed = set(pairs) - LocalClaims._pairs
+        LocalClaims._pairs.update(claimed)
+        self.pairs.update(claimed)
+        return claimed
+
+    async def claim_fid(self, fid: str) -> bool:
+        if fid in self.fids:
+            return True
+        if fid in LocalClaims._fids:
+            return False
+        LocalClaims._fids.add(fid)
+        self.fids.add(fid)
+        return True
+
+    async def release_fid(self, fid: str):
+        if fid in self.fids:
+            self.fids.discard(fid)
+            LocalClaims._fids.discard(fid)
+
+    async def close(self):
+        LocalClaims._fids.difference_update(self.fids)
+        LocalClaims._pairs.difference_update(self.pairs)
+        self.fids.clear()
+        self.pairs.clear()
+
+
+class SharedClaims(LocalClaims):
+    """
+    Claims held as advisory locks on the run's own connection. Queries run
+    in a thread so the event loop never waits on the database; if one fails
+    the claim is granted, since a run should not stop over its bookkeeping.
+    """
+
+    def __init__(self, conn):
+        super().__init__()
+        self._conn = conn
+
+    async def claim_pairs(self, pairs: Iterable[Pair]) -> set[Pair]:
+        pairs = sorted(set(pairs))
+        try:
+            granted = await asyncio.to_thread(try_claims, self._conn, [_pair_key(pair) for pair in pairs])
+        except Exception as e:
+            logger.exception(f"Failed to claim {len(pairs)} pair(s): {e}")
+            return set(pairs)
+        claimed = {pair for pair, ok in zip(pairs, granted) if ok}
+        self.pairs.update(claimed)
+        return claimed
+
+    async def claim_fid(self, fid: str) -> bool:
+        if fid in self.fids:
+            return True
+        try:
+            (granted,) = await asyncio.to_thread(try_claims, self._conn, [_fid_key(fid)])
+        except Exception as e:
+            logger.exception(f"Failed to claim player {fid}: {e}")
+            return True
+        if granted:
+            self.fids.add(fid)
+        return granted
+
+    async def release_fid(self, fid: str):
+        if fid not in self.fids:
+            return
+        self.fids.discard(fid)
+        try:
+            await asyncio.to_thread(release_claims, self._conn, [_fid_key(fid)])
+        except Exception as e:
+            logger.exception(f"Failed to release player {fid}: {e}")
+
+    async def close(self):
+        # Closing the session drops every lock it still holds
+        self.fids.clear()
+        self.pairs.clear()
+        await asyncio.to_thread(self._conn.close)
+
+
+async def open_claims() -> LocalClaims:
+    """SharedClaims with the Postgres task store (several workers), LocalClaims otherwise."""
+    if settings.TASK_STORE != "postgres":
+        return LocalClaims()
+    try:
+        return SharedClaims(await asyncio.to_thread(open_claims_connection))
+    except Exception as e:
+        logger.exception(f"Failed to open a claims connection; claims only cover this process: {e}")
+        return LocalClaims()
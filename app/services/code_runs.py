@@ -0,0 +1,61 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Iterable
+
+logger = logging.getLogger(__name__)
+
+
+class CodeRunQueue:
+    """
+    Newly added or reactivated gift codes waiting for a code-scoped run.
+    Whatever adds a code (a fetch, a batch run) submits it here; one
+    background consumer hands the codes to ``handler`` one at a time, next to
+    whatever batch run is going on. A code is only queued once while it is
+    pending or running.
+    """
+
+    def __init__(self):
+        self._queue: asyncio.Queue[str] = asyncio.Queue()
+        self._pending: set[str] = set()
+        self._consumer: asyncio.Task | None = None
+
+    def submit(self, codes: Iterable[str]) -> list[str]:
+        """Queue ``codes``; returns the ones that were not already pending."""
+        queued = []
+        for code in codes:
+            if code and code not in self._pending:
+                self._pending.add(code)
+                self._queue.put_nowait(code)
+                queued.append(code)
+        if queued:
+            logger.info(f"Queued code-scoped runs for {queued}.")
+        return queued
+
+    def pending(self) -> list[str]:
+        return sorted(self._pending)
+
+    def start(self, handler: Callable[[str], Awaitable[None]]):
+        if self._consumer is None or self._consumer.done():
+            self._consumer = asyncio.create_task(self._consume(handler))
+
+    async def stop(self):
+        if self._consumer is not None:
+            self._consumer.cancel()
+            try:
+                await self._consumer
+            except asyncio.CancelledError:
+                pass
+            self._consumer = None
+
+    async def _consume(self, handler):
+        while True:
+            code = await self._queue.get()
+            try:
+                await handler(code)
+            except Exception as e:
+                logger.exception(f"Code-scoped run for '{code}' failed: {e}")
+            finally:
+                self._pending.discard(code)
+
+
+code_runs = CodeRunQueue()
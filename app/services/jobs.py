@@ -1,26 +1,234 @@
-import uuid, asyncio
-from typing import Dict, Any, Tuple
+import uuid, asyncio, contextvars, logging
+from typing import Dict, Tuple
 from app.core.config import settings
+from app.db.supabase import acquire_job_lock, release_job_lock, fail_orphaned_tasks, request_task_cancel
 from app.services import batch_redeemer  # if module at app/batch_redeemer.py; else adjust import
+from app.services.task_registry import TaskRegistry, SharedTaskRegistry
+from app.services.task_events import task_events, HEARTBEAT
+from app.services.code_runs import code_runs
+from app.utils import tracing
 
-task_results: Dict[str, Dict[str, Any]] = {}
+logger = logging.getLogger(__name__)
+
+if settings.TASK_STORE == "postgres":
+    task_results = SharedTaskRegistry(
+        max_finished=settings.TASK_HISTORY_MAX,
+        ttl=settings.TASK_HISTORY_TTL,
+        flush_interval=settings.TASK_PROGRESS_FLUSH_SECONDS,
+    )
+else:
+    task_results = TaskRegistry(max_finished=settings.TASK_HISTORY_MAX, ttl=settings.TASK_HISTORY_TTL)
+
+class RunHandle:
+    """A run started by this process: its asyncio task and the event asking it to stop."""
+
+    __slots__ = ("task", "cancel")
+
+    def __init__(self, task: asyncio.Task, cancel: asyncio.Event):
+        self.task = task
+        self.cancel = cancel
+
+# task_id -> handle of every run (batch or code-scoped) still going in this process
+runs: Dict[str, RunHandle] = {}
+
+def _spawn(task_id: str, run) -> asyncio.Task:
+    """Start ``run(cancel)`` in the background and track it under ``task_id``."""
+    cancel = asyncio.Event()
+    # Spans traced inside the run are filed under its task id
+    context = contextvars.copy_context()
+    context.run(tracing.current_task.set, task_id)
+    task = asyncio.create_task(run(cancel), context=context)
+    runs[task_id] = RunHandle(task, cancel)
+    task.add_done_callback(lambda _: runs.pop(task_id, None))
+    return task
+
+def _cancel_local(task_id: str) -> bool:
+    handle = runs.get(task_id)
+    if handle is None:
+        return False
+    handle.cancel.set()
+    return True
+
+if isinstance(task_results, SharedTaskRegistry):
+    task_results.on_cancel_requested = _cancel_local
 
 def has_inflight_task() -> Tuple[bool, str | None]:
-    for tid, info in task_results.items():
-        if info.get("status") == "Processing":
-            return True, tid
-    return False, None
+    tid = task_results.inflight()
+    return tid is not None, tid
+
+def reset_tasks():
+    """
+    Forget finished tasks and any Processing record whose run is no longer
+    going in this process (it died without finishing); live runs keep theirs.
+    With the shared store, Processing rows of other workers are marked failed
+    only if no worker holds the run lock, i.e. no batch run is live anywhere.
+    """
+    live = {task_id for task_id, handle in runs.items() if not handle.task.done()}
+    if isinstance(task_results, SharedTaskRegistry):
+        lock = acquire_job_lock()
+        if lock is not None:
+            try:
+                orphaned = fail_orphaned_tasks("", stale_after=2 * settings.CODE_RUN_TIMEOUT)
+                if orphaned:
+                    logger.warning(f"Marked {orphaned} orphaned task(s) as failed.")
+            finally:
+                release_job_lock(lock)
+    task_results.clear(keep=live)
+
+def cancel_job(task_id: str) -> bool:
+    """
+    Ask a run to stop: its workers finish their current step, what they
+    recorded is flushed and the task ends as Cancelled. A run on another
+    worker process is flagged in the tasks table and stops once that worker
+    next writes its progress. False if no such run is going.
+    """
+    if _cancel_local(task_id):
+        return True
+    if isinstance(task_results, SharedTaskRegistry):
+        try:
+            return request_task_cancel(task_id)
+        except Exception as e:
+            logger.exception(f"Failed to request cancellation of {task_id}: {e}")
+    return False
+
+async def drain(grace: float):
+    """
+    Shutdown: ask every run in this process to stop and give them ``grace``
+    seconds to flush; whatever is still running after that is cancelled
+    outright (it still records what it finished).
+    """
+    handles = list(runs.values())
+    if not handles:
+        return
+    logger.info(f"Draining {len(handles)} run(s) within {grace} seconds.")
+    for handle in handles:
+        handle.cancel.set()
+    _, pending = await asyncio.wait([h.task for h in handles], timeout=grace)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    if pending:
+        logger.warning(f"Cancelled {len(pending)} run(s) still going after the grace period.")
 
-def start_job(*, n: int | None = None, default_player: str | None = None) -> str:
+async def _run_locked(lock, task_id: str, **kwargs):
+    try:
+        await batch_redeemer.main(task_results, task_id, **kwargs)
+    finally:
+        if lock is not None:
+            release_job_lock(lock)
+        task_events.close(task_id, task_results.get(task_id))
+
+def start_job(*, n: int | None = None, default_player: str | None = None) -> str | None:
+    """
+    Start a batch run in the background and return its task id, or None when
+    another worker process already holds the run lock.
+    """
+    lock = None
     task_id = str(uuid.uuid4())
-    task_results[task_id] = {"status": "Processing", "progress": 0}
-    asyncio.create_task(
-        batch_redeemer.main(
-            task_results,
+    if isinstance(task_results, SharedTaskRegistry):
+        lock = acquire_job_lock()
+        if lock is None:
+            return None
+
+    try:
+        if lock is not None:
+            # We hold the lock, so any other Processing row belongs to a dead worker
+            orphaned = fail_orphaned_tasks(task_id, stale_after=2 * settings.CODE_RUN_TIMEOUT)
+            if orphaned:
+                logger.warning(f"Marked {orphaned} orphaned task(s) as failed.")
+
+        task_results[task_id] = {"status": "Processing", "progress": 0}
+        _spawn(task_id, lambda cancel: _run_locked(
+            lock,
             task_id,
             salt=settings.SALT,
             default_player=default_player or settings.DEFAULT_PLAYER,
-            n=n
+            n=n,
+            cancel=cancel
+        ))
+    except BaseException:
+        # The run never started, so _run_locked won't release the lock
+        if lock is not None:
+            release_job_lock(lock)
+        raise
+    return task_id
+
+async def _run_code(task_id: str, code: str, cancel: asyncio.Event):
+    try:
+        await batch_redeemer.run_code(
+            task_results,
+            task_id,
+            code,
+            default_player=settings.DEFAULT_PLAYER,
+            timeout=settings.CODE_RUN_TIMEOUT,
+            cancel=cancel
         )
-    )
+    finally:
+        task_events.close(task_id, task_results.get(task_id))
+
+async def run_code_job(code: str) -> str:
+    """Run a code-scoped job for ``code`` (the code_runs consumer); returns its task id."""
+    task_id = str(uuid.uuid4())
+    task_results[task_id] = {"status": "Processing", "progress": 0, "code": code}
+    task = _spawn(task_id, lambda cancel: _run_code(task_id, code, cancel))
+    # asyncio.wait, not await: stopping the consumer must not cancel the run; drain() handles it
+    await asyncio.wait([task])
     return task_id
+
+def start_code_runs():
+    """Start consuming newly added codes (called from lifespan)."""
+    code_runs.start(run_code_job)
+
+async def stream_player_redemption(player_id: str, codes: list[str]):
+    """
+    Redeem ``codes`` for one player in the background and yield each
+    finished pair as it lands. If the consumer goes away (the client
+    disconnected) the run stops after its current step, still recording
+    what it finished; errors of the run are raised after the last pair.
+    """
+    results: asyncio.Queue = asyncio.Queue()
+    run_id = f"redeem-{player_id}-{uuid.uuid4()}"
+
+    async def run(cancel):
+        try:
+            await batch_redeemer.redeem_for_player(player_id, codes, results.put_nowait, cancel=cancel)
+        finally:
+            results.put_nowait(None)
+
+    task = _spawn(run_id, run)
+    try:
+        while (pair := await results.get()) is not None:
+            yield pair
+        await task
+    finally:
+        if not task.done():
+            _cancel_local(run_id)
+
+async def stream_task_events(task_id: str, poll_interval: float = 1.0, heartbeat: float = 15.0):
+    """
+    Yield (event, data) for a task: live from the event bus when the run is
+    in this process, otherwise by watching the shared task store (the run is
+    on another worker, or already finished).
+    """
+    if task_events.has(task_id):
+        async for item in task_events.subscribe(task_id, heartbeat=heartbeat):
+            yield item
+        return
+
+    last_progress, idle = None, 0.0
+    while True:
+        record = task_results.get(task_id)
+        if record is None:
+            yield "error", {"status": "Not Found", "task_id": task_id}
+            return
+        if record.get("status") != "Processing":
+            yield "result", record
+            return
+        if record.get("progress") != last_progress:
+            last_progress, idle = record.get("progress"), 0.0
+            yield "progress", {"progress": last_progress}
+        elif idle >= heartbeat:
+            idle = 0.0
+            yield HEARTBEAT, None
+        await asyncio.sleep(poll_interval)
+        idle += poll_interval
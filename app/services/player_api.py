@@ -1,20 +1,38 @@
 from contextlib import asynccontextmanager
 from app.utils.wos_api import PlayerAPI
+from app.core.http import get_http_session
 from app.core.config import settings
 
+_player_api: PlayerAPI | None = None
+
+
+def get_player_api() -> PlayerAPI:
+    """
+    Return the process-wide PlayerAPI shared by routers and batch runs, so
+    logins and per-player cooldowns are tracked in one place.
+    """
+    global _player_api
+    if _player_api is None or _player_api.session.closed:
+        _player_api = PlayerAPI(get_http_session())
+    return _player_api
+
+
+async def close_player_api():
+    global _player_api
+    if _player_api is not None:
+        await _player_api.close_session()
+        _player_api = None
+
+
 @asynccontextmanager
 async def player_session(player_id: str):
     """
     Async context manager for a PlayerAPI session:
-    - Logs in the given player
-    - Ensures the session is closed after use
+    - Logs in the given player on the shared PlayerAPI
     - Yields the logged-in API instance
     """
-    api = PlayerAPI()
-    try:
-        login = await api.login_player(player_id, settings.SALT)
-        if not login:
-            raise RuntimeError(f"Login failed for player: {player_id}")
-        yield api
-    finally:
-        await api.close_session()
+    api = get_player_api()
+    login = await api.login_player(player_id, settings.SALT)
+    if not login:
+        raise RuntimeError(f"Login failed for player: {player_id}")
+    yield api
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+from collections import Counter
+from typing import AsyncIterator, Iterable
+
+from app.core.config import settings
+from app.db.supabase import (
+    get_player_ids, update_players_table, upsert_players, record_login_failures, clear_login_failures
+)
+from app.services.player_api import get_player_api
+from app.utils.circuit_breaker import CircuitOpenError
+from app.utils.wos_api import LoginUnavailable
+
+logger = logging.getLogger(__name__)
+
+ADDED = "added"
+UPDATED = "updated"
+LOGIN_FAILED = "login_failed"
+UPSTREAM_UNAVAILABLE = "upstream_unavailable"
+
+
+async def login_many(fids: Iterable[str], concurrency: int = None) -> AsyncIterator[tuple[str, dict | None, str | None]]:
+    """
+    Log ``fids`` in with a fresh profile, at most ``concurrency`` at a time;
+    every call still goes through the PlayerAPI's shared rate limiter and
+    single-flight logins. Yields (fid, profile, error) in completion order,
+    profile None (and error set) when the login failed.
+    """
+    api = get_player_api()
+    gate = asyncio.Semaphore(concurrency or settings.BULK_LOGIN_CONCURRENCY)
+
+    async def login(fid):
+        async with gate:
+            try:
+                result = await api.login_player(fid, settings.SALT, refresh=True, raise_unavailable=True)
+            except (CircuitOpenError, LoginUnavailable):
+                return fid, None, UPSTREAM_UNAVAILABLE
+        if not result or "token" not in result:
+            return fid, None, LOGIN_FAILED
+        return fid, result["token"], None
+
+    tasks = [asyncio.create_task(login(fid)) for fid in fids]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def onboard_players(fids: Iterable[str]) -> AsyncIterator[dict]:
+    """
+    Subscribe many players: log them in concurrently, then upsert every
+    profile in one statement. Yields one result per fid; login failures as
+    they happen, the rest once the upsert is done.
+    """
+    profiles = {}
+    async for fid, profile, error in login_many(fids):
+        if error:
+            yield {"player_id": fid, "status": error}
+        else:
+            profiles[fid] = {**profile, "fid": fid}
+
+    statuses = upsert_players(profiles.values()) if profiles else {}
+    for fid, profile in profiles.items():
+        yield {"player_id": fid, "status": statuses.get(str(fid), UPDATED), "nickname": profile.get("nickname")}
+
+
+async def refresh_profiles() -> dict:
+    """
+    Log every subscribed player in for a fresh profile and write back only
+    the rows that changed, in one statement. Players still backing off after
+    failed logins are skipped, and rejected logins extend that backoff just
+    like in batch runs. Returns the counts: rows scanned, changed, and
+    logins that failed.
+    """
+    fids = get_player_ids(skip_backed_off=True)
+    profiles, failed, rejected = [], Counter(), []
+    async for fid, profile, error in login_many(fids):
+        if error:
+            failed[error] += 1
+            if error == LOGIN_FAILED:
+                rejected.append(fid)
+        else:
+            profiles.append({**profile, "fid": fid})
+
+    record_login_failures(rejected)
+    clear_login_failures([p["fid"] for p in profiles])
+    changed = update_players_table(profiles) if profiles else []
+    return {"scanned": len(fids), "refreshed": len(profiles), "changed": len(changed), "failed": dict(failed)}
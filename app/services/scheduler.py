@@ -0,0 +1,289 @@
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict
+
+from app.core.config import settings
+from app.db.supabase import (
+    add_giftcode, acquire_job_lock, release_job_lock, get_schedule_state, save_schedule_state, SCHEDULER_LOCK_KEY
+)
+from app.services.code_runs import code_runs
+from app.services.jobs import has_inflight_task, start_job
+from app.services.player_bulk import refresh_profiles
+from app.utils.fetch_gc_async import fetch_latest_codes_async
+
+logger = logging.getLogger(__name__)
+
+OK = "ok"
+SKIPPED = "skipped"
+ERROR = "error"
+
+
+@dataclass
+class ScheduledJob:
+    """
+    One periodic job. ``run`` returns a JSON-friendly detail dict; a
+    "status" key in it (e.g. SKIPPED) overrides the default OK. ``jitter``
+    is a fraction of ``interval`` by which each next run is moved either way.
+    """
+    name: str
+    run: Callable[[], Awaitable[Dict[str, Any]]]
+    interval: float
+    jitter: float = 0.0
+    enabled: bool = True
+    last_run_at: float | None = None    # epoch seconds
+    last_status: str | None = None
+    last_detail: Dict[str, Any] | None = None
+    next_run_at: float | None = None    # epoch seconds
+    running: bool = False
+
+    def plan(self, now, rng=random):
+        """Set next_run_at from the last run, or shortly after ``now`` if it never ran."""
+        if self.last_run_at is None:
+            self.next_run_at = now + self.interval * rng.uniform(0, self.jitter)
+        else:
+            self.next_run_at = self.last_run_at + self.interval * (1 + rng.uniform(-self.jitter, self.jitter))
+
+    def snapshot(self):
+        return {
+            "interval": self.interval,
+            "jitter": self.jitter,
+            "enabled": self.enabled,
+            "running": self.running,
+            "last_run_at": self.last_run_at,
+            "last_status": self.last_status,
+            "last_detail": self.last_detail,
+            "next_run_at": self.next_run_at if self.enabled else None,
+        }
+
+    def state(self):
+        """Columns for save_schedule_state."""
+        return {
+            "interval_seconds": self.interval,
+            "jitter": self.jitter,
+            "enabled": self.enabled,
+            "last_run_at": datetime.fromtimestamp(self.last_run_at, timezone.utc) if self.last_run_at is not None else None,
+            "last_status": self.last_status,
+            "last_detail": self.last_detail,
+        }
+
+
+class Scheduler:
+    """
+    Runs ScheduledJobs from the API process instead of an external cron.
+
+    Only one worker process schedules at a time: the one holding the
+    scheduler advisory lock (``use_lock``); the others retry every
+    ``poll`` seconds so one takes over if the leader dies. Job settings and
+    last runs live in the ``schedule_state`` table, so a restart keeps its
+    place and an adjustment made through any worker reaches the leader on
+    its next poll. Due jobs run as their own tasks, so a slow one never
+    holds up the others; a job never overlaps itself, and the batch-run
+    jobs skip while another run holds the run lock, retrying ``retry``
+    seconds later.
+    """
+
+    def __init__(self, jobs, poll=30.0, retry=300.0, use_lock=True, rng=None):
+        self.jobs: Dict[str, ScheduledJob] = {job.name: job for job in jobs}
+        self.poll = poll
+        self.retry = retry
+        self.use_lock = use_lock
+        self.rng = rng or random.Random()
+        self._lock = None
+        self._task: asyncio.Task | None = None
+        self._running: Dict[asyncio.Task, ScheduledJob] = {}  # job runs started by the loop
+        self._wake = asyncio.Event()
+
+    @property
+    def leader(self):
+        return self._lock is not None or not self.use_lock
+
+    def snapshot(self):
+        if not self.leader:
+            self.load()  # the leader may have run jobs since
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "leader": self.leader,
+            "jobs": {name: job.snapshot() for name, job in self.jobs.items()},
+        }
+
+    def load(self):
+        """Apply persisted overrides and newer last runs, re-planning the jobs they change."""
+        try:
+            rows = get_schedule_state()
+        except Exception as e:
+            logger.exception(f"Failed to load schedule state: {e}")
+            rows = {}
+        now = time.time()
+        for name, job in self.jobs.items():
+            row = rows.get(name) or {}
+            changed = job.next_run_at is None
+            for column, attr in (("interval_seconds", "interval"), ("jitter", "jitter"), ("enabled", "enabled")):
+                if row.get(column) is not None and row[column] != getattr(job, attr):
+                    setattr(job, attr, row[column])
+                    changed = True
+            if row.get("last_run_at") is not None:
+                last_run_at = row["last_run_at"].timestamp()
+                if job.last_run_at is None or last_run_at > job.last_run_at:
+                    job.last_run_at = last_run_at
+                    job.last_status = row.get("last_status")
+                    job.last_detail = row.get("last_detail")
+                    changed = True
+            if changed:
+                job.plan(now, self.rng)
+
+    def _save(self, job):
+        try:
+            save_schedule_state(job.name, job.state())
+        except Exception as e:
+            logger.exception(f"Failed to save schedule state for '{job.name}': {e}")
+
+    def update(self, name, *, interval=None, jitter=None, enabled=None):
+        """Adjust a job (KeyError if unknown, ValueError if out of range) and re-plan it."""
+        job = self.jobs[name]
+        if not self.leader:
+            self.load()  # don't write back stale last runs
+        if interval is not None and interval <= 0:
+            raise ValueError("interval must be positive")
+        if jitter is not None and not 0 <= jitter < 1:
+            raise ValueError("jitter must be in [0, 1)")
+        if interval is not None:
+            job.interval = interval
+        if jitter is not None:
+            job.jitter = jitter
+        if enabled is not None:
+            job.enabled = enabled
+        job.plan(time.time(), self.rng)
+        self._save(job)
+        self._wake.set()
+        return job.snapshot()
+
+    async def run_job(self, name):
+        """Run a job now (unless it is already running) and record the outcome."""
+        job = self.jobs[name]
+        if job.running:
+            return {"status": SKIPPED, "reason": "already running"}
+        job.running = True
+        return await self._run(job)
+
+    async def _run(self, job):
+        """run_job() for a job the caller already marked as running."""
+        name = job.name
+        try:
+            detail = dict(await job.run() or {})
+            status = detail.pop("status", OK)
+        except Exception as e:
+            logger.exception(f"Scheduled job '{name}' failed: {e}")
+            status, detail = ERROR, {"error": str(e)}
+        finally:
+            job.running = False
+        job.last_status, job.last_detail = status, detail
+        if status == SKIPPED:
+            # Blocked by another run: try again soon rather than a whole interval later
+            job.next_run_at = time.time() + min(self.retry, job.interval)
+        else:
+            job.last_run_at = time.time()
+            job.plan(job.last_run_at, self.rng)
+        self._save(job)
+        self._wake.set()  # the loop re-reads next_run_at
+        logger.info(f"Scheduled job '{name}': {status} {detail}")
+        return {"status": status, **detail}
+
+    def _acquire_leadership(self):
+        if self.leader:
+            return True
+        try:
+            self._lock = acquire_job_lock(SCHEDULER_LOCK_KEY)
+        except Exception as e:
+            logger.exception(f"Failed to take the scheduler lock: {e}")
+        if self._lock is not None:
+            logger.info("This worker now runs the scheduler.")
+        return self.leader
+
+    async def _loop(self):
+        while True:
+            delay = self.poll
+            if self._acquire_leadership():
+                self.load()  # picks up adjustments made through other workers
+                for job in self.jobs.values():
+                    if job.enabled and not job.running and job.next_run_at is not None and job.next_run_at <= time.time():
+                        job.running = True
+                        task = asyncio.create_task(self._run(job))
+                        self._running[task] = job
+                        task.add_done_callback(self._forget)
+                pending = [job.next_run_at for job in self.jobs.values() if job.enabled and job.next_run_at and not job.running]
+                if pending:
+                    delay = min(delay, max(min(pending) - time.time(), 0.0))
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _forget(self, task):
+        job = self._running.pop(task, None)
+        if job is not None and task.cancelled():
+            job.running = False  # cancelled before _run() got to its finally
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        running = list(self._running)
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        if self._lock is not None:
+            release_job_lock(self._lock, SCHEDULER_LOCK_KEY)
+            self._lock = None
+
+
+async def fetch_codes():
+    fetched = await fetch_latest_codes_async("whiteoutsurvival", "gift code")
+    new_codes = [c for c in (add_giftcode(code) for code in fetched) if c]
+    code_runs.submit(new_codes)
+    return {"fetched": len(fetched), "new_codes": new_codes}
+
+
+def _start_batch(**kwargs):
+    inflight, tid = has_inflight_task()
+    if inflight:
+        return {"status": SKIPPED, "reason": "a task is already in progress", "task_id": tid}
+    tid = start_job(**kwargs)
+    if tid is None:
+        return {"status": SKIPPED, "reason": "another worker holds the run lock"}
+    return {"task_id": tid}
+
+
+async def probe_codes():
+    """The default player checks codes not checked in the last day (POST /tasks/expired-check)."""
+    return _start_batch()
+
+
+async def redeem_codes():
+    """A batch redemption run (POST /tasks/automate-all)."""
+    return _start_batch(n=settings.SCHEDULE_REDEEM_BATCH)
+
+
+def default_jobs():
+    jitter = settings.SCHEDULE_JITTER
+    return [
+        ScheduledJob("fetch", fetch_codes, settings.SCHEDULE_FETCH_INTERVAL, jitter),
+        ScheduledJob("probe", probe_codes, settings.SCHEDULE_PROBE_INTERVAL, jitter),
+        ScheduledJob("redeem", redeem_codes, settings.SCHEDULE_REDEEM_INTERVAL, jitter),
+        ScheduledJob("refresh", refresh_profiles, settings.SCHEDULE_REFRESH_INTERVAL, jitter),
+    ]
+
+
+scheduler = Scheduler(default_jobs(), use_lock=settings.TASK_STORE == "postgres")
@@ -0,0 +1,96 @@
+import asyncio
+import itertools
+from collections import OrderedDict, deque
+
+HEARTBEAT = "heartbeat"
+
+
+class _TaskStream:
+    __slots__ = ("history", "subscribers", "closed")
+
+    def __init__(self, history):
+        self.history = deque(maxlen=history)
+        self.subscribers: set[asyncio.Queue] = set()
+        self.closed = False
+
+
+class TaskEventBus:
+    """
+    In-process fan-out of task events (progress, per-pair outcomes, final
+    result) to SSE/WebSocket subscribers. Each task keeps its last
+    ``history`` events so a late subscriber starts from the current state;
+    a slow subscriber loses its oldest queued events rather than slowing
+    the run down (progress events carry the absolute value, so nothing is
+    lost that the next one doesn't restore).
+    """
+
+    def __init__(self, history=100, queue_size=500, keep_closed=20):
+        self.history = history
+        self.queue_size = queue_size
+        self.keep_closed = keep_closed
+        self._streams: OrderedDict[str, _TaskStream] = OrderedDict()
+        self._seq = itertools.count(1)
+
+    def has(self, task_id):
+        return task_id in self._streams
+
+    def publish(self, task_id, event, data):
+        stream = self._streams.get(task_id)
+        if stream is None:
+            stream = self._streams[task_id] = _TaskStream(self.history)
+        if stream.closed:
+            return
+        item = (next(self._seq), event, data)
+        stream.history.append(item)
+        for queue in stream.subscribers:
+            if queue.qsize() >= self.queue_size:
+                queue.get_nowait()
+            queue.put_nowait(item)
+
+    def close(self, task_id, result):
+        """Publish the final ``result`` event and end every subscription to ``task_id``."""
+        self.publish(task_id, "result", result)
+        stream = self._streams[task_id]
+        stream.closed = True
+        for queue in stream.subscribers:
+            queue.put_nowait(None)  # the spare slot is reserved for this
+        self._streams.move_to_end(task_id)
+        closed = [tid for tid, s in self._streams.items() if s.closed]
+        for tid in closed[:-self.keep_closed or None]:
+            del self._streams[tid]
+
+    async def subscribe(self, task_id, heartbeat=15.0):
+        """
+        Yield (event, data) for ``task_id``: the buffered history first, then
+        live events until the task closes. Yields (HEARTBEAT, None) after
+        ``heartbeat`` idle seconds so proxies keep the connection open.
+        """
+        stream = self._streams.get(task_id)
+        if stream is None:
+            stream = self._streams[task_id] = _TaskStream(self.history)
+        # Subscribe before replaying so nothing published during the replay is missed
+        history = list(stream.history)
+        last_seq = history[-1][0] if history else 0
+        live = not stream.closed
+        queue = asyncio.Queue(maxsize=self.queue_size + 1)
+        if live:
+            stream.subscribers.add(queue)
+        try:
+            for _, event, data in history:
+                yield event, data
+            while live:
+                try:
+                    item = await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield HEARTBEAT, None
+                    continue
+                if item is None:
+                    return
+                seq, event, data = item
+                if seq > last_seq:
+                    yield event, data
+        finally:
+            stream.subscribers.discard(queue)
+
+
+task_events = TaskEventBus()
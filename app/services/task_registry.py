@@ -0,0 +1,232 @@
+import asyncio
+import copy
+import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict
+
+from app.db.supabase import (
+    upsert_task, get_task, get_inflight_task, delete_finished_tasks
+)
+
+logger = logging.getLogger(__name__)
+
+PROCESSING = "Processing"
+
+# Record fields that used to carry full table snapshots; finished records keep only their size.
+LARGE_FIELDS = ("giftcodes", "players")
+# Set on the records of code-scoped runs (batch_redeemer.run_code), which run beside the batch run.
+CODE_FIELD = "code"
+
+
+def summarize(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Replace large list payloads in a finished task record with their lengths."""
+    compact = {}
+    for key, value in record.items():
+        if key in LARGE_FIELDS and isinstance(value, (list, tuple)):
+            compact[f"{key}_count"] = len(value)
+        else:
+            compact[key] = value
+    return compact
+
+
+class TaskRegistry(MutableMapping):
+    """
+    task_id -> status record, used like the dict it replaces (batch_redeemer
+    writes records and bumps ``progress`` in place).
+
+    In-flight tasks are indexed separately so ``inflight()`` is O(1); it only
+    reports batch runs, code-scoped runs (records with a ``code``) are listed
+    by ``inflight_codes()`` and never block a batch run. Finished
+    records are stored as compact summaries and evicted once there are more
+    than ``max_finished`` of them or they are older than ``ttl`` seconds;
+    in-flight tasks are never evicted.
+    """
+
+    def __init__(self, max_finished=50, ttl=7 * 86400):
+        self.max_finished = max_finished
+        self.ttl = ttl
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._inflight: Dict[str, None] = {}                   # insertion-ordered set
+        self._code_runs: Dict[str, str] = {}                   # task_id -> code, in-flight code-scoped runs
+        self._finished: OrderedDict[str, float] = OrderedDict()  # task_id -> finished at (monotonic)
+
+    def __getitem__(self, task_id):
+        return self._records[task_id]
+
+    def __setitem__(self, task_id, record):
+        self._finished.pop(task_id, None)
+        self._inflight.pop(task_id, None)
+        self._code_runs.pop(task_id, None)
+        if record.get("status") == PROCESSING:
+            if record.get(CODE_FIELD) is None:
+                self._inflight[task_id] = None
+            else:
+                self._code_runs[task_id] = record[CODE_FIELD]
+        else:
+            record = summarize(record)
+            self._finished[task_id] = time.monotonic()
+        self._records[task_id] = record
+        self.evict()
+
+    def __delitem__(self, task_id):
+        del self._records[task_id]
+        self._inflight.pop(task_id, None)
+        self._code_runs.pop(task_id, None)
+        self._finished.pop(task_id, None)
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def __len__(self):
+        return len(self._records)
+
+    def inflight(self) -> str | None:
+        """Oldest batch run still processing, or None."""
+        return next(iter(self._inflight), None)
+
+    def inflight_codes(self) -> Dict[str, str]:
+        """code -> task_id of the code-scoped runs still processing."""
+        return {code: task_id for task_id, code in self._code_runs.items()}
+
+    def processing(self, task_id) -> bool:
+        return task_id in self._inflight or task_id in self._code_runs
+
+    def touch(self, task_id):
+        """Called after a record was changed in place (e.g. its progress)."""
+
+    def evict(self):
+        cutoff = time.monotonic() - self.ttl
+        while self._finished:
+            task_id, finished_at = next(iter(self._finished.items()))
+            if len(self._finished) <= self.max_finished and finished_at > cutoff:
+                break
+            self._finished.popitem(last=False)
+            self._records.pop(task_id, None)
+
+    def clear(self, keep=()):
+        """
+        Drop every record but those in ``keep`` (the runs still going), so
+        a Processing record left behind by a run that died goes too.
+        """
+        for task_id in [t for t in self._records if t not in keep]:
+            del self[task_id]
+
+
+class SharedTaskRegistry(TaskRegistry):
+    """
+    TaskRegistry that writes through to the Postgres ``tasks`` table so every
+    API worker process sees the same task state. Records this process owns
+    are served from memory; anything else is read from the table. Progress
+    bumps are written at most every ``flush_interval`` seconds, status
+    changes immediately. Which run is in flight is decided by the batch-run
+    advisory lock (see app.db.supabase.acquire_job_lock); code-scoped runs
+    take no lock, and ``inflight_codes()`` only lists this process's own.
+    A cancel requested through another worker comes back from the next write
+    of the task and is handed to ``on_cancel_requested``.
+
+    Writes made from the event loop run on a single background thread, in
+    the order they were made, so progress flushes never block the loop. The
+    table's answer to ``inflight()`` is cached for ``inflight_ttl`` seconds.
+    """
+
+    def __init__(self, max_finished=50, ttl=7 * 86400, flush_interval=1.0, inflight_ttl=2.0):
+        super().__init__(max_finished=max_finished, ttl=ttl)
+        self.flush_interval = flush_interval
+        self.inflight_ttl = inflight_ttl
+        self.on_cancel_requested: Callable[[str], Any] | None = None
+        self._flushed_at: Dict[str, float] = {}
+        self._remote_inflight: tuple[float, str | None] | None = None  # (looked up at, task_id)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="task-store")
+
+    def _off_loop(self, fn, *args, then=None):
+        """
+        Run ``fn(*args)`` on the writer thread when called from the event loop
+        (inline otherwise), then hand its result to ``then`` on the loop.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            result = fn(*args)
+            if then is not None:
+                then(result)
+            return
+
+        def run():
+            result = fn(*args)
+            if then is not None and not loop.is_closed():
+                loop.call_soon_threadsafe(then, result)
+
+        self._writer.submit(run)
+
+    def _persist(self, task_id):
+        self._flushed_at[task_id] = time.monotonic()
+        record = copy.deepcopy(self._records[task_id])
+        self._off_loop(self._upsert, task_id, record, then=lambda cancel: self._cancel_requested(task_id, cancel))
+
+    @staticmethod
+    def _upsert(task_id, record) -> bool:
+        try:
+            return upsert_task(task_id, record)
+        except Exception as e:
+            logger.exception(f"Failed to persist task {task_id}: {e}")
+            return False
+
+    def _cancel_requested(self, task_id, cancel_requested):
+        if cancel_requested and self.on_cancel_requested is not None and self.processing(task_id):
+            self.on_cancel_requested(task_id)
+
+    def _prune(self, max_finished):
+        try:
+            delete_finished_tasks(max_finished, self.ttl)
+        except Exception as e:
+            logger.exception(f"Failed to prune finished tasks: {e}")
+
+    def __getitem__(self, task_id):
+        try:
+            return super().__getitem__(task_id)
+        except KeyError:
+            pass
+        try:
+            record = get_task(task_id)
+        except Exception as e:
+            logger.exception(f"Failed to load task {task_id}: {e}")
+            record = None
+        if record is None:
+            raise KeyError(task_id)
+        return record
+
+    def __setitem__(self, task_id, record):
+        super().__setitem__(task_id, record)
+        if task_id not in self._records:
+            return  # evicted straight away
+        self._persist(task_id)
+        if record.get("status") != PROCESSING:
+            self._flushed_at.pop(task_id, None)
+            self._off_loop(self._prune, self.max_finished)
+
+    def touch(self, task_id):
+        if self.processing(task_id) and time.monotonic() - self._flushed_at.get(task_id, 0.0) >= self.flush_interval:
+            self._persist(task_id)
+
+    def inflight(self) -> str | None:
+        local = super().inflight()
+        if local is not None:
+            return local
+        now = time.monotonic()
+        if self._remote_inflight is not None and now - self._remote_inflight[0] < self.inflight_ttl:
+            return self._remote_inflight[1]
+        try:
+            task_id = get_inflight_task()
+        except Exception as e:
+            logger.exception(f"Failed to look up in-flight task: {e}")
+            return None
+        self._remote_inflight = (now, task_id)
+        return task_id
+
+    def clear(self, keep=()):
+        super().clear(keep)
+        self._remote_inflight = None
+        self._off_loop(self._prune, 0)
@@ -0,0 +1,62 @@
+import time
+import tracemalloc
+import unittest
+from unittest import mock
+
+from app.utils import player_sessions
+from app.utils.player_sessions import PlayerSessionStore
+
+
+class PlayerSessionStoreTests(unittest.TestCase):
+    def test_least_recently_used_session_is_evicted_at_capacity(self):
+        store = PlayerSessionStore(max_size=2, ttl=60)
+        store.put("a", 1, "sign-a")
+        store.put("b", 2, "sign-b")
+        store.get("a")
+
+        store.put("c", 3, "sign-c")
+
+        self.assertIn("a", store)
+        self.assertNotIn("b", store)
+        self.assertEqual(len(store), 2)
+
+    def test_expired_session_is_dropped_on_access(self):
+        store = PlayerSessionStore(max_size=10, ttl=30)
+        now = time.monotonic()
+        with mock.patch.object(player_sessions.time, "monotonic", return_value=now):
+            store.put("a", 1, "sign-a")
+        with mock.patch.object(player_sessions.time, "monotonic", return_value=now + 31):
+            self.assertIsNone(store.get("a"))
+        self.assertEqual(len(store), 0)
+
+    def test_relogin_keeps_pending_cooldown(self):
+        store = PlayerSessionStore()
+        store.put("a", 1, "old").next_allowed_at = 123.0
+
+        session = store.put("a", 2, "new")
+
+        self.assertEqual(session.next_allowed_at, 123.0)
+        self.assertEqual(session.request_data(), {"fid": "a", "time": 2, "sign": "new"})
+
+    def test_memory_per_session_stays_small(self):
+        count = 2000
+        fids = [str(400000000 + i) for i in range(count)]
+        signs = [f"{i:032x}" for i in range(count)]
+        stamps = [1760000000000 + i for i in range(count)]
+        store = PlayerSessionStore(max_size=count, ttl=60)
+
+        tracemalloc.start()
+        try:
+            before, _ = tracemalloc.get_traced_memory()
+            for fid, stamp, sign in zip(fids, stamps, signs):
+                store.put(fid, stamp, sign)
+            after, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        per_session = (after - before) / count
+        self.assertLess(per_session, 512, f"{per_session:.0f} bytes per session")
+
+
+if __name__ == "__main__":
+    unittest.main()
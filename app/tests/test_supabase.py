@@ -28,6 +28,9 @@ class FakeCursor:
     def execute(self, query, params=None):
         self.executions.append((str(query), params))
 
+    def executemany(self, query, params_seq):
+        self.executions.append((str(query), list(params_seq)))
+
     def fetchone(self):
         if self.fetchone_results:
             return self.fetchone_results.pop(0)
@@ -36,6 +39,9 @@ class FakeCursor:
     def fetchall(self):
         return self.fetchall_result
 
+    def __iter__(self):
+        return iter(self.fetchall_result)
+
 
 class FakeConnection:
     def __init__(self, cursor):
@@ -47,7 +53,8 @@ class FakeConnection:
     def __exit__(self, exc_type, exc, tb):
         return False
 
-    def cursor(self):
+    def cursor(self, **kwargs):
+        self.cursor_kwargs = kwargs
         return self._cursor
 
 
@@ -95,6 +102,47 @@ class SupabaseTests(unittest.TestCase):
         self.assertIs(params["subscribed_date"], now)
         self.assertIsNotNone(params["subscribed_date"].tzinfo)
 
+    def test_upsert_players_sends_one_statement_with_deduplicated_profiles(self):
+        cursor = FakeCursor(fetchall_result=[("1", True), ("2", False)])
+        profiles = [
+            {"fid": 1, "nickname": "old", "kid": 1, "stove_lv": 2, "stove_lv_content": 2,
+             "avatar_image": "a.png", "total_recharge_amount": 0, "extra": "dropped"},
+            {"fid": "1", "nickname": "new", "kid": 1, "stove_lv": 2, "stove_lv_content": 2,
+             "avatar_image": "a.png", "total_recharge_amount": 0},
+            {"fid": "2", "nickname": "two", "kid": 3, "stove_lv": 4, "stove_lv_content": 4,
+             "avatar_image": "b.png", "total_recharge_amount": 5},
+        ]
+
+        with patch_connect(cursor):
+            results = supabase.upsert_players(profiles)
+
+        self.assertEqual(results, {"1": "added", "2": "updated"})
+        self.assertEqual(len(cursor.executions), 1)
+        query, params = cursor.executions[0]
+        self.assertIn("jsonb_to_recordset", query)
+        self.assertIn("ON CONFLICT (fid)", query)
+        rows = params[1].obj
+        self.assertEqual([(r["fid"], r["nickname"]) for r in rows], [("1", "new"), ("2", "two")])
+        self.assertNotIn("extra", rows[0])
+
+    def test_update_players_table_writes_only_changed_profiles_in_one_statement(self):
+        cursor = FakeCursor(fetchall_result=[("2",)])
+        profiles = [
+            {"fid": 1, "nickname": "same", "kid": 1, "stove_lv": 2, "stove_lv_content": 2,
+             "avatar_image": "a.png", "total_recharge_amount": 0},
+            {"fid": 2, "nickname": "renamed", "kid": 3, "stove_lv": 4, "stove_lv_content": 4,
+             "avatar_image": "b.png", "total_recharge_amount": 5},
+        ]
+
+        with patch_connect(cursor):
+            changed = supabase.update_players_table(profiles)
+
+        self.assertEqual(changed, ["2"])
+        self.assertEqual(len(cursor.executions), 1)
+        query, params = cursor.executions[0]
+        self.assertIn("IS DISTINCT FROM", query)
+        self.assertEqual([r["fid"] for r in params[0].obj], ["1", "2"])
+
     def test_update_player_normalizes_numeric_fid(self):
         cursor = FakeCursor()
         player = {
@@ -136,6 +184,32 @@ class SupabaseTests(unittest.TestCase):
         self.assertEqual(params, ("player-1", "CODE1", now))
         self.assertIsNotNone(params[2].tzinfo)
 
+    def test_record_run_results_writes_each_kind_in_one_statement(self):
+        cursor = FakeCursor()
+        now = datetime(2026, 6, 3, 12, 5, tzinfo=timezone.utc)
+
+        with patch_connect(cursor), mock.patch.object(supabase, "_now", return_value=now):
+            supabase.record_run_results(
+                redeemed=[{"fid": 1, "code": "A"}, {"fid": "2", "code": "A"}],
+                expired=["OLD"], captcha_ids=[7, 8], checked=["A"],
+            )
+
+        (insert, rows), (expire, expired), (feedback, ids), (checked, codes) = cursor.executions
+        self.assertIn("INSERT INTO redemptions", insert)
+        self.assertEqual(rows, [("1", "A", now), ("2", "A", now)])
+        self.assertIn("status = 'Inactive'", expire)
+        self.assertEqual(expired, (["OLD"],))
+        self.assertEqual(ids, ([7, 8],))
+        self.assertEqual(codes, (now, ["A"]))
+
+    def test_record_run_results_skips_empty_kinds(self):
+        cursor = FakeCursor()
+
+        with patch_connect(cursor):
+            supabase.record_run_results(checked=["A"])
+
+        self.assertEqual(len(cursor.executions), 1)
+
     def test_update_giftcode_checkedtime_writes_timezone_aware_last_checked(self):
         cursor = FakeCursor()
         now = datetime(2026, 6, 3, 12, 10, tzinfo=timezone.utc)
@@ -169,6 +243,78 @@ class SupabaseTests(unittest.TestCase):
         self.assertEqual(rows, [{"fid": "player-1", "code": "CODE1"}])
         self.assertIn("r.redeemed_date", query)
         self.assertNotIn("redeemed_at", query)
+        self.assertIn("FROM ineligible_pairs i", query)
+        self.assertIn("f.retry_after > CURRENT_TIMESTAMP", query)
+
+    def test_get_player_ids_can_skip_players_backing_off(self):
+        cursor = FakeCursor(fetchall_result=[("1",), ("2",)])
+
+        with patch_connect(cursor):
+            everyone = supabase.get_player_ids()
+            reachable = supabase.get_player_ids(skip_backed_off=True)
+
+        self.assertEqual(everyone, ["1", "2"])
+        self.assertEqual(reachable, ["1", "2"])
+        self.assertNotIn("player_login_failures", cursor.executions[0][0])
+        self.assertIn("f.retry_after > CURRENT_TIMESTAMP", cursor.executions[1][0])
+
+    def test_select_unredeemed_pairs_orders_by_policy_and_limits(self):
+        rows = [{"fid": "1", "code": "A"}]
+        cursor = FakeCursor(fetchall_result=rows)
+
+        with patch_connect(cursor):
+            result = supabase.select_unredeemed_pairs(25, "least-recent", exclude_codes={"B"})
+
+        query, params = cursor.executions[0]
+        self.assertEqual(result, rows)
+        self.assertIn("LEFT JOIN redemption_attempts a", query)
+        self.assertIn(supabase.SELECTION_POLICIES["least-recent"], query)
+        self.assertIn("NOT (pending.code = ANY(%s))", query)
+        self.assertEqual(params[-2:], (["B"], 25))
+
+        with self.assertRaises(ValueError):
+            supabase.select_unredeemed_pairs(25, "random-seed-42")
+
+    def test_record_attempts_upserts_one_row_per_pair(self):
+        cursor = FakeCursor()
+
+        with patch_connect(cursor):
+            supabase.record_attempts([
+                {"fid": 123, "code": "A", "outcome": "20000"},
+                {"fid": "456", "code": "B", "outcome": "40103"},
+            ])
+
+        query, params = cursor.executions[0]
+        self.assertIn("ON CONFLICT (player_id, code)", query)
+        self.assertIn("attempts = redemption_attempts.attempts + 1", query)
+        self.assertEqual([(p[0], p[1], p[3]) for p in params], [("123", "A", "20000"), ("456", "B", "40103")])
+        self.assertIsNotNone(params[0][2].tzinfo)
+
+    def test_record_login_failures_backs_off_exponentially_with_a_cap(self):
+        cursor = FakeCursor()
+
+        with patch_connect(cursor):
+            supabase.record_login_failures([123])
+
+        query, params = cursor.executions[0]
+        self.assertIn("POWER(2, player_login_failures.failures)", query)
+        self.assertIn("LEAST(%(cap)s", query)
+        self.assertEqual(params[0]["fid"], "123")
+        self.assertEqual(params[0]["base"], supabase.settings.DEAD_PLAYER_BACKOFF_BASE)
+        self.assertEqual(params[0]["cap"], supabase.settings.DEAD_PLAYER_BACKOFF_MAX)
+
+    def test_iter_labeled_captchas_streams_feedback_rows_through_named_cursor(self):
+        cursor = FakeCursor(fetchall_result=[(1, "AB23", memoryview(b"img"))])
+        conn = FakeConnection(cursor)
+
+        with mock.patch.object(supabase, "_connect", return_value=conn):
+            rows = list(supabase.iter_labeled_captchas(limit=10))
+
+        query, params = cursor.executions[-1]
+        self.assertEqual(rows, [(1, "AB23", b"img")])
+        self.assertEqual(params, [10])
+        self.assertIn("feedback = TRUE", query)
+        self.assertIn("name", conn.cursor_kwargs)
 
 
 if __name__ == "__main__":
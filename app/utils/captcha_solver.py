@@ -2,40 +2,134 @@ from PIL import Image
 import base64
 import io
 import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import onnxruntime as ort
+from app.core.config import settings
 from app.db.supabase import record_captcha
+from app.utils import metrics
+from app.utils.tracing import tracer
 
+logger = logging.getLogger(__name__)
 
 MODEL_PATH = "app/model/captcha_model.onnx"
 META_PATH = "app/model/captcha_model_metadata.json"
 
+# Selectable model variants. Each entry carries its own metadata so variants
+# may differ in input shape (the preprocessing reads it from there).
+MODEL_VARIANTS = {
+    "fp32": {"model": MODEL_PATH, "metadata": META_PATH},
+    # Written by `python -m app.utils.quantize_captcha_model`.
+    "int8": {"model": "app/model/captcha_model.int8.onnx", "metadata": META_PATH},
+}
 
-class CaptchaSolver:
-    def __init__(self):
-        self.session = ort.InferenceSession(MODEL_PATH)
-        with open(META_PATH, "r", encoding="utf-8") as f:
-            self.metadata = json.load(f)
 
-    def preprocess_image(self, image: Image.Image):
-        channels, height, width = self.metadata["input_shape"]
+def register_variant(name, model_path, meta_path=META_PATH):
+    """Add or replace a model variant at runtime."""
+    MODEL_VARIANTS[name] = {"model": model_path, "metadata": meta_path}
+
+
+class CaptchaSolver:
+    def __init__(self, variant=None):
+        variant = variant or settings.CAPTCHA_MODEL_VARIANT
+        if variant not in MODEL_VARIANTS:
+            raise ValueError(f"Unknown captcha model variant: {variant}")
+        spec = MODEL_VARIANTS[variant]
 
-        img = image.resize((width, height)).convert('L')  # convert to grayscale
+        self.variant = variant
+        self.session = ort.InferenceSession(spec["model"])
+        with open(spec["metadata"], "r", encoding="utf-8") as f:
+            self.metadata = json.load(f)
+        self.shadow = None
+        self._compile()
 
-        arr = np.asarray(img).astype(np.float32) / 255.0
+    def _compile(self):
+        """Precompute everything preprocess/decode would otherwise look up per call."""
+        self.channels, self.height, self.width = self.metadata["input_shape"]
+        self.output_positions = self.metadata["output_positions"]
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # A symbolic/unknown leading dim means the graph accepts batches in one run().
+        batch_dim = model_input.shape[0] if getattr(model_input, "shape", None) else 1
+        self.batchable = not isinstance(batch_dim, int)
 
+        # (px / 255 - mean) / std  ==  px * scale + shift
         mean = self.metadata["normalization"]["mean"][0]
         std = self.metadata["normalization"]["std"][0]
-        arr = (arr - mean) / std
+        self.scale = np.float32(1.0 / (255.0 * std))
+        self.shift = np.float32(-mean / std)
+
+        # Index -> ASCII byte lookup table, decoded in one shot with tobytes().
+        idx_to_char = self.metadata["idx_to_char"]
+        chars = "".join(idx_to_char[str(i)] for i in range(len(idx_to_char)))
+        self.charmap = np.frombuffer(chars.encode("ascii"), dtype=np.uint8)
+
+        # Input buffers are reused across calls; one per thread so concurrent solves don't collide.
+        self._local = threading.local()
+
+    def _input_buffer(self):
+        buf = getattr(self._local, "buf", None)
+        if buf is None:
+            buf = np.empty((1, self.channels, self.height, self.width), dtype=np.float32)
+            self._local.buf = buf
+        return buf
 
-        # Shape: [1, C, H, W]
-        if channels == 1:
-            arr = arr[np.newaxis, np.newaxis, :, :]
-        else:
-            arr = np.repeat(arr[np.newaxis, :, :], channels, axis=0)
-            arr = arr[np.newaxis, :, :, :]
+    def preprocess_image(self, image: Image.Image, out=None):
+        """Write the normalized [1, C, H, W] tensor for ``image`` into ``out`` (or the thread buffer)."""
+        if out is None:
+            out = self._input_buffer()
 
-        return arr
+        # Grayscale first so the resize only touches one channel.
+        img = image.convert('L').resize((self.width, self.height))
+        pixels = np.asarray(img)
+
+        # Fused normalization straight into the first channel, no float temporaries.
+        plane = out[0, 0]
+        np.multiply(pixels, self.scale, out=plane)
+        plane += self.shift
+        if self.channels > 1:
+            out[0, 1:] = plane
+
+        return out
+
+    def decode(self, outputs):
+        """Decode per-position model outputs into (texts, confidences) for every row of the batch."""
+        # [positions] x [N, classes] -> [N, positions, classes]
+        probs = np.stack(
+            [np.reshape(o, (-1, o.shape[-1])) for o in outputs[:self.output_positions]],
+            axis=1,
+        )
+        idx = probs.argmax(axis=2)
+        confidences = np.take_along_axis(probs, idx[..., np.newaxis], axis=2)[..., 0]
+        texts = [row.tobytes().decode("ascii") for row in self.charmap[idx]]
+        return texts, confidences
+
+    def predict(self, image: Image.Image):
+        """Run the model on a single image and return (text, per-position confidences)."""
+        arr = self.preprocess_image(image)
+        outputs = self.session.run(None, {self.input_name: arr})
+        texts, confidences = self.decode(outputs)
+        return texts[0], confidences[0].tolist()
+
+    def predict_batch(self, images):
+        """Predict a list of images, in one run() when the model has a dynamic batch dimension."""
+        if not self.batchable:
+            results = [self.predict(image) for image in images]
+            return [text for text, _ in results], [conf for _, conf in results]
+
+        batch = np.empty((len(images), self.channels, self.height, self.width), dtype=np.float32)
+        for i, image in enumerate(images):
+            self.preprocess_image(image, out=batch[i:i + 1])
+        outputs = self.session.run(None, {self.input_name: batch})
+        texts, confidences = self.decode(outputs)
+        return texts, confidences.tolist()
 
     def solve(self, captcha_json):
         image_data = captcha_json["data"]["img"]
@@ -44,37 +138,150 @@ class CaptchaSolver:
         raw_bytes = base64.b64decode(base64_str)
         image = Image.open(io.BytesIO(raw_bytes))
 
-        arr = self.preprocess_image(image)
+        start = time.perf_counter()
+        with tracer.span("onnx", variant=self.variant):
+            predicted_text, _ = self.predict(image)
+        elapsed = time.perf_counter() - start
+        metrics.captcha_solve_latency.observe(elapsed)
 
-        input_name = self.session.get_inputs()[0].name
-        outputs = self.session.run(None, {input_name: arr})
+        if self.shadow is not None:
+            self.shadow.compare(image, predicted_text, elapsed)
 
-        predicted_text = ""
-        confidences = []
+        captcha_id = record_captcha(predicted_text, raw_bytes)
 
-        idx_to_char = self.metadata["idx_to_char"]
-        output_positions = self.metadata["output_positions"]
+        return predicted_text, captcha_id
 
-        for pos in range(output_positions):
-            probs = outputs[pos]
-            probs = np.squeeze(probs)
 
-            max_idx = int(np.argmax(probs))
-            max_prob = float(probs[max_idx])
+class ShadowSolver:
+    """
+    Runs a candidate variant on the same live captchas as the primary and
+    records how often they agree and how long each took. The candidate's
+    answer is never used, so it runs on its own worker thread: compare()
+    only queues the image, and samples beyond ``max_pending`` queued ones
+    are dropped rather than piling up.
+    """
 
-            predicted_text += idx_to_char[str(max_idx)]
-            confidences.append(max_prob)
-        
-        captcha_id = record_captcha(predicted_text, raw_bytes)
+    def __init__(self, candidate: CaptchaSolver, sample_rate=1.0, window=1000, max_pending=8):
+        self.candidate = candidate
+        self.sample_rate = sample_rate
+        self.max_pending = max_pending
+        self.compared = 0
+        self.agreed = 0
+        self.errors = 0
+        self.dropped = 0
+        self.pending = 0
+        self.primary_ms = deque(maxlen=window)
+        self.candidate_ms = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="captcha-shadow")
 
-        return predicted_text, captcha_id
+    def compare(self, image, primary_text, primary_elapsed):
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.dropped += 1
+                return
+            self.pending += 1
+        self._executor.submit(self._compare, image, primary_text, primary_elapsed)
+
+    def flush(self):
+        """Wait for the comparisons queued so far."""
+        self._executor.submit(lambda: None).result()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def _compare(self, image, primary_text, primary_elapsed):
+        try:
+            self._run(image, primary_text, primary_elapsed)
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def _run(self, image, primary_text, primary_elapsed):
+        try:
+            start = time.perf_counter()
+            candidate_text, _ = self.candidate.predict(image)
+            elapsed = time.perf_counter() - start
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            logger.warning(f"Shadow variant '{self.candidate.variant}' failed: {e}")
+            return
+
+        with self._lock:
+            self.compared += 1
+            self.agreed += candidate_text == primary_text
+            self.primary_ms.append(primary_elapsed * 1000)
+            self.candidate_ms.append(elapsed * 1000)
+
+    def stats(self):
+        with self._lock:
+            primary = list(self.primary_ms)
+            candidate = list(self.candidate_ms)
+            compared, agreed, errors, dropped = self.compared, self.agreed, self.errors, self.dropped
+        return {
+            "candidate": self.candidate.variant,
+            "compared": compared,
+            "agreement": round(agreed / compared, 4) if compared else None,
+            "errors": errors,
+            "dropped": dropped,
+            "primary_p50_ms": round(float(np.median(primary)), 3) if primary else None,
+            "candidate_p50_ms": round(float(np.median(candidate)), 3) if candidate else None,
+        }
+
+
+_solver: CaptchaSolver | None = None
+
+
+def get_solver() -> CaptchaSolver:
+    """Return the process-wide solver, built lazily from settings on first use."""
+    global _solver
+    if _solver is None:
+        select_variant(settings.CAPTCHA_MODEL_VARIANT, settings.CAPTCHA_SHADOW_VARIANT,
+                       settings.CAPTCHA_SHADOW_SAMPLE_RATE)
+    return _solver
+
+
+def _check_variant_files(variant):
+    spec = MODEL_VARIANTS.get(variant)
+    if spec is None:
+        raise ValueError(f"Unknown captcha model variant: {variant}")
+    missing = [path for path in (spec["model"], spec["metadata"]) if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(f"Captcha model variant '{variant}' is missing {', '.join(missing)}")
+
+
+def select_variant(primary, shadow=None, sample_rate=0.05) -> CaptchaSolver:
+    """Switch the process-wide solver to ``primary``, optionally shadowed by ``shadow``."""
+    global _solver
+    _check_variant_files(primary)
+    if shadow and shadow != primary:
+        _check_variant_files(shadow)
+    solver = CaptchaSolver(primary)
+    if shadow and shadow != primary:
+        solver.shadow = ShadowSolver(CaptchaSolver(shadow), sample_rate=sample_rate)
+    previous, _solver = _solver, solver
+    if previous is not None and previous.shadow is not None:
+        previous.shadow.close()
+    logger.info(f"Captcha solver using variant '{primary}'" + (f" (shadow: '{shadow}')" if solver.shadow else ""))
+    return solver
+
+
+def shadow_stats():
+    """Agreement/latency stats for the active shadow variant, or None when shadow mode is off."""
+    if _solver is None or _solver.shadow is None:
+        return None
+    return _solver.shadow.stats()
 
 
 def main():
     solver = CaptchaSolver()
-    result = solver.solve("captcha.png")
+    path = sys.argv[1] if len(sys.argv) > 1 else "captcha.png"
+    result = solver.predict(Image.open(path))
     print(result)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,108 @@
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling upstream while the breaker is open; ``retry_at`` is a time.monotonic()."""
+
+    def __init__(self, name, retry_at):
+        super().__init__(f"Circuit '{name}' is open; retry in {max(0.0, retry_at - time.monotonic()):.1f}s")
+        self.name = name
+        self.retry_at = retry_at
+
+
+class CircuitBreaker:
+    """
+    Failure-rate circuit breaker.
+
+    CLOSED: calls go through; the last ``window`` outcomes are kept and the
+    breaker opens once at least ``min_calls`` of them show a failure rate of
+    ``failure_rate`` or more.
+    OPEN: calls fail fast with CircuitOpenError for ``open_seconds``.
+    HALF_OPEN: up to ``half_open_calls`` probes are let through; a success
+    closes the breaker, a failure re-opens it. ``consecutive_trips`` counts
+    re-opens without an intervening recovery, so callers can give up.
+    """
+
+    def __init__(self, name, failure_rate=0.5, window=20, min_calls=8, open_seconds=30, half_open_calls=1):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+
+        self.state = CLOSED
+        self.opened_until = 0.0
+        self.trips = 0
+        self.consecutive_trips = 0
+        self._outcomes = deque(maxlen=window)
+        self._probes = 0
+        self._probe_started = 0.0
+
+    def before_call(self):
+        """Raise CircuitOpenError if the call must not go upstream right now."""
+        if self.state == OPEN:
+            if time.monotonic() < self.opened_until:
+                raise CircuitOpenError(self.name, self.opened_until)
+            self.state = HALF_OPEN
+            self._probes = 0
+            logger.info(f"Circuit '{self.name}' half-open; probing upstream.")
+
+        if self.state == HALF_OPEN:
+            now = time.monotonic()
+            # A probe that never reported back (e.g. cancelled) frees its slot after open_seconds
+            if self._probes >= self.half_open_calls and now - self._probe_started < self.open_seconds:
+                raise CircuitOpenError(self.name, now + 1)
+            if self._probes >= self.half_open_calls:
+                self._probes = 0
+            self._probes += 1
+            self._probe_started = now
+
+    def record_success(self):
+        if self.state == HALF_OPEN:
+            logger.info(f"Circuit '{self.name}' closed; upstream recovered.")
+            self.state = CLOSED
+            self.consecutive_trips = 0
+            self._outcomes.clear()
+        self._outcomes.append(True)
+
+    def record_failure(self):
+        if self.state == HALF_OPEN:
+            self._open()
+            return
+        self._outcomes.append(False)
+        if self.state == CLOSED and len(self._outcomes) >= self.min_calls:
+            failures = self._outcomes.count(False)
+            if failures / len(self._outcomes) >= self.failure_rate:
+                self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_until = time.monotonic() + self.open_seconds
+        self.trips += 1
+        self.consecutive_trips += 1
+        self._outcomes.clear()
+        logger.warning(f"Circuit '{self.name}' opened for {self.open_seconds}s (trip {self.consecutive_trips}).")
+
+    @property
+    def retry_at(self):
+        return self.opened_until if self.state == OPEN else time.monotonic()
+
+    def snapshot(self):
+        recent = len(self._outcomes)
+        return {
+            "name": self.name,
+            "state": self.state,
+            "failure_rate": round(self._outcomes.count(False) / recent, 3) if recent else 0.0,
+            "recent_calls": recent,
+            "trips": self.trips,
+            "consecutive_trips": self.consecutive_trips,
+            "retry_in": round(max(0.0, self.opened_until - time.monotonic()), 1) if self.state == OPEN else 0.0,
+        }
@@ -0,0 +1,210 @@
+"""
+Minimal in-process metrics rendered in the Prometheus text format (GET /metrics).
+
+Counters, gauges and histograms keyed by a tuple of label values. Updates
+are a dict lookup under a lock, cheap enough for every upstream call and DB
+query. A counter or gauge can instead be read from ``fn`` when scraped, for
+state another module already counts (fn returns the value, or with labels a
+dict of label-value tuples to values).
+"""
+import bisect
+import threading
+from typing import Any, Callable
+
+# Seconds; covers sub-millisecond DB/captcha work up to slow upstream calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name!r} is already registered.")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=(), registry=registry, fn: Callable[[], Any] | None = None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self.fn = fn
+        self._values = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _labels(self, values):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}.")
+        return tuple(zip(self.labelnames, values))
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def _current(self):
+        if self.fn is None:
+            with self._lock:
+                return dict(self._values)
+        value = self.fn()
+        return value if self.labelnames else {(): value}
+
+    def value(self, *labels):
+        return self._current().get(labels, 0)
+
+    def samples(self):
+        for labels, value in self._current().items():
+            yield self.name, self._labels(labels), value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value that goes up and down."""
+
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), registry=registry, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # per-bucket counts (the last one is +Inf), sum, count
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, *labels):
+        state = self._values.get(labels)
+        return state[2] if state else 0
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, (list(counts), total, n)) for labels, (counts, total, n) in self._values.items()]
+        for labels, (counts, total, n) in items:
+            named = self._labels(labels)
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket
+                yield f"{self.name}_bucket", named + (("le", _format_value(float(bound))),), cumulative
+            yield f"{self.name}_sum", named, total
+            yield f"{self.name}_count", named, n
+
+
+def render() -> str:
+    return registry.render()
+
+
+# Upstream gift code API (app/utils/wos_api.py)
+upstream_requests = Counter(
+    "wos_upstream_requests_total", "Upstream API calls by endpoint and HTTP status (\"error\" when no response).",
+    ("endpoint", "status"),
+)
+upstream_results = Counter(
+    "wos_upstream_results_total", "Parsed upstream responses by endpoint and err_code.", ("endpoint", "err_code"),
+)
+upstream_latency = Histogram("wos_upstream_request_seconds", "Upstream API call latency.", ("endpoint",))
+player_logins = Counter(
+    "wos_player_logins_total", "Player logins sent upstream, or coalesced onto one already in flight.", ("result",),
+)
+
+
+def _limiter_state():
+    from app.utils.wos_api import upstream_limiter
+    return upstream_limiter.snapshot()
+
+
+def _policy_decisions():
+    from app.utils.outcome_policy import get_policy
+    return {(rule, event): n for rule, counts in get_policy().snapshot().items() for event, n in counts.items()}
+
+
+upstream_limiter_tokens = Gauge(
+    "wos_upstream_limiter_tokens", "Tokens left in the upstream rate limiter (negative: callers are queued).",
+    fn=lambda: _limiter_state()["tokens"],
+)
+upstream_limiter_waits = Counter(
+    "wos_upstream_limiter_waits_total", "Upstream calls that had to wait for the rate limiter.",
+    fn=lambda: _limiter_state()["waits"],
+)
+
+# Outcome policy (app/utils/outcome_policy.py)
+policy_decisions = Counter(
+    "wos_policy_decisions_total", "Outcome policy decisions by rule and event (seen, retries, give_ups).",
+    ("rule", "event"), fn=_policy_decisions,
+)
+
+# Captcha solving (app/utils/captcha_solver.py)
+captcha_solve_latency = Histogram(
+    "wos_captcha_solve_seconds", "Captcha model inference time per solve.",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1),
+)
+
+# Database (app/db/supabase.py)
+db_latency = Histogram("wos_db_call_seconds", "Latency of app.db.supabase functions.", ("function",))
+
+# Batch redemption (app/services/batch_redeemer.py)
+redeem_workers = Gauge("wos_redeem_workers", "Workers running in process_unredeemed_df.")
+redeem_queue_depth = Gauge("wos_redeem_queue_depth", "Players queued in process_unredeemed_df.")
+pairs_processed = Counter("wos_pairs_processed_total", "Finished (fid, code) pairs by outcome.", ("outcome",))
+
+# HTTP server (app/core/access_log.py)
+http_requests = Counter("http_requests_total", "HTTP requests by method, route and status.", ("method", "route", "status"))
+http_latency = Histogram("http_request_seconds", "HTTP request latency by route.", ("method", "route"))
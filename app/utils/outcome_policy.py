@@ -0,0 +1,157 @@
+import json
+import random
+import threading
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from app.core.config import settings
+
+# Actions an outcome can map to.
+DONE = "done"                    # redeemed (or already claimed)
+EXPIRED = "expired"              # code is no longer redeemable
+INELIGIBLE = "ineligible"        # code is fine, this player just can't redeem it
+RETRY_CAPTCHA = "retry-captcha"  # fetch a fresh captcha and try again
+RELOGIN = "relogin"              # login token is stale
+BACKOFF = "backoff"              # transient; wait and try again
+GIVE_UP = "give-up"              # stop trying this pair
+
+ACTIONS = {DONE, EXPIRED, INELIGIBLE, RETRY_CAPTCHA, RELOGIN, BACKOFF, GIVE_UP}
+RETRYING = {RETRY_CAPTCHA, RELOGIN, BACKOFF}
+
+DEFAULT_RETRIES = 4
+DEFAULT_JITTER = 0.2
+
+# Per-run decision counts, next to the process-wide ones; see track_run()
+_run_stats: ContextVar[defaultdict | None] = ContextVar("policy_run_stats", default=None)
+
+
+def track_run() -> defaultdict:
+    """
+    Count policy decisions made from here on in the current task, and in
+    tasks it starts, into a fresh {outcome: Counter} that is returned. Runs
+    going on at the same time each see only their own decisions.
+    """
+    stats = defaultdict(Counter)
+    _run_stats.set(stats)
+    return stats
+
+
+class Rule:
+    """One compiled error_codes.json entry."""
+
+    __slots__ = ("key", "message", "action", "retries", "backoff_base", "backoff_max", "jitter")
+
+    def __init__(self, key, message, action, retries, backoff_base, backoff_max, jitter):
+        self.key = key
+        self.message = message
+        self.action = action
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+
+    def delay(self, attempt):
+        """Exponential backoff for the given 1-based attempt, capped and jittered."""
+        delay = min(self.backoff_max, self.backoff_base * 2 ** max(0, attempt - 1))
+        if self.jitter:
+            delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return delay
+
+
+def _compile_rule(key, entry):
+    action = entry.get("action")
+    if action is None:
+        # Entries written before actions existed only carry the flags
+        if entry.get("success"):
+            action = DONE
+        elif entry.get("expired"):
+            action = EXPIRED
+        elif entry.get("captcha_error"):
+            action = RETRY_CAPTCHA
+        else:
+            action = BACKOFF
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown action '{action}' for error code {key}")
+
+    backoff_base, backoff_max = entry.get("backoff", [2, 2])
+    return Rule(
+        key=key,
+        message=entry.get("message", f"err_code {key}"),
+        action=action,
+        retries=entry.get("retries", DEFAULT_RETRIES),
+        backoff_base=backoff_base,
+        backoff_max=backoff_max,
+        jitter=entry.get("jitter", DEFAULT_JITTER),
+    )
+
+
+class OutcomePolicy:
+    """
+    Dispatch table compiled from error_codes.json. Maps upstream outcomes
+    (err_code, "Sign Error", missing responses, HTTP 429) to an action with
+    a retry budget and jittered backoff, and counts what happened per outcome.
+    """
+
+    def __init__(self, table):
+        self._rules = {str(key): _compile_rule(str(key), entry) for key, entry in table.items()}
+        self.default = self._rules.get("default") or _compile_rule("default", {})
+        self._stats = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def rule(self, key):
+        return self._rules.get(str(key), self.default)
+
+    def classify(self, result):
+        """Pick the rule for a gift_code/captcha API response (or its absence)."""
+        if not result:
+            return self.rule("no_response")
+        if result.get("msg") == "Sign Error":
+            return self.rule("sign_error")
+        return self.rule(result.get("err_code"))
+
+    def decide(self, rule, attempt):
+        """
+        Return (action, delay) for ``rule`` on the 1-based ``attempt``.
+        Retrying actions turn into GIVE_UP once the rule's budget is spent;
+        delay is None for anything that does not retry.
+        """
+        if isinstance(rule, str):
+            rule = self.rule(rule)
+        run = _run_stats.get()
+        with self._lock:
+            self._count(run, rule.key, "seen")
+            if rule.action not in RETRYING:
+                return rule.action, None
+            if attempt >= rule.retries:
+                self._count(run, rule.key, "give_ups")
+                return GIVE_UP, None
+            self._count(run, rule.key, "retries")
+        return rule.action, rule.delay(attempt)
+
+    def _count(self, run, key, field):
+        self._stats[key][field] += 1
+        if run is not None:
+            run[key][field] += 1
+
+    def next_delay(self, rule, attempt):
+        """Backoff before retrying ``rule`` again, or None when its retry budget is spent."""
+        _, delay = self.decide(rule, attempt)
+        return delay
+
+    def snapshot(self):
+        with self._lock:
+            return {key: dict(counts) for key, counts in self._stats.items()}
+
+
+_policy: OutcomePolicy | None = None
+
+
+def get_policy() -> OutcomePolicy:
+    global _policy
+    if _policy is None:
+        _policy = OutcomePolicy.from_file(settings.ERROR_CODES_FILE)
+    return _policy
@@ -0,0 +1,72 @@
+import time
+from collections import OrderedDict
+
+
+class PlayerSession:
+    """What PlayerAPI needs to sign requests for one logged-in fid, and nothing else."""
+
+    __slots__ = ("fid", "time", "sign", "expires_at", "next_allowed_at", "captcha_pending")
+
+    def __init__(self, fid, time_ms, sign, expires_at, next_allowed_at=0.0):
+        self.fid = fid
+        self.time = time_ms
+        self.sign = sign
+        self.expires_at = expires_at          # time.monotonic() after which the login is considered stale
+        self.next_allowed_at = next_allowed_at  # time.monotonic() of the next allowed captcha/redeem call
+        self.captcha_pending = False          # a captcha was fetched and not yet submitted
+
+    def request_data(self):
+        return {"fid": self.fid, "time": self.time, "sign": self.sign}
+
+
+class PlayerSessionStore:
+    """
+    LRU of PlayerSession records with TTL eviction. Bounded by ``max_size``
+    so a long-lived PlayerAPI serving thousands of players stays flat.
+    """
+
+    def __init__(self, max_size=10000, ttl=1800):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._sessions: OrderedDict[str, PlayerSession] = OrderedDict()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, fid):
+        return self.get(fid) is not None
+
+    def get(self, fid):
+        """Return the live session for ``fid`` (marking it recently used), or None."""
+        session = self._sessions.get(fid)
+        if session is None:
+            return None
+        if session.expires_at <= time.monotonic():
+            del self._sessions[fid]
+            return None
+        self._sessions.move_to_end(fid)
+        return session
+
+    def put(self, fid, time_ms, sign):
+        """Store a fresh login for ``fid``, keeping any cooldown still pending from the previous one."""
+        previous = self._sessions.pop(fid, None)
+        session = PlayerSession(
+            fid, time_ms, sign,
+            expires_at=time.monotonic() + self.ttl,
+            next_allowed_at=previous.next_allowed_at if previous else 0.0,
+        )
+        self._sessions[fid] = session
+        self.evict()
+        return session
+
+    def pop(self, fid):
+        return self._sessions.pop(fid, None)
+
+    def evict(self):
+        """Drop expired sessions from the LRU end and anything beyond ``max_size``."""
+        now = time.monotonic()
+        while self._sessions:
+            fid, oldest = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_size and oldest.expires_at > now:
+                break
+            del self._sessions[fid]
@@ -0,0 +1,23 @@
+import argparse
+from onnxruntime.quantization import QuantType, quantize_dynamic
+from app.utils.captcha_solver import MODEL_VARIANTS
+
+
+def quantize(source="fp32", target="int8"):
+    """Write a dynamically INT8-quantized copy of the ``source`` variant to the ``target`` variant's path."""
+    src = MODEL_VARIANTS[source]["model"]
+    dst = MODEL_VARIANTS[target]["model"]
+    quantize_dynamic(src, dst, weight_type=QuantType.QInt8)
+    return dst
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dynamically quantize the captcha model to INT8.")
+    parser.add_argument("--source", default="fp32")
+    parser.add_argument("--target", default="int8")
+    args = parser.parse_args()
+    print(f"Quantized model written to {quantize(args.source, args.target)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import asyncio
+import time
+
+
+class RateLimiter:
+    """
+    Token bucket shared by everything that calls one upstream host: up to
+    ``burst`` calls at once, refilled at ``rate`` calls per second. A caller
+    that finds the bucket empty reserves the next token (the balance goes
+    negative) and sleeps until it is due, so waiters are served in arrival
+    order without a lock. ``rate`` <= 0 disables the limit.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.waits = 0
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self):
+        """Take a token; return how many seconds to wait before using it."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        self.waits += 1
+        return -self.tokens / self.rate
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def snapshot(self):
+        if self.rate > 0:
+            self._refill()
+        return {"rate": self.rate, "burst": self.burst, "tokens": round(self.tokens, 2), "waits": self.waits}
@@ -0,0 +1,211 @@
+"""
+In-process tracing for batch runs: one span tree per (fid, code) pair.
+
+Spans are only created under an active trace, so the hot paths cost a
+ContextVar lookup when nothing is being traced. Finished spans go to a ring
+buffer (queried by task id via GET /tasks/{task_id}/trace) and, with
+TRACE_FILE set, are appended as JSON lines by a background thread.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# The span new child spans attach to, and the task id new traces are filed under
+_current_span: ContextVar["Span | None"] = ContextVar("trace_span", default=None)
+current_task: ContextVar[str | None] = ContextVar("trace_task", default=None)
+
+
+class Span:
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id", "task_id", "start", "duration", "attrs", "_t0")
+
+    def __init__(self, tracer, name, trace_id, span_id, parent_id, task_id, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.task_id = task_id
+        self.start = time.time()
+        self.duration = None
+        self.attrs = attrs
+        self._t0 = time.perf_counter()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def end(self, **attrs):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._t0
+        self.attrs.update(attrs)
+        self.tracer.record(self)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "task_id": self.task_id,
+            "start": self.start,
+            "duration": self.duration,
+            "attrs": self.attrs,
+        }
+
+
+class _ChildSpan:
+    """Context manager for tracer.span(); a no-op outside a trace."""
+
+    __slots__ = ("tracer", "name", "attrs", "span", "_token")
+
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.span = None
+
+    def __enter__(self):
+        parent = _current_span.get()
+        if parent is None:
+            return None
+        self.span = self.tracer._child(parent, self.name, self.attrs)
+        self._token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.span is None:
+            return False
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.span.attrs["error"] = exc_type.__name__
+        self.span.end()
+        return False
+
+
+class _Activation:
+    __slots__ = ("span", "_token")
+
+    def __init__(self, span):
+        self.span = span
+
+    def __enter__(self):
+        self._token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        return False
+
+
+class _FileExporter:
+    """Appends span dicts to ``path`` as JSON lines from a daemon thread."""
+
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span):
+        self._queue.put(span)
+
+    def _run(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            while (span := self._queue.get()) is not None:
+                f.write(json.dumps(span, default=str) + "\n")
+                if self._queue.empty():
+                    f.flush()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+class Tracer:
+    def __init__(self, max_spans=20000, enabled=True, path=None):
+        self.enabled = enabled
+        self.path = path
+        self.spans: deque[Span] = deque(maxlen=max_spans)
+        self._ids = itertools.count(1)
+        self._exporter: _FileExporter | None = None
+
+    def start_export(self):
+        if self.path and self._exporter is None:
+            self._exporter = _FileExporter(self.path)
+            logger.info(f"Exporting trace spans to {self.path}.")
+
+    def stop_export(self):
+        if self._exporter is not None:
+            self._exporter.close()
+            self._exporter = None
+
+    def start_trace(self, name, **attrs) -> Span | None:
+        """Open a root span (ended by the caller); None while tracing is disabled."""
+        if not self.enabled:
+            return None
+        span_id = str(next(self._ids))
+        return Span(self, name, span_id, span_id, None, current_task.get(), attrs)
+
+    @staticmethod
+    def _child(parent, name, attrs):
+        # Recorded (and numbered) by whichever tracer holds the trace's root
+        owner = parent.tracer
+        return Span(owner, name, parent.trace_id, str(next(owner._ids)), parent.span_id, parent.task_id, attrs)
+
+    def span(self, name, **attrs):
+        """``with tracer.span("captcha", attempt=2) as span:`` a child of the current span, if any."""
+        return _ChildSpan(self, name, attrs)
+
+    def activate(self, span):
+        """Make ``span`` (possibly None) the parent of spans opened inside the ``with`` block."""
+        return _Activation(span)
+
+    def event(self, name, **attrs):
+        """A zero-length child span marking a decision (e.g. a backoff) at this point."""
+        parent = _current_span.get()
+        if parent is not None:
+            self._child(parent, name, attrs).end()
+
+    def annotate(self, **attrs):
+        """Tag the current span, if any."""
+        span = _current_span.get()
+        if span is not None:
+            span.attrs.update(attrs)
+
+    async def sleep(self, delay, reason, **attrs):
+        """asyncio.sleep() recorded as a "sleep" span tagged with why."""
+        with self.span("sleep", reason=reason, delay=round(delay, 3), **attrs):
+            await asyncio.sleep(delay)
+
+    def record(self, span):
+        self.spans.append(span)
+        if self._exporter is not None:
+            self._exporter.export(span.to_dict())
+
+    def for_task(self, task_id) -> list[dict]:
+        """The buffered span trees of ``task_id``, oldest trace first; children nest under "children"."""
+        nodes = {}
+        for span in list(self.spans):
+            if span.task_id == task_id:
+                nodes[span.span_id] = {**span.to_dict(), "children": []}
+
+        roots = []
+        for node in nodes.values():
+            parent = nodes.get(node["parent_id"]) if node["parent_id"] else None
+            (parent["children"] if parent else roots).append(node)
+        for node in nodes.values():
+            node["children"].sort(key=lambda n: n["start"])
+        return sorted(roots, key=lambda n: n["start"])
+
+
+tracer = Tracer(settings.TRACE_BUFFER_SPANS, enabled=settings.TRACE_ENABLED, path=settings.TRACE_FILE)
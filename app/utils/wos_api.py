@@ -3,13 +3,22 @@ import asyncio
 import hashlib
 import time
 import logging
+from contextlib import asynccontextmanager
+from app.core.config import settings
+from app.core.http import create_http_session, get_http_session
+from app.utils.player_sessions import PlayerSessionStore
+from app.utils.outcome_policy import get_policy, RELOGIN, BACKOFF
+from app.utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from app.utils.rate_limiter import RateLimiter
+from app.utils import metrics
+from app.utils.tracing import tracer
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Redemption API endpoint
-URL = "https://wos-giftcode-api.centurygame.com/api"
+# Redemption API endpoint (WOS_API_URL points it at e.g. app/benchmarks/fake_wos_server.py)
+URL = settings.WOS_API_URL
 HTTP_HEADER = {
     "Content-Type": "application/json",
     "Accept": "application/json",
@@ -17,16 +26,193 @@ HTTP_HEADER = {
     "Referer": "https://wos-giftcode.centurygame.com/",
 }
 
+# Per-player pacing (seconds). These used to be in-request sleeps; now they only
+# move the player's "next allowed at" time so callers can serve someone else.
+# Outcome-driven waits (40100, 429, ...) come from the error_codes.json policy.
+CAPTCHA_DELAY = 2                   # after login / a redemption attempt, before the next captcha
+REDEEM_DELAY = 1                    # after fetching a captcha, before submitting it
+UNSOLVED_CAPTCHA_COOLDOWN = 30      # a previous captcha was fetched but never submitted
+
+# One breaker for the upstream host, shared by every PlayerAPI in the process
+upstream_breaker = CircuitBreaker(
+    "wos-giftcode-api",
+    failure_rate=settings.BREAKER_FAILURE_RATE,
+    window=settings.BREAKER_WINDOW,
+    min_calls=settings.BREAKER_MIN_CALLS,
+    open_seconds=settings.BREAKER_OPEN_SECONDS,
+)
+
+# Request budget for the upstream host, shared the same way
+upstream_limiter = RateLimiter(settings.UPSTREAM_RATE_LIMIT, settings.UPSTREAM_RATE_BURST)
+
+
+class PlayerCooldown(Exception):
+    """Raised by non-blocking calls when the player may not hit the API until ``ready_at`` (time.monotonic())."""
+
+    def __init__(self, player_id, ready_at):
+        super().__init__(f"Player {player_id} is cooling down for {ready_at - time.monotonic():.1f}s")
+        self.player_id = player_id
+        self.ready_at = ready_at
+
+
+class UpstreamBackoff(Exception):
+    """
+    Raised by non-blocking get_captcha() when upstream asks the player to
+    back off (e.g. 40100). The caller owns the rule's retry budget across
+    calls, so the backoff is left to it.
+    """
+
+    def __init__(self, player_id, rule):
+        super().__init__(f"Player {player_id} must back off: {rule.message}")
+        self.player_id = player_id
+        self.rule = rule
+
+
+class LoginUnavailable(Exception):
+    """
+    Raised by login_player(raise_unavailable=True) when the login could not
+    be completed for a transient reason (rate limits, network or upstream
+    errors) rather than being rejected by upstream.
+    """
+
+    def __init__(self, player_id):
+        super().__init__(f"Login for player {player_id} is temporarily unavailable")
+        self.player_id = player_id
+
+
+# _login() result when every attempt failed without upstream rejecting the login
+_UNAVAILABLE = object()
+
+
 class PlayerAPI:
-    def __init__(self):
-        self.session = aiohttp.ClientSession()
-        self.players_data = {}  # Stores player_id -> (session data, request data)
+    def __init__(self, session: aiohttp.ClientSession | None = None, base_url: str | None = None):
+        self.base_url = (base_url or URL).rstrip("/")
+        # Prefer the application-scoped pooled session; only own one when running standalone.
+        session = session or get_http_session()
+        self._owns_session = session is None
+        self.session = session or create_http_session()
+        # player_id -> PlayerSession (signing data + cooldown), bounded LRU with TTL
+        self.sessions = PlayerSessionStore(settings.PLAYER_SESSION_MAX, settings.PLAYER_SESSION_TTL)
+        self._inflight_logins: dict[str, asyncio.Future] = {}
+        self.policy = get_policy()
+        self.breaker = upstream_breaker
+        self.limiter = upstream_limiter
+
+    @asynccontextmanager
+    async def _request(self, endpoint, payload, attempt=None):
+        """
+        POST ``payload`` to ``endpoint`` through the circuit breaker and the
+        shared rate limiter. Network errors, timeouts and 5xx count as
+        failures; raises CircuitOpenError without calling upstream while the
+        breaker is open. Traced as a span named after the endpoint.
+        """
+        with tracer.span(endpoint, attempt=attempt) as span:
+            self.breaker.before_call()
+            await self.limiter.acquire()
+            recorded = False
+            start = time.perf_counter()
+            try:
+                async with self.session.post(f"{self.base_url}/{endpoint}", json=payload, headers=HTTP_HEADER) as response:
+                    recorded = True
+                    metrics.upstream_latency.observe(time.perf_counter() - start, endpoint)
+                    metrics.upstream_requests.inc(endpoint, response.status)
+                    if span is not None:
+                        span.set(status=response.status)
+                    if response.status >= 500:
+                        self.breaker.record_failure()
+                    else:
+                        self.breaker.record_success()
+                    yield response
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if not recorded:
+                    metrics.upstream_latency.observe(time.perf_counter() - start, endpoint)
+                    metrics.upstream_requests.inc(endpoint, "error")
+                    self.breaker.record_failure()
+                raise
+
+    @staticmethod
+    async def _json(endpoint, response):
+        """Parse the response body; count its err_code and tag the request's span with it."""
+        body = await response.json()
+        err_code = body.get("err_code", "none") if isinstance(body, dict) else "none"
+        metrics.upstream_results.inc(endpoint, err_code)
+        tracer.annotate(err_code=err_code)
+        return body
+
+    def ready_at(self, player_id):
+        """Monotonic time at which ``player_id`` may make its next captcha/redeem call."""
+        session = self.sessions.get(player_id)
+        return session.next_allowed_at if session else 0.0
+
+    def defer(self, player_id, seconds):
+        """Push the player's next allowed call at least ``seconds`` into the future."""
+        session = self.sessions.get(player_id)
+        if session:
+            session.next_allowed_at = max(session.next_allowed_at, time.monotonic() + seconds)
+
+    async def _wait_turn(self, player_id, wait):
+        """Sleep out the player's cooldown, or raise PlayerCooldown when ``wait`` is False."""
+        while (delay := self.ready_at(player_id) - time.monotonic()) > 0:
+            if not wait:
+                raise PlayerCooldown(player_id, self.ready_at(player_id))
+            await tracer.sleep(delay, "cooldown")
+
+    async def login_player(self, player_id, salt, max_retries=5, refresh=False, raise_unavailable=False):
+        """
+        Logs in a player and stores request data for reuse.
+
+        Returns {"token": <profile>, "request_data": ...} for a fresh login. A
+        cached login only carries "request_data"; pass ``refresh=True`` when
+        the caller needs the current profile.
+
+        Returns None when the login fails. With ``raise_unavailable=True``
+        None means upstream rejected the player, and a login that only failed
+        on rate limits or errors raises LoginUnavailable instead.
+        """
+        result = await self._login_once(player_id, salt, max_retries, refresh)
+        if result is _UNAVAILABLE:
+            if raise_unavailable:
+                raise LoginUnavailable(player_id)
+            return None
+        return result
 
-    async def login_player(self, player_id, salt, max_retries=5):
-        """Logs in a player and stores request data for reuse."""
-        if player_id in self.players_data:
-            return self.players_data[player_id]  # Already logged in
+    async def _login_once(self, player_id, salt, max_retries, refresh):
+        session = None if refresh else self.sessions.get(player_id)
+        if session:
+            return {"request_data": session.request_data()}  # Already logged in
 
+        # Single-flight: concurrent callers for the same fid share one upstream login
+        while (inflight := self._inflight_logins.get(player_id)) is not None:
+            metrics.player_logins.inc("coalesced")
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # The caller doing the login was cancelled, not us: take over
+                if not inflight.cancelled() or asyncio.current_task().cancelling():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight_logins[player_id] = future
+        metrics.player_logins.inc("upstream")
+        try:
+            result = await self._login(player_id, salt, max_retries)
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._inflight_logins.pop(player_id, None)
+
+    async def refresh_login(self, player_id, salt, stale_time):
+        """Re-login after a token error, unless another caller already replaced the login signed at ``stale_time``."""
+        session = self.sessions.get(player_id)
+        if session is not None and session.time != stale_time:
+            return {"request_data": session.request_data()}
+        return await self.login_player(player_id, salt, refresh=True)
+
+    async def _login(self, player_id, salt, max_retries):
         request_data = {
             "fid": player_id,
             "time": int(time.time() * 1000)
@@ -39,141 +225,185 @@ class PlayerAPI:
 
         for attempt in range(1, max_retries + 1):
             try:
-                async with self.session.post(f"{URL}/player", json=request_data, headers=HTTP_HEADER, timeout=30) as response:
+                async with self._request("player", request_data, attempt) as response:
                     if response.status == 429:
-                        logger.warning(f"Player {player_id}: Rate limited (attempt {attempt}). Retrying in {backoff} seconds...")
-                        await asyncio.sleep(backoff)
-                        backoff *= 2
+                        delay = self.policy.next_delay("http_429", attempt)
+                        if delay is None:
+                            break
+                        logger.warning(f"Player {player_id}: Rate limited (attempt {attempt}). Retrying in {delay:.1f} seconds...")
+                        await tracer.sleep(delay, "http_429", attempt=attempt)
                         continue
 
                     response.raise_for_status()
-                    login_response = await response.json()
+                    login_response = await self._json("player", response)
 
                     if login_response.get("msg") != "success":
                         logger.info(f"Login failed for player {player_id}: {login_response}")
                         return None
 
-                    # Cache and return on success
-                    self.players_data[player_id] = {
+                    # Cache the signing data only; the profile goes back to the caller
+                    self.sessions.put(player_id, request_data["time"], request_data["sign"])
+                    self.defer(player_id, CAPTCHA_DELAY)
+                    return {
                         "token": login_response.get("data", {}),
                         "request_data": request_data
                     }
-                    return self.players_data[player_id]
 
+            except CircuitOpenError:
+                raise
             except aiohttp.ClientError as e:
                 logger.info(f"Network error for player {player_id} on attempt {attempt}: {e}")
             except Exception as e:
                 logger.info(f"Unexpected error for player {player_id} on attempt {attempt}: {e}")
 
-            await asyncio.sleep(backoff)
+            await tracer.sleep(backoff, "retry", attempt=attempt)
             backoff *= 2  # Double backoff even on other exceptions
 
         logger.error(f"Login failed after {max_retries} attempts for player {player_id}")
-        return None
+        return _UNAVAILABLE
 
     
-    async def get_captcha(self, player_id, salt, delay=2, max_retries=5):
-        """Get CAPTCHA for a logged-in player with retry logic on rate limits and specific error codes."""
-        if player_id not in self.players_data:
+    async def get_captcha(self, player_id, salt, max_retries=5, wait=True):
+        """
+        Get CAPTCHA for a logged-in player with retry logic on rate limits and specific error codes.
+
+        With ``wait=False`` the call never sleeps out a player cooldown; it raises
+        PlayerCooldown carrying the time the player becomes ready instead, and
+        UpstreamBackoff when upstream answers with a backoff outcome.
+        """
+        session = self.sessions.get(player_id)
+        if session is None:
             logger.info(f"Error: Player {player_id} is not logged in.")
             return None
 
-        # Wait longer if CAPTCHA is already being solved
-        await asyncio.sleep(30 if 'to_solve' in self.players_data[player_id] else delay)
+        # A captcha that was fetched but never submitted needs a longer pause before the next one
+        if session.captcha_pending:
+            session.captcha_pending = False
+            self.defer(player_id, UNSOLVED_CAPTCHA_COOLDOWN)
 
-        request_data = self.players_data[player_id]["request_data"].copy()
         backoff = 1
 
         for attempt in range(1, max_retries + 1):
+            await self._wait_turn(player_id, wait)
+            session = self.sessions.get(player_id)
+            if session is None:
+                logger.info(f"Session for player {player_id} was evicted; logging in again.")
+                if not await self.login_player(player_id, salt):
+                    return None
+                continue
+            request_data = session.request_data()
             try:
-                async with self.session.post(f"{URL}/captcha", json=request_data, headers=HTTP_HEADER, timeout=30) as response:
+                async with self._request("captcha", request_data, attempt) as response:
                     if response.status == 429:
-                        logger.warning(f"Player {player_id}: Rate limited (attempt {attempt}). Retrying in {backoff} seconds...")
-                        await asyncio.sleep(backoff)
-                        backoff *= 2
+                        delay = self.policy.next_delay("http_429", attempt)
+                        if delay is None:
+                            break
+                        logger.warning(f"Player {player_id}: Rate limited (attempt {attempt}). Retrying in {delay:.1f} seconds...")
+                        await tracer.sleep(delay, "http_429", attempt=attempt)
                         continue
 
                     response.raise_for_status()
-                    captcha_response = await response.json()
+                    captcha_response = await self._json("captcha", response)
+
+                    if captcha_response.get("msg") != "SUCCESS":
+                        rule = self.policy.classify(captcha_response)
+                        if rule.action in (RELOGIN, BACKOFF) and rule is not self.policy.default:
+                            if rule.action == BACKOFF and not wait:
+                                raise UpstreamBackoff(player_id, rule)
+                            action, delay = self.policy.decide(rule, attempt)
+                            if action == RELOGIN:
+                                logger.info(f"Token expired for {player_id}. Re-logging in.")
+                                if not await self.refresh_login(player_id, salt, request_data["time"]):
+                                    return None
+                                continue
+                            if action == BACKOFF:
+                                logger.info(f"{rule.message} Player {player_id} cooling down {delay:.0f}s.")
+                                self.defer(player_id, delay)
+                                continue
 
-                    err_code = captcha_response.get("err_code")
-                    msg = captcha_response.get("msg")
-
-                    if err_code == 40009:
-                        logger.info(f"Token expired for {player_id}. Re-logging in.")
-                        self.players_data.pop(player_id, None)
-                        await self.login_player(player_id, salt)
-                        continue
-
-                    if err_code == 40100:
-                        logger.info(f"Captcha Get too Frequent for {player_id}. Waiting 60s.")
-                        await asyncio.sleep(30)
-                        continue
-
-                    if msg != "SUCCESS":
                         logger.info(f"Captcha retrieval failed for player {player_id}: {captcha_response}")
                         return None
 
-                    self.players_data[player_id]["to_solve"] = captcha_response
+                    session.captcha_pending = True
+                    self.defer(player_id, REDEEM_DELAY)
                     return captcha_response  # Success
 
+            except (CircuitOpenError, UpstreamBackoff):
+                raise
             except aiohttp.ClientError as e:
                 logger.info(f"Captcha - Network error for player {player_id} on attempt {attempt}: {e}")
             except Exception as e:
                 logger.info(f"Captcha - Unexpected error for player {player_id} on attempt {attempt}: {e}")
 
-            await asyncio.sleep(backoff)
+            await tracer.sleep(backoff, "retry", attempt=attempt)
             backoff *= 2
 
         logger.error(f"Failed to retrieve CAPTCHA for player {player_id} after {max_retries} attempts.")
         return None
 
 
-    async def redeem_code(self, player_id, code, captcha_solution, salt, delay=1, max_retries=5):
-        """Redeems a gift code for a logged-in player with retry logic on rate limits."""
-        if player_id not in self.players_data:
+    async def redeem_code(self, player_id, code, captcha_solution, salt, max_retries=5, wait=True):
+        """
+        Redeems a gift code for a logged-in player with retry logic on rate limits.
+
+        ``wait`` behaves as in get_captcha().
+        """
+        if self.sessions.get(player_id) is None:
             logger.info(f"Error: Player {player_id} is not logged in.")
             return None
 
-        await asyncio.sleep(delay)
-        base_request_data = self.players_data[player_id]["request_data"].copy()
+        await self._wait_turn(player_id, wait)
+        session = self.sessions.get(player_id)
+        if session is None:
+            logger.info(f"Session for player {player_id} expired before redemption.")
+            return None
+        session.captcha_pending = False
+        base_request_data = session.request_data()
         base_request_data["cdk"] = code
 
         backoff = 1
 
-        for attempt in range(1, max_retries + 1):
-            try:
-                request_data = base_request_data.copy()
-                request_data["captcha_code"] = captcha_solution
-                request_data["sign"] = hashlib.md5(
-                    f"captcha_code={request_data['captcha_code']}&cdk={request_data['cdk']}&fid={request_data['fid']}&time={request_data['time']}{salt}".encode("utf-8")
-                ).hexdigest()
-
-                async with self.session.post(f"{URL}/gift_code", json=request_data, headers=HTTP_HEADER, timeout=30) as response:
-                    if response.status == 429:
-                        logger.warning(f"Player {player_id}: Rate limited (attempt {attempt}). Retrying in {backoff} seconds...")
-                        await asyncio.sleep(backoff)
-                        backoff *= 2
-                        continue
-
-                    response.raise_for_status()
-                    return await response.json()  # Success
-
-            except aiohttp.ClientError as e:
-                logger.warning(f"Network error during redemption for player {player_id} (attempt {attempt}): {e}")
-            except Exception as e:
-                logger.warning(f"Unexpected error during redemption for player {player_id} (attempt {attempt}): {e}")
-
-            await asyncio.sleep(backoff)
-            backoff *= 2
-
-        logger.error(f"Failed to redeem code for player {player_id} after {max_retries} attempts.")
-        return None
+        try:
+            for attempt in range(1, max_retries + 1):
+                try:
+                    request_data = base_request_data.copy()
+                    request_data["captcha_code"] = captcha_solution
+                    request_data["sign"] = hashlib.md5(
+                        f"captcha_code={request_data['captcha_code']}&cdk={request_data['cdk']}&fid={request_data['fid']}&time={request_data['time']}{salt}".encode("utf-8")
+                    ).hexdigest()
+
+                    async with self._request("gift_code", request_data, attempt) as response:
+                        if response.status == 429:
+                            delay = self.policy.next_delay("http_429", attempt)
+                            if delay is None:
+                                break
+                            logger.warning(f"Player {player_id}: Rate limited (attempt {attempt}). Retrying in {delay:.1f} seconds...")
+                            await tracer.sleep(delay, "http_429", attempt=attempt)
+                            continue
+
+                        response.raise_for_status()
+                        return await self._json("gift_code", response)  # Success
+
+                except CircuitOpenError:
+                    raise
+                except aiohttp.ClientError as e:
+                    logger.warning(f"Network error during redemption for player {player_id} (attempt {attempt}): {e}")
+                except Exception as e:
+                    logger.warning(f"Unexpected error during redemption for player {player_id} (attempt {attempt}): {e}")
+
+                await tracer.sleep(backoff, "retry", attempt=attempt)
+                backoff *= 2
+
+            logger.error(f"Failed to redeem code for player {player_id} after {max_retries} attempts.")
+            return None
+        finally:
+            self.defer(player_id, CAPTCHA_DELAY)
 
 
     async def close_session(self):
-        """Closes the session when done."""
-        await self.session.close()
+        """Closes the session when done (a shared session is left to lifespan)."""
+        if self._owns_session:
+            await self.session.close()
 
 async def main():
     pass